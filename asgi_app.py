@@ -0,0 +1,164 @@
+"""
+ASGI front-end for the TTS server
+
+Serves the same API as server.py from an event loop, so status polls, progress
+events and downloads are answered promptly while inference keeps the workers
+busy:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+/synthesize, /job/<job_id> (status and downloads), /job/<job_id>/events,
+/status, /healthz, /readyz and /metrics are served natively. Their blocking
+work (audio cache reads, transcoding, reading spilled results) runs in a
+thread pool. Every other route (voices, cleanup, memory settings, streaming
+synthesis and the web page) is handed to the Flask app on its own threads.
+"""
+import contextlib
+import json
+import logging
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_range_header
+
+import server
+from job_events import KEEPALIVE
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Every queued or running job may hold a Flask thread for a streamed response, plus a few for the rest
+WSGI_THREADS = server.QUEUE_MAX_SIZE + server.INFERENCE_WORKERS + 4
+
+
+async def synthesize(request):
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        return JSONResponse({'error': 'Request body is not valid JSON'}, 400)
+
+    try:
+        # The audio cache may read from disk, so keep it off the event loop
+        payload, status_code, headers = await run_in_threadpool(server.submit_synthesis, data)
+        return JSONResponse(payload, status_code, headers)
+    except Exception as e:
+        logger.error(f"Error in synthesis: {str(e)}")
+        logger.error("Stack trace:", exc_info=True)
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def get_job_status(request):
+    """Get the status of a speech generation job, or download its audio"""
+    job_id = request.path_params['job_id']
+    try:
+        job = server.active_jobs.get(job_id)
+        if job is None:
+            return JSONResponse({'error': 'Job not found'}, 404)
+
+        if job['status'] == 'completed' and request.query_params.get('download') == 'true':
+            accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+            try:
+                # The first download in a new format encodes it
+                result, download_name = await run_in_threadpool(
+                    server.prepare_download, job_id, job, request.query_params.get('format'), accept
+                )
+            except server.DownloadError as e:
+                return JSONResponse({'error': str(e)}, e.status_code)
+
+            start, end, status_code, headers = server.plan_download(
+                result, download_name, parse_range_header(request.headers.get('range'))
+            )
+            if status_code == 416:
+                return Response(status_code=416, headers=headers)
+            # A plain iterator is read on the thread pool, so spilled results page in off the loop
+            return StreamingResponse(
+                server.send_result(result, start, end),
+                status_code=status_code,
+                headers=headers,
+                media_type=result.mimetype
+            )
+
+        return JSONResponse(server.job_status(job_id, job))
+
+    except Exception as e:
+        logger.error(f"Error getting job status: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def get_job_events(request):
+    """Push a job's status changes and progress as Server-Sent Events until it finishes"""
+    job_id = request.path_params['job_id']
+    if job_id not in server.active_jobs:
+        return JSONResponse({'error': 'Job not found'}, 404)
+
+    async def stream():
+        sent = {}
+        while True:
+            version = server.job_events.version
+            messages, finished = server.job_event_messages(job_id, sent)
+            for message in messages:
+                yield message
+            if finished:
+                return
+            # Waiting listeners cost a coroutine each, not a thread
+            if await server.job_events.wait_async(version, server.EVENTS_KEEPALIVE_SECONDS) == version:
+                yield KEEPALIVE
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers=server.EVENT_STREAM_HEADERS)
+
+
+async def get_status(request):
+    try:
+        return JSONResponse(server.server_status())
+    except Exception as e:
+        logger.error(f"Error in get_status: {str(e)}")
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def healthz(request):
+    return JSONResponse({'status': 'ok', 'uptime_seconds': time.perf_counter() - server.STARTUP_BEGAN})
+
+
+async def readyz(request):
+    return JSONResponse(server.startup_state, 200 if server.startup_state['ready'] else 503)
+
+
+async def get_metrics(request):
+    return Response(server.metrics_registry.render(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Load the model in the background so /healthz answers while it loads
+    server.load_model_in_background()
+    yield
+    if isinstance(server.current_generator, server.ReplicaPool):
+        server.current_generator.shutdown()
+
+
+app = Starlette(
+    routes=[
+        Route('/synthesize', synthesize, methods=['POST']),
+        Route('/job/{job_id}', get_job_status, methods=['GET']),
+        Route('/job/{job_id}/events', get_job_events, methods=['GET']),
+        Route('/status', get_status, methods=['GET']),
+        Route('/healthz', healthz, methods=['GET']),
+        Route('/readyz', readyz, methods=['GET']),
+        Route('/metrics', get_metrics, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(server.app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    logger.info("Starting CSM TTS server (ASGI)...")
+    uvicorn.run(app, host='0.0.0.0', port=server.PORT)
@@ -0,0 +1,162 @@
+"""
+Content-addressed cache of synthesized audio with an in-memory and an on-disk tier
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+import unicodedata
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """Normalize unicode and whitespace so trivially different prompts share an entry"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_cache_key(text, speaker_id, speed, temperature, topk, model_id, seed=None):
+    """Hash the parameters that determine the generated audio"""
+    payload = json.dumps({
+        'text': normalize_text(text),
+        'speaker': speaker_id,
+        'speed': round(float(speed), 4),
+        'temperature': round(float(temperature), 4),
+        'topk': int(topk),
+        'model': model_id,
+        'seed': seed,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Two-tier LRU cache mapping cache keys to encoded audio bytes.
+
+    Entries are written to both tiers. Each tier evicts its least recently
+    used entries once it exceeds its byte budget, and a disk hit is promoted
+    back into memory. The disk tier survives restarts.
+    """
+
+    def __init__(self, memory_budget_bytes, disk_budget_bytes, disk_dir):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.disk_budget_bytes = disk_budget_bytes
+        self.disk_dir = disk_dir
+
+        self._memory = collections.OrderedDict()
+        self._memory_bytes = 0
+        self._disk = collections.OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.disk_budget_bytes > 0:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _load_disk_index(self):
+        """Rebuild the disk tier's LRU order from file modification times"""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-len(".bin")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+        if self._disk:
+            logger.info(f"Loaded {len(self._disk)} cached audio entries from {self.disk_dir}")
+
+    def get(self, key):
+        """Return cached bytes for a key, or None on a miss"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.hits += 1
+                return data
+
+            if key in self._disk:
+                try:
+                    with open(self._disk_path(key), "rb") as f:
+                        data = f.read()
+                except OSError as e:
+                    logger.warning(f"Dropping unreadable cache entry {key}: {str(e)}")
+                    self._disk_bytes -= self._disk.pop(key)
+                else:
+                    self._disk.move_to_end(key)
+                    self._put_memory(key, data)
+                    self.hits += 1
+                    return data
+
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        """Store bytes for a key in both tiers"""
+        with self._lock:
+            self._put_memory(key, data)
+            self._put_disk(key, data)
+
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_budget_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_budget_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _put_disk(self, key, data):
+        if len(data) > self.disk_budget_bytes or key in self._disk:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {str(e)}")
+            return
+        self._disk[key] = len(data)
+        self._disk_bytes += len(data)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_budget_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.unlink(self._disk_path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Return hit rate and tier sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+            }
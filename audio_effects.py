@@ -0,0 +1,263 @@
+"""
+Post-processing applied to generated audio
+"""
+import functools
+import math
+
+import torch
+
+# Analysis frame of roughly 40ms, the usual choice for speech
+FRAME_SECONDS = 0.04
+
+# Four analysis frames overlap at any point, enough for a Hann window to reconstruct cleanly
+OVERLAP = 4
+
+# Speeds requests may ask for; further out the phase vocoder smears speech noticeably
+MIN_SPEED = 0.5
+MAX_SPEED = 2.0
+
+
+@functools.lru_cache(maxsize=16)
+def _stretch_plan(sample_rate, device):
+    """STFT size, hop, window, per-bin phase advance and bin indices for one sample rate and device"""
+    n_fft = 1 << math.ceil(math.log2(sample_rate * FRAME_SECONDS))
+    hop_length = n_fft // OVERLAP
+    window = torch.hann_window(n_fft, device=device)
+    phase_advance = torch.linspace(0, math.pi * hop_length, n_fft // 2 + 1, device=device)
+    # int32 halves the cost of the peak search's cummax over int64
+    bins = torch.arange(n_fft // 2 + 1, dtype=torch.int32, device=device)
+    return n_fft, hop_length, window, phase_advance, bins
+
+
+def _nearest_peak(magnitude, bins):
+    """Index of the closest spectral peak for every bin of every frame, with bins on the last dim"""
+    floor = magnitude.new_full(magnitude[..., :1].shape, -1.0)
+    lower = torch.cat([floor, magnitude[..., :-1]], dim=-1)
+    higher = torch.cat([magnitude[..., 1:], floor], dim=-1)
+    is_peak = (magnitude >= lower) & (magnitude > higher)
+
+    num_bins = bins.shape[0]
+    below = torch.where(is_peak, bins, -num_bins).cummax(dim=-1).values
+    above = torch.where(is_peak, bins, 2 * num_bins).flip(-1).cummin(dim=-1).values.flip(-1)
+    return torch.where(bins - below <= above - bins, below, above).long()
+
+
+def _phase_vocoder(spectrum, rate, phase_advance, bins):
+    """
+    Resample the frames of a complex spectrogram at ``rate`` while keeping
+    each bin's phase advancing at its measured frequency.
+
+    Phases are accumulated per bin and then locked to the nearest spectral
+    peak, so bins belonging to one partial stay in phase with each other.
+    Without the locking, slowed-down audio partly cancels itself.
+    """
+    # Frames-major, so per-frame work runs over contiguous bins
+    spectrum = torch.nn.functional.pad(spectrum, [0, 1]).transpose(-1, -2)
+    magnitude = spectrum.abs()
+    angle = spectrum.angle()
+    peak = _nearest_peak(magnitude, bins)
+
+    steps = torch.arange(0, spectrum.shape[-2] - 1, rate, device=spectrum.device)
+    index = steps.long()
+    weight = (steps - index)[:, None]
+    angle_before = angle[..., index, :]
+    advance = angle[..., index + 1, :] - angle_before - phase_advance
+    advance = advance - 2 * math.pi * torch.round(advance / (2 * math.pi)) + phase_advance
+    phase = torch.cat([angle_before[..., :1, :], advance[..., :-1, :]], dim=-2).cumsum(dim=-2)
+
+    peak = peak[..., index, :]
+    phase = phase.gather(-1, peak) + angle_before - angle_before.gather(-1, peak)
+    magnitude = torch.lerp(magnitude[..., index, :], magnitude[..., index + 1, :], weight)
+    return torch.polar(magnitude, phase).transpose(-1, -2)
+
+
+def stretched_length(num_samples, speed):
+    """Number of samples a clip of ``num_samples`` has after ``time_stretch``"""
+    return int(round(num_samples / speed))
+
+
+def time_stretch(clips, sample_rate, speed):
+    """
+    Change the tempo of one or more clips without changing their pitch.
+
+    ``speed`` above 1.0 makes speech faster and shorter. The clips may have
+    different lengths; they are padded and stretched together in one batched
+    phase vocoder pass, then each is trimmed to its own stretched length.
+    """
+    if speed == 1.0 or not clips:
+        return list(clips)
+
+    device = clips[0].device
+    n_fft, hop_length, window, phase_advance, bins = _stretch_plan(sample_rate, device)
+    lengths = [clip.shape[-1] for clip in clips]
+    # Every clip is followed by at least a frame of silence, so its stretched
+    # samples do not depend on which other clips share the batch
+    padded = max(lengths) + n_fft
+    batch = torch.zeros(len(clips), padded, device=device)
+    for row, clip in enumerate(clips):
+        batch[row, :clip.shape[-1]] = clip.float()
+
+    spectrum = torch.stft(batch, n_fft, hop_length, window=window, return_complex=True)
+    spectrum = _phase_vocoder(spectrum, speed, phase_advance, bins)
+    stretched = torch.istft(
+        spectrum, n_fft, hop_length, window=window, length=stretched_length(padded, speed)
+    )
+    return [
+        stretched[row, :stretched_length(length, speed)].to(clip.dtype)
+        for row, (clip, length) in enumerate(zip(clips, lengths))
+    ]
+
+
+def apply_speed(audio, sample_rate, speed):
+    """Change the speed of the audio while keeping its pitch"""
+    if speed == 1.0:
+        return audio
+    return time_stretch([audio], sample_rate, speed)[0]
+
+
+
+def _overlap_add(frames, hop_length):
+    """Sum (num_frames, frame_length) frames placed ``hop_length`` apart"""
+    num_frames, frame_length = frames.shape
+    length = (num_frames - 1) * hop_length + frame_length
+    return torch.nn.functional.fold(
+        frames.T.unsqueeze(0), output_size=(1, length), kernel_size=(1, frame_length), stride=(1, hop_length)
+    ).reshape(length)
+
+
+class TimeStretcher:
+    """
+    ``time_stretch`` for audio that arrives in chunks, such as a stream or a long document.
+
+    Stretching every chunk on its own restarts the phase vocoder at each
+    boundary, so the phases jump and the join clicks. This keeps the
+    analysis frames still needed, the running phase of every bin and the
+    overlap-add tail between calls instead. ``process`` returns the output
+    samples that no later input can change and ``flush`` the rest, so
+    however the input is split, the joined output is the same single
+    stretch of the whole. Each call handles all of its frames in one batch.
+    """
+
+    def __init__(self, sample_rate, speed, device='cpu'):
+        self.speed = speed
+        device = torch.device(device)
+        self.n_fft, self.hop_length, self.window, self.phase_advance, self.bins = _stretch_plan(sample_rate, device)
+        self._wrapped_advance = torch.remainder(self.phase_advance, 2 * math.pi)
+        half = self.n_fft // 2
+        # Input from sample ``_input_start`` on; it gains torch.stft's reflected centre padding once long enough
+        self._input = torch.zeros(0, device=device)
+        self._input_start = 0
+        self._received = 0
+        # Analysis frames from index ``_spectra_start`` on
+        self._spectra = torch.zeros(0, self.n_fft // 2 + 1, dtype=torch.complex64, device=device)
+        self._spectra_start = 0
+        self._output_frames = 0
+        self._phase = None
+        # Overlap-add sums and window envelope, from output sample ``_output_start`` on
+        self._output = torch.zeros(0, device=device)
+        self._envelope = torch.zeros(0, device=device)
+        self._output_start = 0
+        # torch.istft drops the first half frame of a centred transform
+        self._skip = half
+        self._emitted = 0
+
+    def process(self, audio):
+        """Add the next chunk of input and return the stretched samples that are now final"""
+        if self.speed == 1.0:
+            return audio
+        self._received += audio.shape[-1]
+        self._input = torch.cat([self._input, audio.float().to(self._input.device)])
+        self._analyse()
+        return self._emit(self._output_frames * self.hop_length).to(audio.dtype)
+
+    def flush(self):
+        """Return the rest of the output once the input has ended"""
+        if self.speed == 1.0:
+            return torch.zeros(0)
+        # The same trailing silence time_stretch pads with, so the last input samples are fully synthesized
+        self._input = torch.cat([self._input, self._input.new_zeros(self.n_fft + self.n_fft // 2)])
+        self._analyse(final=True)
+        remaining = max(0, stretched_length(self._received, self.speed) - self._emitted)
+        audio = self._emit(self._output_start + self._output.shape[0])[:remaining]
+        return torch.cat([audio, audio.new_zeros(remaining - audio.shape[0])])
+
+    def _analyse(self, final=False):
+        """Compute the analysis frames the input now covers, then every output frame they allow"""
+        half = self.n_fft // 2
+        if self._input_start == 0:
+            if self._input.shape[0] <= half:
+                return
+            self._input = torch.cat([self._input[1:half + 1].flip(0), self._input])
+            self._input_start = -half
+
+        next_frame = self._spectra_start + self._spectra.shape[0]
+        offset = next_frame * self.hop_length - half - self._input_start
+        count = (self._input.shape[0] - offset - self.n_fft) // self.hop_length + 1
+        if count > 0:
+            segments = self._input[offset:].unfold(0, self.n_fft, self.hop_length)[:count]
+            self._spectra = torch.cat([self._spectra, torch.fft.rfft(segments * self.window)])
+        if final:
+            # time_stretch pads the spectrogram with one silent frame to interpolate towards
+            self._spectra = torch.cat([self._spectra, torch.zeros_like(self._spectra[:1])])
+
+        # Output frame j sits between analysis frames floor(j * speed) and the one after it
+        next_frame = self._spectra_start + self._spectra.shape[0]
+        last = math.ceil((next_frame - 1) / self.speed)
+        if last > self._output_frames:
+            self._synthesize(torch.arange(self._output_frames, last, dtype=torch.float64) * self.speed)
+
+        # Drop the analysis frames and input that no later output frame reaches
+        needed = int(self._output_frames * self.speed)
+        self._spectra = self._spectra[needed - self._spectra_start:]
+        self._spectra_start = needed
+        keep_from = needed * self.hop_length - half
+        if keep_from > self._input_start:
+            self._input = self._input[keep_from - self._input_start:]
+            self._input_start = keep_from
+
+    def _synthesize(self, steps):
+        """Overlap-add the output frames at ``steps``, in analysis frames, as _phase_vocoder does"""
+        index = steps.long()
+        weight = (steps - index).float()[:, None].to(self._spectra.device)
+        index = (index - self._spectra_start).to(self._spectra.device)
+        before, after = self._spectra[index], self._spectra[index + 1]
+        angle_before = before.angle()
+        magnitude_before = before.abs()
+
+        advance = after.angle() - angle_before - self.phase_advance
+        # Whole turns are dropped from the advance and the carried phase, so precision holds however long the input
+        advance = advance - 2 * math.pi * torch.round(advance / (2 * math.pi)) + self._wrapped_advance
+        start = angle_before[:1] if self._phase is None else self._phase[None]
+        phase = torch.cat([start, advance[:-1]]).cumsum(dim=0)
+        self._phase = torch.remainder(phase[-1] + advance[-1], 2 * math.pi)
+
+        peak = _nearest_peak(magnitude_before, self.bins)
+        phase = phase.gather(-1, peak) + angle_before - angle_before.gather(-1, peak)
+        magnitude = torch.lerp(magnitude_before, after.abs(), weight)
+        frames = torch.fft.irfft(torch.polar(magnitude, phase), n=self.n_fft) * self.window
+
+        position = self._output_frames * self.hop_length - self._output_start
+        added = _overlap_add(frames, self.hop_length)
+        envelope = _overlap_add((self.window ** 2).expand(frames.shape[0], -1), self.hop_length)
+        end = position + added.shape[0]
+        if end > self._output.shape[0]:
+            grow = end - self._output.shape[0]
+            self._output = torch.cat([self._output, self._output.new_zeros(grow)])
+            self._envelope = torch.cat([self._envelope, self._envelope.new_zeros(grow)])
+        self._output[position:end] += added
+        self._envelope[position:end] += envelope
+        self._output_frames += steps.shape[0]
+
+    def _emit(self, until):
+        """Normalise and hand out the output samples before ``until``, minus the centre trim"""
+        count = until - self._output_start
+        output, envelope = self._output[:count], self._envelope[:count]
+        audio = torch.where(envelope > 1e-11, output / envelope.clamp(min=1e-11), torch.zeros_like(output))
+        self._output, self._envelope = self._output[count:], self._envelope[count:]
+        self._output_start = until
+
+        skipped = min(self._skip, audio.shape[0])
+        self._skip -= skipped
+        audio = audio[skipped:]
+        self._emitted += audio.shape[0]
+        return audio
@@ -0,0 +1,92 @@
+"""
+Output formats for generated audio and content negotiation between them
+"""
+import io
+import logging
+
+import soundfile as sf
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Canonical format the generator output is stored in
+DEFAULT_FORMAT = 'wav'
+
+# name -> (libsndfile container, subtype, mimetype, file extension)
+_CANDIDATE_FORMATS = {
+    'wav': ('WAV', 'FLOAT', 'audio/wav', 'wav'),
+    'wav16': ('WAV', 'PCM_16', 'audio/wav', 'wav'),
+    'flac': ('FLAC', 'PCM_16', 'audio/flac', 'flac'),
+    'ogg': ('OGG', 'VORBIS', 'audio/ogg', 'ogg'),
+    'opus': ('OGG', 'OPUS', 'audio/ogg; codecs=opus', 'opus'),
+    'mp3': ('MP3', 'MPEG_LAYER_III', 'audio/mpeg', 'mp3'),
+}
+
+
+def _available_formats():
+    """Keep only the formats the installed libsndfile can write"""
+    containers = sf.available_formats()
+    formats = {}
+    for name, spec in _CANDIDATE_FORMATS.items():
+        container, subtype = spec[0], spec[1]
+        if container in containers and subtype in sf.available_subtypes(container):
+            formats[name] = spec
+    return formats
+
+
+FORMATS = _available_formats()
+
+# Accept-header mimetypes in order of preference; the canonical WAV wins ties like */*
+_ACCEPT_TYPES = [
+    ('audio/wav', 'wav'),
+    ('audio/x-wav', 'wav'),
+    ('audio/wave', 'wav'),
+    ('audio/flac', 'flac'),
+    ('audio/x-flac', 'flac'),
+    ('audio/ogg', 'ogg'),
+    ('audio/opus', 'opus'),
+    ('audio/mpeg', 'mp3'),
+]
+
+
+def negotiate_format(requested, accept_mimetypes=None):
+    """
+    Pick an output format from an explicit ``format`` parameter or the Accept header.
+
+    Raises ValueError for an unknown or unavailable explicit format. An Accept
+    header that matches nothing falls back to the canonical WAV.
+    """
+    if requested:
+        requested = requested.lower()
+        if requested not in FORMATS:
+            raise ValueError(f"Unsupported format '{requested}', choose from: {', '.join(FORMATS)}")
+        return requested
+
+    if accept_mimetypes:
+        offered = [mimetype for mimetype, name in _ACCEPT_TYPES if name in FORMATS]
+        best = accept_mimetypes.best_match(offered)
+        if best is not None:
+            return dict(_ACCEPT_TYPES)[best]
+    return DEFAULT_FORMAT
+
+
+def mimetype_for(name):
+    return FORMATS[name][2]
+
+
+def extension_for(name):
+    return FORMATS[name][3]
+
+
+def encode_audio(audio, sample_rate, name):
+    """Encode a mono float waveform (numpy array) into the named format"""
+    container, subtype = FORMATS[name][0], FORMATS[name][1]
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, format=container, subtype=subtype)
+    return buffer.getbuffer()
+
+
+def transcode(data, name):
+    """Re-encode stored audio (any format libsndfile reads) into the named format"""
+    audio, sample_rate = sf.read(io.BytesIO(data), dtype='float32')
+    return encode_audio(audio, sample_rate, name)
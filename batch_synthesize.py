@@ -0,0 +1,388 @@
+"""
+Offline synthesis of a JSONL manifest, resumable after an interruption
+
+Each manifest line is a JSON object with ``text`` and ``output`` (a path,
+relative to the manifest's directory unless absolute) and optionally
+``speaker``, ``speed``, ``temperature``, ``topk`` and ``seed``:
+
+    {"text": "Thanks for calling.", "speaker": 0, "output": "clips/greeting.wav"}
+
+    python batch_synthesize.py manifest.jsonl [--replicas 4] [--batch-size 4] [--device cpu]
+
+Requests are generated concurrently so the batching engine (or each replica)
+fills its batches. Every output is written to a temporary file and renamed
+into place, then recorded in a journal next to the manifest. A rerun skips
+entries whose output is still on disk with the content hash in the journal
+and was made from the same text and settings, so an interrupted run resumes
+where it stopped.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import soundfile as sf
+
+# Add the CSM directory to the path
+sys.path.append('../csm')
+
+from audio_cache import make_cache_key
+from audio_effects import MAX_SPEED, MIN_SPEED, apply_speed
+from audio_encoding import FORMATS, encode_audio, transcode
+from batching import BatchingEngine
+from csm_generator import FRAME_MS, QUANTIZATION_MODES, load_csm_generator, model_id_for
+from duration_estimator import DurationEstimator
+from long_form import LongFormSynthesizer
+from replica_pool import ReplicaPool
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Output file extension -> audio_encoding format
+EXTENSION_FORMATS = {'.wav': 'wav', '.flac': 'flac', '.ogg': 'ogg', '.opus': 'opus', '.mp3': 'mp3'}
+
+# Text longer than this is generated sentence by sentence, as the server does
+LONG_FORM_CHARS = 300
+
+
+def load_manifest(path):
+    """Read and validate a manifest, returning its entries with defaults filled in and output paths resolved"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    entries, outputs = [], set()
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: not valid JSON ({e})")
+            if not isinstance(data, dict):
+                raise ValueError(f"{path}:{line_number}: every entry must be a JSON object")
+            text, output = data.get('text'), data.get('output')
+            if not isinstance(text, str) or not text.strip() or not isinstance(output, str) or not output:
+                raise ValueError(f"{path}:{line_number}: every entry needs a text and an output")
+
+            output = os.path.join(base_dir, output)
+            extension = os.path.splitext(output)[1].lower()
+            if EXTENSION_FORMATS.get(extension) not in FORMATS:
+                raise ValueError(f"{path}:{line_number}: cannot write {extension or 'extensionless'} files")
+            if output in outputs:
+                raise ValueError(f"{path}:{line_number}: {data['output']} is written by an earlier entry")
+            outputs.add(output)
+
+            try:
+                entries.append({
+                    'line': line_number,
+                    'text': text.strip(),
+                    'speaker': int(data.get('speaker', 0)),
+                    'speed': float(data.get('speed', 1.0)),
+                    'temperature': float(data.get('temperature', 0.9)),
+                    'topk': int(data.get('topk', 50)),
+                    'seed': int(data['seed']) if data.get('seed') is not None else None,
+                    'output': output,
+                    'format': EXTENSION_FORMATS[extension],
+                })
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"{path}:{line_number}: invalid setting ({e})")
+            if not MIN_SPEED <= entries[-1]['speed'] <= MAX_SPEED:
+                raise ValueError(f"{path}:{line_number}: speed must be between {MIN_SPEED} and {MAX_SPEED}")
+    return entries
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def temp_path_for(output, extension):
+    """A hidden file beside ``output``, so the final rename stays on one filesystem"""
+    directory, name = os.path.split(output)
+    return os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.part{extension}")
+
+
+def write_atomic(output, data):
+    """Write ``data`` to ``output`` so readers see either the old file or the complete new one"""
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp_path = temp_path_for(output, '')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class Journal:
+    """
+    Append-only record of finished outputs, one JSON line per output.
+
+    Each line is flushed and synced before the entry counts as done, so after
+    a crash the journal never claims more than was written. A torn last line
+    is ignored, and a later line for the same output replaces an earlier one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.records[record['output']] = record
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def is_done(self, output, key):
+        """Whether ``output`` exists with the hash recorded for it, generated from settings hashing to ``key``"""
+        record = self.records.get(output)
+        if record is None or record['key'] != key or not os.path.exists(output):
+            return False
+        return file_sha256(output) == record['sha256']
+
+    def record(self, output, key, sha256, audio_seconds):
+        record = {'output': output, 'key': key, 'sha256': sha256, 'audio_seconds': audio_seconds,
+                  'finished_at': time.time()}
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.records[output] = record
+
+    def close(self):
+        self._file.close()
+
+
+class Throughput:
+    """Counts finished utterances and audio, printing rates at most every ``interval`` seconds"""
+
+    def __init__(self, total, interval=5.0, out=sys.stdout):
+        self.total = total
+        self.interval = interval
+        self.out = out
+        self.done = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.started_at = time.perf_counter()
+        self._last_report = self.started_at
+        self._lock = threading.Lock()
+
+    def add(self, audio_seconds=None):
+        with self._lock:
+            if audio_seconds is None:
+                self.failed += 1
+            else:
+                self.done += 1
+                self.audio_seconds += audio_seconds
+            now = time.perf_counter()
+            if now - self._last_report >= self.interval:
+                self._last_report = now
+                self.report()
+
+    def rates(self):
+        elapsed = max(time.perf_counter() - self.started_at, 1e-9)
+        return self.done / elapsed, self.audio_seconds / elapsed
+
+    def report(self, final=False):
+        utterances_per_second, audio_per_second = self.rates()
+        label = "Finished" if final else "Progress"
+        print(
+            f"{label}: {self.done}/{self.total} done, {self.failed} failed, "
+            f"{utterances_per_second:.2f} utterances/s, {audio_per_second:.2f} audio-s/s",
+            file=self.out, flush=True
+        )
+
+
+class BatchSynthesizer:
+    """
+    Generates manifest entries concurrently and writes each output atomically.
+
+    Short entries go through ``engine`` (a ``BatchingEngine``) or, for a
+    ``ReplicaPool``, through the pool, which batches on each replica. Seeded
+    entries run on their own so the seed fully determines the output, and
+    long texts use the long-form pipeline. Frame budgets come from a
+    ``DurationEstimator`` that learns the pace of each speaker as the run goes.
+    """
+
+    def __init__(self, generator, engine=None, model_id=None, workers=4):
+        self.generator = generator
+        self.engine = engine
+        self.model_id = model_id or generator.model_id
+        self.workers = workers
+        self.duration_estimator = DurationEstimator()
+
+    def key_for(self, entry):
+        return make_cache_key(
+            entry['text'], entry['speaker'], entry['speed'], entry['temperature'], entry['topk'],
+            self.model_id, entry['seed']
+        )
+
+    def run(self, entries, journal, throughput_interval=5.0, out=sys.stdout):
+        """Synthesize every entry the journal does not already cover; returns the throughput counters"""
+        pending = [entry for entry in entries if not journal.is_done(entry['output'], self.key_for(entry))]
+        print(f"{len(entries) - len(pending)} of {len(entries)} entries already done, {len(pending)} to go",
+              file=out, flush=True)
+
+        throughput = Throughput(len(pending), interval=throughput_interval, out=out)
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch-synthesize")
+        try:
+            futures = {executor.submit(self._synthesize, entry, journal): entry for entry in pending}
+            for future in as_completed(futures):
+                try:
+                    throughput.add(future.result())
+                except Exception as e:
+                    entry = futures[future]
+                    logger.error(f"Error synthesizing manifest line {entry['line']}: {str(e)}")
+                    throughput.add(None)
+        finally:
+            # On Ctrl-C, drop what has not started; finished entries are already in the journal
+            executor.shutdown(wait=True, cancel_futures=True)
+        throughput.report(final=True)
+        return throughput
+
+    def _synthesize(self, entry, journal):
+        """Generate one entry, write it and journal it; returns the seconds of audio written"""
+        sample_rate = self.generator.sample_rate
+        if len(entry['text']) > LONG_FORM_CHARS:
+            data = self._long_form(entry)
+        else:
+            audio = self._generate(entry)
+            audio = apply_speed(audio, sample_rate, entry['speed'])
+            data = encode_audio(audio.numpy(), sample_rate, entry['format'])
+
+        write_atomic(entry['output'], data)
+        audio_seconds = sf.info(entry['output']).duration
+        journal.record(entry['output'], self.key_for(entry), hashlib.sha256(data).hexdigest(), audio_seconds)
+        return audio_seconds
+
+    def _segment_budgets(self, entry):
+        """Long-form options that size each segment's budget and calibrate the speaker from it, like short entries"""
+        voice = f"speaker:{entry['speaker']}"
+
+        def on_stop(segment, reason, frames):
+            if reason == 'eos':
+                self.duration_estimator.observe(segment, voice, frames * FRAME_MS)
+
+        return {
+            'budget_ms': lambda segment: self.duration_estimator.budget_ms(segment, voice),
+            'stop_callback': on_stop,
+        }
+
+    def _generate(self, entry):
+        voice = f"speaker:{entry['speaker']}"
+
+        def on_stop(reason, frames):
+            if reason == 'eos':
+                self.duration_estimator.observe(entry['text'], voice, frames * FRAME_MS)
+
+        options = {
+            'text': entry['text'],
+            'speaker': entry['speaker'],
+            'context': [],
+            'max_audio_length_ms': self.duration_estimator.budget_ms(entry['text'], voice),
+            'temperature': entry['temperature'],
+            'topk': entry['topk'],
+            'stop_callback': on_stop,
+        }
+        if entry['seed'] is not None or self.engine is None:
+            return self.generator.generate(seed=entry['seed'], **options)
+        return self.engine.generate(**options)
+
+    def _long_form(self, entry):
+        """Stitch a long text into a temporary WAV file and return it encoded in the entry's format"""
+        tmp_path = temp_path_for(entry['output'], '.wav')
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        try:
+            if isinstance(self.generator, ReplicaPool):
+                self.generator.synthesize_long_form(
+                    entry['text'], entry['speaker'], tmp_path, temperature=entry['temperature'],
+                    topk=entry['topk'], speed=entry['speed'], **self._segment_budgets(entry)
+                )
+            else:
+                LongFormSynthesizer(self.generator).synthesize(
+                    entry['text'], entry['speaker'], tmp_path, temperature=entry['temperature'],
+                    topk=entry['topk'], speed=entry['speed'], **self._segment_budgets(entry)
+                )
+            with open(tmp_path, 'rb') as f:
+                return transcode(f.read(), entry['format'])
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthesize every entry of a JSONL manifest')
+    parser.add_argument('manifest', help='JSONL file with one {"text", "output", ...} object per line')
+    parser.add_argument('--journal', help='Progress journal (default: <manifest>.journal)')
+    parser.add_argument('--device', default='cuda', choices=['cuda', 'cpu'])
+    parser.add_argument('--no-half', action='store_true', help='Disable half precision on CUDA')
+    parser.add_argument('--quantization', default='none', choices=QUANTIZATION_MODES,
+                        help='Weight format on the CPU')
+    parser.add_argument('--replicas', type=int, default=0,
+                        help='Model replicas in worker processes; 0 runs one model in this process')
+    parser.add_argument('--batch-size', type=int, default=4, help='Maximum requests generated together')
+    parser.add_argument('--workers', type=int, help='Entries in flight (default: batch size x replicas)')
+    parser.add_argument('--report-every', type=float, default=5.0, help='Seconds between throughput lines')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    try:
+        entries = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read manifest: {e}", file=sys.stderr)
+        return 1
+
+    import torch
+    device = args.device if args.device == 'cpu' or torch.cuda.is_available() else 'cpu'
+    generator_options = {
+        'device': device,
+        'use_half_precision': device == 'cuda' and not args.no_half,
+        'quantization': args.quantization if device == 'cpu' else 'none',
+    }
+    model_id = model_id_for(device, generator_options['use_half_precision'], generator_options['quantization'])
+
+    engine = None
+    if args.replicas > 0:
+        generator = ReplicaPool(
+            args.replicas, generator_options=generator_options,
+            batching_options={'max_batch_size': args.batch_size}
+        )
+    else:
+        generator = load_csm_generator(**generator_options)
+        engine = BatchingEngine(lambda: generator, max_batch_size=args.batch_size)
+
+    # Block until the model is loaded, so the throughput figures cover synthesis only
+    logger.info(f"Model loaded, sample rate {generator.sample_rate} Hz")
+
+    workers = args.workers or args.batch_size * max(1, args.replicas)
+    journal = Journal(args.journal or args.manifest + '.journal')
+    try:
+        synthesizer = BatchSynthesizer(generator, engine=engine, model_id=model_id, workers=workers)
+        throughput = synthesizer.run(entries, journal, throughput_interval=args.report_every)
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume", file=sys.stderr)
+        return 130
+    finally:
+        journal.close()
+        if isinstance(generator, ReplicaPool):
+            generator.shutdown()
+    return 1 if throughput.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Dynamic micro-batching of concurrent generation requests
+"""
+import collections
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class BatchingEngine:
+    """
+    Collects generation requests that arrive within a short window and runs
+    them through ``CSMGenerator.generate_frames_batch`` as one padded batch.
+
+    ``max_batch_size`` and ``max_wait_ms`` are the throughput-vs-latency knob:
+    larger batches keep the backbone busier, while a longer wait lets more
+    requests join a batch at the cost of added latency for the first one.
+    Only requests with the same sampling settings and voice profile share a
+    batch, so a profile's cached prompt state covers every row. A request
+    may name the ``generator`` it runs on, e.g. the one its job holds while
+    the server swaps models; only requests naming the same one share a batch.
+
+    Only frame generation needs the backbone, so a finished batch's frames
+    are handed to a post-processing thread that decodes and watermarks them
+    while the next batch is generated. At most ``max_pending_batches`` wait
+    for it; when that many are queued, the next batch waits rather than
+    piling up frames. With ``max_pending_batches=0`` each batch is decoded
+    before the next one starts.
+    """
+
+    def __init__(self, get_generator, max_batch_size=4, max_wait_ms=25, max_pending_batches=2):
+        self.get_generator = get_generator
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_pending_batches = max_pending_batches
+
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._post_queue = queue.Queue(maxsize=max(1, max_pending_batches))
+        self._post_thread = None
+
+        # Counters for /status
+        self.batches_run = 0
+        self.requests_run = 0
+
+    def generate(self, text, speaker, context=None, max_audio_length_ms=10000, temperature=0.9, topk=50, voice=None,
+                 progress_callback=None, stop_callback=None, generator=None, cancel=None, timings=None):
+        """Generate speech for one request, blocking until its batch completes"""
+        return self.submit(
+            text, speaker, context=context, max_audio_length_ms=max_audio_length_ms,
+            temperature=temperature, topk=topk, voice=voice, progress_callback=progress_callback,
+            stop_callback=stop_callback, generator=generator, cancel=cancel, timings=timings
+        ).result()
+
+    def submit(self, text, speaker, context=None, max_audio_length_ms=10000, temperature=0.9, topk=50, voice=None,
+               progress_callback=None, stop_callback=None, generator=None, cancel=None, timings=None):
+        """
+        Queue a request for the next batch and return a Future for its audio.
+
+        When ``timings`` is a dict, the seconds spent in each stage are stored
+        in it: ``'frames'``, ``'post_wait'`` (queued for the post-processing
+        thread), ``'decode'`` and ``'watermark'``.
+        """
+        future = Future()
+        request = {
+            'text': text,
+            'speaker': speaker,
+            'context': context,
+            'max_audio_length_ms': max_audio_length_ms,
+            'voice': voice,
+            'progress_callback': progress_callback,
+            'stop_callback': stop_callback,
+            'cancel': cancel,
+            'timings': timings,
+        }
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._batch_loop, name="batching-engine")
+                self._thread.daemon = True
+                self._thread.start()
+                if self.max_pending_batches > 0:
+                    self._post_thread = threading.Thread(target=self._post_loop, name="batching-engine-post")
+                    self._post_thread.daemon = True
+                    self._post_thread.start()
+            key = (temperature, topk, voice.key if voice is not None else None, generator)
+            self._pending.append((key, request, future))
+            self._cond.notify()
+        return future
+
+    def stats(self):
+        """Return batching settings and the average batch size so far"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'batches_run': self.batches_run,
+            'avg_batch_size': self.requests_run / self.batches_run if self.batches_run else 0.0,
+            'max_pending_batches': self.max_pending_batches,
+            'pending_decodes': self._post_queue.qsize(),
+        }
+
+    def threads(self):
+        """The engine's generation and post-processing threads, once started"""
+        return [thread for thread in (self._thread, self._post_thread) if thread is not None]
+
+    def _collect_batch(self):
+        """Wait for a first request, then gather compatible ones until full or timed out"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            deadline = time.monotonic() + self.max_wait_ms / 1000.0
+            key = self._pending[0][0]
+            while True:
+                matching = sum(1 for pending_key, _, _ in self._pending if pending_key == key)
+                remaining = deadline - time.monotonic()
+                if matching >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, rest = [], collections.deque()
+            for item in self._pending:
+                if item[0] == key and len(batch) < self.max_batch_size:
+                    batch.append(item)
+                else:
+                    rest.append(item)
+            self._pending = rest
+            return key, batch
+
+    def _batch_loop(self):
+        while True:
+            (temperature, topk, _, generator), batch = self._collect_batch()
+            requests = [request for _, request, _ in batch]
+            futures = [future for _, _, future in batch]
+
+            try:
+                if generator is None:
+                    generator = self.get_generator()
+                frames = generator.generate_frames_batch(requests, temperature=temperature, topk=topk)
+            except Exception as e:
+                logger.error(f"Error generating batch of {len(batch)}: {str(e)}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            self.batches_run += 1
+            self.requests_run += len(batch)
+            logger.debug(f"Generated frames for batch of {len(batch)} request(s)")
+            if self.max_pending_batches > 0:
+                # Blocks while the post-processing thread is behind, so frames cannot pile up
+                self._post_queue.put((generator, requests, frames, futures, time.perf_counter()))
+            else:
+                self._decode_batch(generator, requests, frames, futures)
+
+    def _post_loop(self):
+        while True:
+            generator, requests, frames, futures, queued_at = self._post_queue.get()
+            waited = time.perf_counter() - queued_at
+            for request in requests:
+                if request['timings'] is not None:
+                    request['timings']['post_wait'] = waited
+            self._decode_batch(generator, requests, frames, futures)
+
+    def _decode_batch(self, generator, requests, frames, futures):
+        """Decode and watermark each request's frames and hand the audio to its caller"""
+        for request, request_frames, future in zip(requests, frames, futures):
+            try:
+                audio = generator.decode_frames(request_frames, timings=request['timings'])
+            except Exception as e:
+                logger.error(f"Error decoding audio: {str(e)}")
+                future.set_exception(e)
+                continue
+            future.set_result(audio)
@@ -0,0 +1,81 @@
+"""
+Compare bytes-on-wire and encode time for every supported output format.
+
+Uses a WAV file when one is given, otherwise a synthetic speech-like signal
+(harmonics under a syllable-rate envelope plus breath noise), which needs
+neither the model nor a GPU:
+
+    python benchmarks/bench_encoding.py [--input speech.wav] [--seconds 10] [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_encoding import FORMATS, encode_audio
+
+
+def synthetic_speech(seconds, sample_rate=24000, seed=0):
+    """Voiced harmonics with a wandering pitch, gated at syllable rate"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 120 + 20 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 2
+    audio = 0.3 * envelope * voiced + 0.01 * rng.standard_normal(t.shape)
+    return audio.astype(np.float32), sample_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark audio output formats')
+    parser.add_argument('--input', type=str, help='WAV file to encode instead of the synthetic signal')
+    parser.add_argument('--seconds', type=float, default=10.0, help='Length of the synthetic signal')
+    parser.add_argument('--repeat', type=int, default=5, help='Encodes per format; the fastest is reported')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable JSON')
+    args = parser.parse_args()
+
+    if args.input:
+        audio, sample_rate = sf.read(args.input, dtype='float32')
+    else:
+        audio, sample_rate = synthetic_speech(args.seconds)
+    duration = audio.shape[0] / sample_rate
+
+    results = []
+    for name in FORMATS:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            encoded = encode_audio(audio, sample_rate, name)
+            timings.append(time.perf_counter() - start)
+        results.append({
+            'format': name,
+            'bytes': encoded.nbytes,
+            'kbps': encoded.nbytes * 8 / duration / 1000,
+            'encode_ms': min(timings) * 1000,
+            'encode_ms_per_audio_s': min(timings) * 1000 / duration,
+        })
+
+    baseline = results[0]['bytes']
+    for result in results:
+        result['ratio_vs_wav'] = result['bytes'] / baseline
+
+    if args.json:
+        print(json.dumps({'audio_seconds': duration, 'sample_rate': sample_rate, 'formats': results}, indent=2))
+        return
+
+    print(f"{duration:.1f}s of audio at {sample_rate} Hz")
+    print(f"{'format':<8}{'bytes':>12}{'kbps':>10}{'vs wav':>9}{'encode ms':>12}{'ms/audio s':>12}")
+    for r in results:
+        print(f"{r['format']:<8}{r['bytes']:>12}{r['kbps']:>10.1f}{r['ratio_vs_wav']:>9.3f}"
+              f"{r['encode_ms']:>12.2f}{r['encode_ms_per_audio_s']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Measure what overlapping post-processing with frame generation buys at steady load.
+
+Drives a ``BatchingEngine`` from enough concurrent clients to keep it full,
+once decoding each batch before the next starts (``serial``) and once
+handing batches to the post-processing thread (``overlapped``). Reports
+throughput, latency and the mean seconds per stage for both, plus the
+speedup:
+
+    python benchmarks/bench_pipeline.py [--model stub|real|auto] [--concurrency 8] [--requests 48]
+        [--frame-cost-ms 2] [--decode-cost-ms 1] [--watermark-cost-ms 0.5] [--output results.json]
+
+The stub's decode and watermark costs are per frame of audio, like its frame
+cost, so their ratio to ``--frame-cost-ms`` sets how much there is to hide.
+"""
+import argparse
+import json
+import os
+import time
+
+from bench_server import git_commit, make_texts, run_load, use_model
+
+MODES = {'serial': 0, 'overlapped': 2}
+STAGES = ('frames', 'post_wait', 'decode', 'watermark')
+
+
+def bench_mode(generator, texts, concurrency, batch_size, max_pending_batches):
+    from batching import BatchingEngine
+
+    engine = BatchingEngine(
+        lambda: generator, max_batch_size=batch_size, max_wait_ms=10, max_pending_batches=max_pending_batches
+    )
+    timings = []
+
+    def run_one(text):
+        request_timings = {}
+        audio = engine.generate(text=text, speaker=0, context=[], max_audio_length_ms=20_000, timings=request_timings)
+        timings.append(request_timings)
+        return audio.shape[0] / generator.sample_rate
+
+    run_one(texts[0])
+    timings.clear()
+    report = run_load(texts, concurrency, run_one)
+    report['avg_batch_size'] = engine.stats()['avg_batch_size']
+    report['stage_seconds_mean'] = {
+        stage: sum(t[stage] for t in timings if stage in t) / len(timings)
+        for stage in STAGES if any(stage in t for t in timings)
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark overlapped post-processing in the batching engine')
+    parser.add_argument('--model', choices=['stub', 'real', 'auto'], default='stub')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=48, help='Measured requests per mode')
+    parser.add_argument('--batch-size', type=int, default=4, help='Maximum batch size')
+    parser.add_argument('--words', type=str, default='5,20', help='Comma-separated text lengths in words')
+    parser.add_argument('--frame-cost-ms', type=float, default=2.0, help='Per-frame generation cost of the stub')
+    parser.add_argument('--decode-cost-ms', type=float, default=1.0, help='Per-frame decode cost of the stub')
+    parser.add_argument('--watermark-cost-ms', type=float, default=0.5, help='Per-frame watermark cost of the stub')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the text distribution')
+    parser.add_argument('--output', type=str, help='Write the JSON report here as well as to stdout')
+    args = parser.parse_args()
+
+    # The stub reads its costs at import time
+    os.environ.setdefault('STUB_CSM_FRAME_COST_MS', str(args.frame_cost_ms))
+    os.environ.setdefault('STUB_CSM_DECODE_COST_MS', str(args.decode_cost_ms))
+    os.environ.setdefault('STUB_CSM_WATERMARK_COST_MS', str(args.watermark_cost_ms))
+    model = use_model(args.model)
+
+    import torch
+    from csm_generator import load_csm_generator
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    generator = load_csm_generator(device=device, use_half_precision=(device == "cuda"))
+    word_counts = [int(w) for w in args.words.split(',')]
+    texts = make_texts(args.requests, word_counts, args.seed)
+
+    results = {
+        mode: bench_mode(generator, texts, args.concurrency, args.batch_size, max_pending_batches)
+        for mode, max_pending_batches in MODES.items()
+    }
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'config': {
+            'model': model,
+            'costs_ms': {
+                stage: float(os.environ[f'STUB_CSM_{stage.upper()}_COST_MS'])
+                for stage in ('frame', 'decode', 'watermark')
+            } if model == 'stub' else None,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'batch_size': args.batch_size,
+            'words': word_counts,
+            'seed': args.seed,
+        },
+        'results': results,
+        'overlapped_vs_serial': {
+            'throughput_speedup': results['overlapped']['throughput_rtf'] / results['serial']['throughput_rtf'],
+            'latency_p50_ratio': results['overlapped']['latency_p50_ms'] / results['serial']['latency_p50_ms'],
+        },
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
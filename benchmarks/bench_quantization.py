@@ -0,0 +1,144 @@
+"""
+Compare int8 CPU inference with the unquantized weights: memory, speed and how close the audio stays.
+
+Each mode is loaded in its own process, so its peak RSS is not inflated by
+the other. Both modes generate the same texts with the same seeds. Greedy
+sampling (``--topk 1``, the default) makes the outputs depend only on the
+weights, so the log-mel similarity between the two runs of each text shows
+what quantization changes:
+
+    python benchmarks/bench_quantization.py [--model auto|stub|real] [--texts 6] [--words 5,20]
+        [--topk 1] [--output results.json]
+
+With the stub model the numbers only check the harness; pass ``--model real``
+(or ``auto`` when ``../csm`` exists) for meaningful results.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import time
+
+import torch
+import torchaudio
+
+from bench_server import git_commit, make_texts, peak_rss_mb, use_model
+
+MODES = ('none', 'int8')
+
+
+def weights_mb(model):
+    """Serialized size of the model's weights, which counts packed int8 weights correctly"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 ** 2
+
+
+def run_mode(mode, model, texts, topk, frame_cost_ms, results):
+    """Load the generator in ``mode`` and time seeded generations; runs in a child process"""
+    os.environ.setdefault('STUB_CSM_FRAME_COST_MS', str(frame_cost_ms))
+    use_model(model)
+    from csm_generator import load_csm_generator
+
+    start = time.perf_counter()
+    generator = load_csm_generator(device="cpu", quantization=mode)
+    load_seconds = time.perf_counter() - start
+    generator.warm_up()
+
+    audio, wall_seconds = [], 0.0
+    for i, text in enumerate(texts):
+        start = time.perf_counter()
+        audio.append(generator.generate(text=text, speaker=0, max_audio_length_ms=20_000, topk=topk, seed=i))
+        wall_seconds += time.perf_counter() - start
+    audio_seconds = sum(a.shape[0] for a in audio) / generator.sample_rate
+
+    results.put({
+        'mode': mode,
+        'method': generator.quantization_method,
+        'load_seconds': load_seconds,
+        'weights_mb': weights_mb(generator._model._model),
+        'peak_rss_mb': peak_rss_mb(),
+        'audio_seconds': audio_seconds,
+        'wall_seconds': wall_seconds,
+        'real_time_factor': audio_seconds / wall_seconds if wall_seconds > 0 else None,
+        'sample_rate': generator.sample_rate,
+        'audio': [a.numpy() for a in audio],
+    })
+
+
+def log_mel(audio, sample_rate):
+    mel = torchaudio.transforms.MelSpectrogram(sample_rate, n_fft=1024, hop_length=256, n_mels=80)
+    return torch.log(mel(audio) + 1e-5).T
+
+
+def mel_similarity(a, b, sample_rate):
+    """Mean cosine similarity of log-mel frames over the length both clips share"""
+    mel_a, mel_b = log_mel(a, sample_rate), log_mel(b, sample_rate)
+    frames = min(mel_a.shape[0], mel_b.shape[0])
+    if frames == 0:
+        return None
+    return torch.nn.functional.cosine_similarity(mel_a[:frames], mel_b[:frames], dim=1).mean().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark int8 quantized CPU inference against full precision')
+    parser.add_argument('--model', choices=['stub', 'real', 'auto'], default='auto')
+    parser.add_argument('--texts', type=int, default=6, help='Number of texts generated in each mode')
+    parser.add_argument('--words', type=str, default='5,20', help='Comma-separated text lengths in words')
+    parser.add_argument('--topk', type=int, default=1, help='Top-k sampling; 1 is greedy')
+    parser.add_argument('--frame-cost-ms', type=float, default=2.0, help='Per-frame cost of the stub model')
+    parser.add_argument('--output', type=str, help='Write the JSON report here as well as to stdout')
+    args = parser.parse_args()
+
+    texts = make_texts(args.texts, [int(w) for w in args.words.split(',')], seed=0)
+    context = multiprocessing.get_context('spawn')
+    runs = {}
+    for mode in MODES:
+        results = context.Queue()
+        process = context.Process(
+            target=run_mode, args=(mode, args.model, texts, args.topk, args.frame_cost_ms, results)
+        )
+        process.start()
+        runs[mode] = results.get()
+        process.join()
+
+    sample_rate = runs['none']['sample_rate']
+    reference, quantized = runs['none'].pop('audio'), runs['int8'].pop('audio')
+    similarity = [
+        {
+            'text': text,
+            'mel_cosine': mel_similarity(torch.from_numpy(a), torch.from_numpy(b), sample_rate),
+            'length_ratio': b.shape[0] / a.shape[0] if a.shape[0] else None,
+        }
+        for text, a, b in zip(texts, reference, quantized)
+    ]
+    scores = [s['mel_cosine'] for s in similarity if s['mel_cosine'] is not None]
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'config': {
+            'model': args.model,
+            'texts': args.texts,
+            'topk': args.topk,
+            'threads': torch.get_num_threads(),
+        },
+        'results': runs,
+        'int8_vs_none': {
+            'weights_ratio': runs['int8']['weights_mb'] / runs['none']['weights_mb'],
+            'speedup': runs['int8']['real_time_factor'] / runs['none']['real_time_factor'],
+            'mean_mel_cosine': sum(scores) / len(scores) if scores else None,
+            'per_text': similarity,
+        },
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Throughput and latency benchmark for CSMGenerator and the Flask app.
+
+By default it runs against the deterministic stub model in ``stub_csm/``, so
+it needs neither weights nor a GPU and can track server-side regressions on
+a plain CPU box. With ``--model real`` (or ``auto`` when ``../csm`` exists)
+it drives the actual model instead:
+
+    python benchmarks/bench_server.py [--target generator|app|both] [--concurrency 4]
+        [--requests 32] [--words 5,20,60] [--frame-cost-ms 2] [--output results.json]
+
+Each request draws its text length from ``--words``. The report has
+p50/p95/p99 latency, requests/sec, real-time factor and peak RSS per target,
+printed as JSON so runs can be diffed across commits.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import soundfile as sf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VOCABULARY = (
+    "the quick brown fox jumps over a lazy dog while our call center team answers "
+    "every question about your account balance delivery time and recent order today"
+).split()
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of a non-empty list"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def make_texts(count, word_counts, seed):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        words = [rng.choice(VOCABULARY) for _ in range(rng.choice(word_counts))]
+        texts.append(" ".join(words).capitalize() + ".")
+    return texts
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_load(texts, concurrency, run_one):
+    """Run ``run_one(text)`` -> audio seconds over ``texts`` from ``concurrency`` threads"""
+    pending = list(texts)
+    lock = threading.Lock()
+    samples = []
+    errors = []
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                text = pending.pop(0)
+            start = time.perf_counter()
+            try:
+                audio_seconds = run_one(text)
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            samples.append((time.perf_counter() - start, audio_seconds))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in samples]
+    audio_total = sum(audio for _, audio in samples)
+    report = {
+        'requests': len(texts),
+        'completed': len(samples),
+        'errors': len(errors),
+        'wall_seconds': wall,
+        'requests_per_second': len(samples) / wall if wall else 0.0,
+        'audio_seconds': audio_total,
+        # Audio produced per second of wall time across all concurrent requests
+        'throughput_rtf': audio_total / wall if wall else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if samples:
+        rtfs = [audio / latency for latency, audio in samples if latency > 0]
+        report.update({
+            'latency_p50_ms': percentile(latencies, 50) * 1000,
+            'latency_p95_ms': percentile(latencies, 95) * 1000,
+            'latency_p99_ms': percentile(latencies, 99) * 1000,
+            'latency_max_ms': max(latencies) * 1000,
+            'rtf_p50': percentile(rtfs, 50) if rtfs else 0.0,
+        })
+    if errors:
+        report['first_error'] = errors[0]
+    return report
+
+
+def bench_generator(texts, concurrency):
+    from csm_generator import load_csm_generator
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    start = time.perf_counter()
+    generator = load_csm_generator(device=device, use_half_precision=(device == "cuda"))
+    load_seconds = time.perf_counter() - start
+
+    def run_one(text):
+        audio = generator.generate(text=text, speaker=0, context=[])
+        return audio.shape[0] / generator.sample_rate
+
+    run_one(texts[0])
+    report = run_load(texts, concurrency, run_one)
+    report['load_seconds'] = load_seconds
+    report['device'] = device
+    return report
+
+
+def bench_app(texts, concurrency, poll_interval):
+    import server
+
+    client = server.app.test_client()
+
+    def run_one(text):
+        response = client.post('/synthesize', json={'text': text, 'speaker_id': 0})
+        if response.status_code != 200:
+            raise RuntimeError(f"/synthesize returned {response.status_code}")
+        job_id = response.get_json()['job_id']
+        while True:
+            status = client.get(f'/job/{job_id}').get_json()
+            if status['status'] == 'completed':
+                break
+            if status['status'] == 'error':
+                raise RuntimeError(status.get('error'))
+            time.sleep(poll_interval)
+        download = client.get(f'/job/{job_id}?download=true')
+        info = sf.info(io.BytesIO(download.data))
+        client.post('/cleanup', json={'job_ids': [job_id]})
+        return info.frames / info.samplerate
+
+    start = time.perf_counter()
+    server.get_generator()
+    load_seconds = time.perf_counter() - start
+
+    run_one(texts[0])
+    report = run_load(texts, concurrency, run_one)
+    report['load_seconds'] = load_seconds
+    report['batching'] = server.batching_engine.stats()
+    return report
+
+
+def use_model(model):
+    """Put the stub or the real ``generator`` module first on the import path"""
+    if model == 'auto':
+        model = 'real' if os.path.isdir(os.path.join(ROOT, '..', 'csm')) else 'stub'
+    if model == 'stub':
+        sys.path.insert(0, os.path.join(ROOT, 'stub_csm'))
+    else:
+        sys.path.insert(0, os.path.join(ROOT, '..', 'csm'))
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CSMGenerator and the HTTP server')
+    parser.add_argument('--target', choices=['generator', 'app', 'both'], default='both')
+    parser.add_argument('--model', choices=['stub', 'real', 'auto'], default='stub')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=32, help='Measured requests per target')
+    parser.add_argument('--words', type=str, default='5,20,60',
+                        help='Comma-separated text lengths in words, drawn uniformly per request')
+    parser.add_argument('--frame-cost-ms', type=float, default=2.0,
+                        help='Per-frame generation cost of the stub model')
+    parser.add_argument('--poll-interval', type=float, default=0.01, help='Seconds between /job polls')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the text distribution')
+    parser.add_argument('--output', type=str, help='Write the JSON report here as well as to stdout')
+    args = parser.parse_args()
+
+    # The stub reads its frame cost at import time
+    os.environ.setdefault('STUB_CSM_FRAME_COST_MS', str(args.frame_cost_ms))
+    model = use_model(args.model)
+
+    word_counts = [int(w) for w in args.words.split(',')]
+    texts = make_texts(args.requests, word_counts, args.seed)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'config': {
+            'model': model,
+            'frame_cost_ms': float(os.environ['STUB_CSM_FRAME_COST_MS']) if model == 'stub' else None,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'words': word_counts,
+            'seed': args.seed,
+        },
+        'results': {},
+    }
+    if args.target in ('generator', 'both'):
+        report['results']['generator'] = bench_generator(texts, args.concurrency)
+    if args.target in ('app', 'both'):
+        report['results']['app'] = bench_app(texts, args.concurrency, args.poll_interval)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare the cost of changing speech speed with the old resample path and
+with the pitch-preserving time stretch, one clip at a time and batched.
+
+Uses synthetic speech-like clips, so it needs neither the model nor a GPU:
+
+    python benchmarks/bench_speed.py [--clips 8] [--seconds 6] [--speeds 0.75,1.25,1.5] [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+import torchaudio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_effects import time_stretch
+from bench_encoding import synthetic_speech
+
+
+def resample(clips, sample_rate, speed):
+    """The previous speed path: resampling shifts pitch along with tempo and rebuilds its kernel per call"""
+    return [torchaudio.functional.resample(clip, orig_freq=sample_rate, new_freq=int(sample_rate * speed))
+            for clip in clips]
+
+
+def stretch_each(clips, sample_rate, speed):
+    return [time_stretch([clip], sample_rate, speed)[0] for clip in clips]
+
+
+METHODS = {
+    'resample': resample,
+    'stretch': stretch_each,
+    'stretch_batched': time_stretch,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the speed post-processing stage')
+    parser.add_argument('--clips', type=int, default=8, help='Number of clips processed per call')
+    parser.add_argument('--seconds', type=float, default=6.0, help='Length of the longest clip')
+    parser.add_argument('--speeds', type=str, default='0.75,1.25,1.5', help='Comma-separated speed factors')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per method; the fastest is reported')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable JSON')
+    args = parser.parse_args()
+
+    # Clips of varied length, as a batch of sentences would be
+    clips = []
+    for i in range(args.clips):
+        audio, sample_rate = synthetic_speech(args.seconds * (0.5 + 0.5 * (i + 1) / args.clips), seed=i)
+        clips.append(torch.from_numpy(audio))
+    duration = sum(clip.shape[0] for clip in clips) / sample_rate
+
+    results = []
+    for speed in [float(s) for s in args.speeds.split(',')]:
+        for name, method in METHODS.items():
+            method(clips, sample_rate, speed)  # warm up caches and allocator
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                method(clips, sample_rate, speed)
+                timings.append(time.perf_counter() - start)
+            results.append({
+                'speed': speed,
+                'method': name,
+                'ms': min(timings) * 1000,
+                'ms_per_audio_s': min(timings) * 1000 / duration,
+            })
+
+    if args.json:
+        print(json.dumps({'audio_seconds': duration, 'sample_rate': sample_rate, 'clips': args.clips,
+                          'threads': torch.get_num_threads(), 'results': results}, indent=2))
+        return
+
+    print(f"{args.clips} clips, {duration:.1f}s of audio at {sample_rate} Hz, {torch.get_num_threads()} threads")
+    print(f"{'speed':>6}  {'method':<16}{'ms':>10}{'ms/audio s':>12}")
+    for r in results:
+        print(f"{r['speed']:>6.2f}  {r['method']:<16}{r['ms']:>10.2f}{r['ms_per_audio_s']:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
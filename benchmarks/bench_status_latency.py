@@ -0,0 +1,235 @@
+"""
+Load test: does /status stay fast while generation saturates the CPU?
+
+Starts the server as a separate process, once per front-end (``flask`` runs
+server.py, ``asgi`` runs asgi_app.py), on the stub model in busy mode, so
+every frame burns CPU and holds the GIL much like the real decoder. For each
+front-end it probes ``/status`` and ``/job/<job_id>`` at a fixed rate, first
+while idle and then while clients keep the job queue full, and reports the
+probe latencies and the server's CPU use:
+
+    python benchmarks/bench_status_latency.py [--mode flask|asgi|both] [--duration 10]
+        [--load-clients 8] [--probe-rate 20] [--frame-cost-ms 20] [--replicas 0] [--output results.json]
+
+Linux only, because server CPU time is read from /proc.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from bench_server import git_commit, make_texts, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    'flask': 'server.py',
+    'asgi': 'asgi_app.py',
+}
+
+
+def request(url, data=None, timeout=30):
+    """Send one request on a fresh connection and return the decoded JSON body"""
+    body = None if data is None else json.dumps(data).encode()
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def group_cpu_seconds(pgid):
+    """User plus system CPU time of every live process in a process group"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[2]) == pgid:
+            total += int(fields[11]) + int(fields[12])
+    return total / ticks
+
+
+def start_server(mode, port, args):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': os.pathsep.join([os.path.join(ROOT, 'stub_csm'), ROOT]),
+        'STUB_CSM_FRAME_COST_MS': str(args.frame_cost_ms),
+        'STUB_CSM_FRAME_BUSY': '1',
+        'TTS_PORT': str(port),
+        'TTS_REPLICAS': str(args.replicas),
+        'TTS_SNAPSHOT_DIR': '',
+        'TTS_QUEUE_SIZE': str(args.load_clients * 2),
+    })
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [sys.executable, ENTRY_POINTS[mode]], cwd=ROOT, env=env,
+        stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+    )
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            request(f'{base_url}/readyz', timeout=2)
+            return process, base_url
+        except (urllib.error.URLError, ConnectionError, OSError):
+            if process.poll() is not None:
+                break
+            time.sleep(0.25)
+    stop_server(process)
+    log.seek(0)
+    raise RuntimeError(f"{mode} server did not become ready:\n{log.read().decode(errors='replace')[-2000:]}")
+
+
+def stop_server(process):
+    # The Flask reloader runs the server in a child, so signal the whole group
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def probe(base_url, job_id, duration, rate):
+    """Alternate /status and /job/<job_id> requests at ``rate`` per second, returning latencies in ms"""
+    latencies = {'status': [], 'job': []}
+    errors = 0
+    interval = 1.0 / rate
+    next_at = time.perf_counter()
+    end_at = next_at + duration
+    i = 0
+    while next_at < end_at:
+        time.sleep(max(0.0, next_at - time.perf_counter()))
+        endpoint = 'status' if i % 2 == 0 else 'job'
+        url = f'{base_url}/status' if endpoint == 'status' else f'{base_url}/job/{job_id}'
+        start = time.perf_counter()
+        try:
+            request(url)
+            latencies[endpoint].append((time.perf_counter() - start) * 1000)
+        except (urllib.error.URLError, ConnectionError, OSError):
+            errors += 1
+        next_at += interval
+        i += 1
+    return latencies, errors
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50),
+        'p95_ms': percentile(values, 95),
+        'p99_ms': percentile(values, 99),
+        'max_ms': max(values),
+    }
+
+
+def run_generation_load(base_url, texts, stop):
+    """Keep submitting jobs and waiting on their event streams until ``stop`` is set"""
+    completed = [0]
+
+    def client(offset):
+        i = offset
+        while not stop.is_set():
+            try:
+                job_id = request(f'{base_url}/synthesize', {'text': texts[i % len(texts)]})['job_id']
+                # One long-lived request per job instead of polling
+                with urllib.request.urlopen(f'{base_url}/job/{job_id}/events', timeout=300) as events:
+                    for line in events:
+                        if line.startswith(b'event: completed') or line.startswith(b'event: failed'):
+                            break
+                request(f'{base_url}/cleanup', {'job_ids': [job_id]})
+                completed[0] += 1
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.1)
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    return threads, completed
+
+
+def bench_mode(mode, port, args, texts):
+    process, base_url = start_server(mode, port, args)
+    try:
+        # A finished job to probe, so /job/<job_id> is served from memory like a client's poll
+        job_id = request(f'{base_url}/synthesize', {'text': 'Hello there.'})['job_id']
+        while request(f'{base_url}/job/{job_id}')['status'] not in ('completed', 'error'):
+            time.sleep(0.05)
+
+        idle, idle_errors = probe(base_url, job_id, args.duration, args.probe_rate)
+
+        stop = threading.Event()
+        threads, completed = run_generation_load(base_url, texts[:args.load_clients], stop)
+        time.sleep(2)  # let the queue fill
+        cpu_start, wall_start = group_cpu_seconds(process.pid), time.perf_counter()
+        loaded, loaded_errors = probe(base_url, job_id, args.duration, args.probe_rate)
+        cpu_percent = 100 * (group_cpu_seconds(process.pid) - cpu_start) / (time.perf_counter() - wall_start)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=60)
+
+        return {
+            'idle': {endpoint: summarize(values) for endpoint, values in idle.items()},
+            'loaded': {endpoint: summarize(values) for endpoint, values in loaded.items()},
+            'probe_errors': idle_errors + loaded_errors,
+            'jobs_completed_under_load': completed[0],
+            'server_cpu_percent': cpu_percent,
+        }
+    finally:
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure status latency while generation saturates the CPU')
+    parser.add_argument('--mode', choices=['flask', 'asgi', 'both'], default='both')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of probing per phase')
+    parser.add_argument('--probe-rate', type=float, default=20.0, help='Probe requests per second')
+    parser.add_argument('--load-clients', type=int, default=8, help='Clients keeping generation busy')
+    parser.add_argument('--words', type=int, default=30, help='Words per generated text')
+    parser.add_argument('--frame-cost-ms', type=float, default=20.0, help='CPU burnt per stub frame')
+    parser.add_argument('--replicas', type=int, default=0, help='TTS_REPLICAS for the server under test')
+    parser.add_argument('--output', type=str, help='Write the JSON report here as well as to stdout')
+    args = parser.parse_args()
+
+    texts = make_texts(args.load_clients, [args.words], seed=0)
+    modes = ['flask', 'asgi'] if args.mode == 'both' else [args.mode]
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'config': {
+            'duration': args.duration,
+            'probe_rate': args.probe_rate,
+            'load_clients': args.load_clients,
+            'words': args.words,
+            'frame_cost_ms': args.frame_cost_ms,
+            'replicas': args.replicas,
+            'cpus': os.cpu_count(),
+        },
+        'results': {mode: bench_mode(mode, args.port, args, texts) for mode in modes},
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
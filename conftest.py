@@ -0,0 +1,48 @@
+"""
+Shared test setup: the stub CSM modules, throwaway directories and polling helpers.
+
+pytest loads this module before collecting the test files. Running one
+directly with ``python test_<name>.py`` imports it at the top of the
+file's ``__main__`` runner instead, so both get the same setup.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+# Needs the real model and weights; run it directly with ``python test_csm.py``
+collect_ignore = ['test_csm.py']
+
+# Use the stub CSM modules so the tests run on CPU without model weights
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_csm'))
+
+# Keep model snapshots, cached audio and profiles out of the working tree
+os.environ.setdefault('TTS_SNAPSHOT_DIR', tempfile.mkdtemp())
+os.environ.setdefault('TTS_CACHE_DIR', tempfile.mkdtemp())
+os.environ.setdefault('TTS_PROFILE_DIR', tempfile.mkdtemp())
+
+
+def wait_until(condition, timeout=60):
+    """Poll ``condition`` until it holds, failing the test after ``timeout`` seconds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def load_server():
+    """Import the Flask server module, which loads its model lazily on first use"""
+    import server as server_module
+    return server_module
+
+
+@pytest.fixture
+def wait_for():
+    return wait_until
+
+
+@pytest.fixture(scope='session')
+def server():
+    return load_server()
@@ -3,10 +3,15 @@ Modified version of CSM generator.py for TTS-v3 with memory optimizations
 """
 import os
 import sys
+import collections
+import contextlib
+import dataclasses
 import torch
 import torchaudio
 import gc
 import logging
+import threading
+import time
 
 # Add the CSM directory to the path
 sys.path.append('../csm')
@@ -14,32 +19,135 @@ sys.path.append('../csm')
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Import original CSM modules
-from generator import Segment
+# The original CSM modules pull in torchtune, moshi and the Hugging Face stack, so they are
+# imported on first use rather than when the server starts
+
+# Each generated frame covers 80ms of audio
+FRAME_MS = 80
+# Backbone context length of the CSM-1B model
+MAX_SEQ_LEN = 2048
+# Rough speaking rate used to estimate how many frames a text needs (about 14 characters a second)
+FRAMES_PER_CHAR = 0.9
+
+
+# Weight formats for CPU inference: the checkpoint's own, or int8 backbone and decoder linear layers
+QUANTIZATION_MODES = ('none', 'int8')
+# Longest cycle of semantic tokens that counts as a runaway loop; a held silence repeats one token
+RUNAWAY_MAX_PERIOD = 4
+
+
+def estimate_frames(text, max_frames):
+    """Estimate the number of frames generated for ``text``, capped at the frame budget"""
+    return max(1, min(max_frames, int(len(text) * FRAMES_PER_CHAR)))
+
+
+def max_text_tokens(text, speaker):
+    """
+    Upper bound on the tokens of a text segment, without loading the tokenizer.
+
+    The Llama 3 tokenizer is byte-level, so it never emits more tokens than
+    ``[speaker]text`` has UTF-8 bytes; BOS and EOS add two more.
+    """
+    return len(f"[{speaker}]{text}".encode('utf-8')) + 2
+
+
+def prompt_token_limit(max_audio_length_ms):
+    """Prompt length (voice prompt, context and text) must stay below this to leave room for the frames"""
+    return MAX_SEQ_LEN - int(max_audio_length_ms / FRAME_MS)
+
+
+def quantize_int8(model):
+    """
+    Replace the backbone and decoder linear layers of ``model`` with int8 ones, in place.
+
+    With torchao the weights become int8 with per-channel scales while the
+    activations keep the model's dtype. Without it, torch's dynamic
+    quantization is used instead, which needs float32 activations, so the
+    rest of the model is cast to float32 first. Returns the method used.
+    """
+    names = [name for name in ('backbone', 'decoder') if hasattr(model, name)]
+    try:
+        from torchao.quantization import int8_weight_only, quantize_
+    except ImportError:
+        model.to(dtype=torch.float32)
+        for name in names:
+            quantized = torch.ao.quantization.quantize_dynamic(getattr(model, name), {torch.nn.Linear}, dtype=torch.qint8)
+            setattr(model, name, quantized)
+        return 'dynamic'
+    for name in names:
+        quantize_(getattr(model, name), int8_weight_only())
+    return 'torchao'
+
+
+def find_loop(tokens, window, max_period=RUNAWAY_MAX_PERIOD):
+    """Return the period of a cycle that fills the last ``window`` tokens, or None if there is none"""
+    if len(tokens) < window:
+        return None
+    recent = list(tokens)[-window:]
+    for period in range(1, max_period + 1):
+        if recent[period:] == recent[:-period]:
+            return period
+    return None
 
 class CSMGenerator:
     """
     Memory-optimized wrapper for CSM generator
     """
-    def __init__(self, device="cpu", use_half_precision=False):
+    def __init__(self, device="cpu", use_half_precision=False, max_cached_prefixes=4, snapshot_dir=None,
+                 runaway_frames=25, quantization="none"):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATION_MODES}")
+        if quantization != "none" and device != "cpu":
+            logger.warning(f"Quantization is only used on the CPU, loading {device} weights unquantized")
+            quantization = "none"
         self.device = device
         self.use_half_precision = use_half_precision
+        self.quantization = quantization
+        self.quantization_method = None
         self._model = None
         self._text_tokenizer = None
         self._audio_tokenizer = None
         self._watermarker = None
         self.sample_rate = 24000  # Default sample rate
         
+        # Prepared weights in their final dtype, memory-mapped on later loads
+        self.snapshot_dir = snapshot_dir
+        self.loaded_from_snapshot = False
+        # Seconds spent in each loading phase, for startup logs and /readyz
+        self.load_timings = {}
+        
+        # The model's KV caches are shared state, so only one batch runs at a time
+        self._lock = threading.Lock()
+        # Decoding has its own lock so it can overlap with the next batch's frame generation
+        self._decode_lock = threading.Lock()
+        self._cache_batch_size = 1
+        
+        # Backbone attention state after each voice profile's prompt, by profile key
+        self.max_cached_prefixes = max_cached_prefixes
+        self._prefix_states = collections.OrderedDict()
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+        
+        # A row whose semantic tokens cycle for this many frames is stopped; 0 disables the check
+        self.runaway_frames = runaway_frames
+        
         # Initialize the generator
         self._initialize()
     
+    @property
+    def model_id(self):
+        """Identify the weights and precision, for keying cached outputs"""
+        return model_id_for(self.device, self.use_half_precision, self.quantization)
+    
     def _initialize(self):
         """Initialize the CSM generator with memory optimizations"""
         try:
             logger.info(f"Initializing CSM generator on {self.device} with half precision: {self.use_half_precision}")
             
+            start = time.perf_counter()
             # Import here to avoid circular imports
             from generator import load_csm_1b
+            self.load_timings['import'] = time.perf_counter() - start
             
             # Clean up memory before loading
             if self.device == "cuda":
@@ -48,30 +156,55 @@ class CSMGenerator:
                 torch.cuda.set_per_process_memory_fraction(0.8)
             gc.collect()
             
+            start = time.perf_counter()
+            model = None
+            snapshot_path = self._snapshot_path()
+            if snapshot_path and os.path.exists(snapshot_path):
+                try:
+                    model = self._load_snapshot(snapshot_path)
+                    self.loaded_from_snapshot = True
+                    logger.info(f"Loaded model weights from snapshot {snapshot_path}")
+                except Exception as e:
+                    logger.warning(f"Ignoring unusable model snapshot {snapshot_path}: {str(e)}")
+            
             # Load model with optimizations
-            if self.device == "cuda":
-                logger.info("Loading model with CUDA optimizations")
-                if self.use_half_precision:
-                    # Load directly to GPU with half precision
-                    logger.info("Using half precision (float16) to reduce memory usage")
-                    with torch.cuda.amp.autocast():
-                        model = load_csm_1b(device="cpu")  # Load to CPU first
-                        
-                        # Move model components to GPU with half precision
-                        model._model.to(device=self.device, dtype=torch.float16)
-                        
-                        # Keep tokenizers on CPU to save memory
-                        model._text_tokenizer = model._text_tokenizer
-                        model._audio_tokenizer = model._audio_tokenizer
-                        model._watermarker = model._watermarker
+            if model is None:
+                if self.device == "cuda":
+                    logger.info("Loading model with CUDA optimizations")
+                    if self.use_half_precision:
+                        # Load directly to GPU with half precision
+                        logger.info("Using half precision (float16) to reduce memory usage")
+                        with torch.cuda.amp.autocast():
+                            model = load_csm_1b(device="cpu")  # Load to CPU first
+                            
+                            # Move model components to GPU with half precision
+                            model._model.to(device=self.device, dtype=torch.float16)
+                            
+                            # Keep tokenizers on CPU to save memory
+                            model._text_tokenizer = model._text_tokenizer
+                            model._audio_tokenizer = model._audio_tokenizer
+                            model._watermarker = model._watermarker
+                    else:
+                        # Load with full precision
+                        logger.info("Using full precision (float32)")
+                        model = load_csm_1b(device=self.device)
                 else:
-                    # Load with full precision
-                    logger.info("Using full precision (float32)")
-                    model = load_csm_1b(device=self.device)
-            else:
-                # Load on CPU
-                logger.info("Loading model on CPU")
-                model = load_csm_1b(device="cpu")
+                    # Load on CPU
+                    logger.info("Loading model on CPU")
+                    model = load_csm_1b(device="cpu")
+            self.load_timings['load_weights'] = time.perf_counter() - start
+            
+            if snapshot_path and not self.loaded_from_snapshot:
+                start = time.perf_counter()
+                self._save_snapshot(model._model, snapshot_path)
+                self.load_timings['save_snapshot'] = time.perf_counter() - start
+            
+            # Snapshots hold the unquantized weights, so every mode shares one
+            if self.quantization == "int8":
+                start = time.perf_counter()
+                self.quantization_method = quantize_int8(model._model)
+                self.load_timings['quantize'] = time.perf_counter() - start
+                logger.info(f"Quantized backbone and decoder linear layers to int8 ({self.quantization_method})")
             
             self._model = model
             self._text_tokenizer = model._text_tokenizer
@@ -85,49 +218,543 @@ class CSMGenerator:
             logger.error(f"Error initializing CSM generator: {str(e)}")
             raise
     
-    def generate(self, text, speaker, context=None, max_audio_length_ms=10000, temperature=0.9, topk=50):
-        """Generate speech using CSM with memory optimizations"""
-        if context is None:
-            context = []
-            
+    def _snapshot_path(self):
+        if not self.snapshot_dir:
+            return None
+        snapshot_id = model_id_for(self.device, self.use_half_precision)
+        return os.path.join(self.snapshot_dir, snapshot_id.replace("/", "_") + ".pt")
+
+    def _save_snapshot(self, model, path):
+        """Write the backbone/decoder weights as they are now: cast, and ready to map"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        state_dict = {name: tensor.detach().cpu() for name, tensor in model.state_dict().items()}
+        # Write then rename, so concurrent replicas never map a half-written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save({'model_args': dataclasses.asdict(model.config), 'state_dict': state_dict}, tmp_path)
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote model snapshot {path}")
+
+    def _load_snapshot(self, path):
+        """
+        Build the generator around weights memory-mapped from a snapshot.
+
+        The model is created on the meta device, so no memory is allocated
+        for random initial weights, and the mapped tensors are then assigned
+        in place. On the CPU they stay file-backed: pages are read on first
+        use and shared with every other process mapping the same file.
+        """
+        from generator import Generator
+        from models import Model, ModelArgs
+        
+        snapshot = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        with torch.device("meta"):
+            model = Model(ModelArgs(**snapshot['model_args']))
+        missing, _ = model.load_state_dict(snapshot['state_dict'], strict=False, assign=True)
+        if missing:
+            raise ValueError(f"snapshot is missing {len(missing)} weights, e.g. {missing[0]}")
+        
+        # Derived buffers such as RoPE tables are not saved; rebuild them like the original load did.
+        # torchtune's rope_init returns early on the meta device without registering anything,
+        # so every RoPE module is rebuilt, not only those left with meta buffers
+        dtype = next(model.parameters()).dtype
+        for module in model.modules():
+            if hasattr(module, 'rope_init'):
+                with torch.device("cpu"):
+                    module.rope_init()
+                module.to(dtype=dtype)
+        if any(buffer.is_meta for buffer in model.buffers()):
+            raise ValueError("snapshot cannot restore every buffer of the model")
+        if any(getattr(module, 'is_cache_built', True) is False for module in model.modules()):
+            raise ValueError("snapshot cannot rebuild the model's RoPE caches")
+        
+        model.to(device=self.device)
+        return Generator(model)
+
+    def warm_up(self):
+        """Run one short generation so first-use costs are paid before serving traffic"""
+        start = time.perf_counter()
+        self.generate(text="Warming up.", speaker=0, max_audio_length_ms=4 * FRAME_MS)
+        self.load_timings['warm_up'] = time.perf_counter() - start
+    
+    def generate(self, text, speaker, context=None, max_audio_length_ms=10000, temperature=0.9, topk=50, seed=None,
+                 voice=None, progress_callback=None, stop_callback=None, cancel=None, timings=None):
+        """
+        Generate speech using CSM with memory optimizations.
+
+        ``progress_callback(frames_done, frames_total)`` is called after every
+        frame. ``frames_total`` is an estimate from the text length until the
+        last frame, when it equals ``frames_done``.
+
+        ``stop_callback(reason, frames)`` is called once generation stops:
+        ``'eos'`` when the model ended the utterance, ``'budget'`` when it
+        reached ``max_audio_length_ms`` and ``'runaway'`` when it was stuck
+        repeating itself. The repeated tail of a runaway is dropped.
+
+        ``cancel`` is anything with an ``is_set()`` method, such as a
+        ``threading.Event``. It is checked before every frame; once it is set,
+        generation stops with reason ``'cancelled'`` and the frames so far are
+        returned.
+
+        When ``timings`` is a dict, the seconds spent in each stage are stored
+        in it under ``'frames'``, ``'decode'`` and ``'watermark'``.
+        """
+        return self.generate_batch(
+            [{'text': text, 'speaker': speaker, 'context': context, 'max_audio_length_ms': max_audio_length_ms,
+              'voice': voice, 'progress_callback': progress_callback, 'stop_callback': stop_callback,
+              'cancel': cancel, 'timings': timings}],
+            temperature=temperature,
+            topk=topk,
+            seed=seed
+        )[0]
+
+    def generate_batch(self, requests, temperature=0.9, topk=50, seed=None):
+        """
+        Generate speech for several requests in one padded batch.
+
+        Each request is a dict with ``text``, ``speaker`` and optionally
+        ``context``, ``max_audio_length_ms``, ``voice`` (a ``VoiceProfile``
+        whose reference prompt precedes the context), ``progress_callback``,
+        ``stop_callback``, ``cancel`` and ``timings`` (see ``generate``).
+        Sampling settings are shared by the whole batch. Returns one audio
+        tensor per request, in order. When ``seed`` is given, sampling is
+        reproducible for the same batch.
+
+        This runs both stages back to back; ``generate_frames_batch`` and
+        ``decode_frames`` run them separately, so the next batch's frames can
+        be generated while this one is decoded on another thread.
+        """
         try:
-            # Clean up memory before generation
-            if self.device == "cuda":
-                torch.cuda.empty_cache()
-                
-            gc.collect()
-            
-            # Generate speech with half precision if enabled
-            if self.device == "cuda" and self.use_half_precision:
-                with torch.cuda.amp.autocast():
-                    audio = self._model.generate(
-                        text=text,
-                        speaker=speaker,
-                        context=context,
-                        max_audio_length_ms=max_audio_length_ms,
-                        temperature=temperature,
-                        topk=topk
-                    )
-            else:
-                audio = self._model.generate(
-                    text=text,
-                    speaker=speaker,
-                    context=context,
-                    max_audio_length_ms=max_audio_length_ms,
-                    temperature=temperature,
-                    topk=topk
-                )
-            
-            # Move audio to CPU to free GPU memory
-            if self.device == "cuda":
-                audio = audio.cpu()
-                
-            return audio
+            frames = self.generate_frames_batch(requests, temperature=temperature, topk=topk, seed=seed)
+            return [
+                self.decode_frames(request_frames, timings=request.get('timings'))
+                for request, request_frames in zip(requests, frames)
+            ]
             
         except Exception as e:
             logger.error(f"Error generating speech: {str(e)}")
             print(f"Error generating speech: {str(e)}")
             raise
+
+    def generate_frames_batch(self, requests, temperature=0.9, topk=50, seed=None):
+        """
+        Run the frame generation stage for a batch of requests (as for ``generate_batch``).
+
+        Returns each request's list of frames, ready for ``decode_frames``.
+        This is the only stage that needs the backbone, so it holds the model
+        lock; the returned frames can be decoded while the next batch runs.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            if seed is not None:
+                torch.manual_seed(seed)
+            
+            frames = self._generate_frames(requests, temperature, topk)
+        
+        elapsed = time.perf_counter() - start
+        for request in requests:
+            if request.get('timings') is not None:
+                request['timings']['frames'] = elapsed
+        return frames
+
+    def generate_frames(self, text, speaker, context=None, max_audio_length_ms=10000, temperature=0.9, topk=50,
+                        voice=None, stop_callback=None, cancel=None):
+        """
+        Generate audio frames without decoding them.
+
+        Pair with ``decode_frames`` to decode on another thread, and with
+        ``frames_to_context`` to condition later generations on these frames
+        without a decode/encode round trip through the audio tokenizer.
+        ``stop_callback`` and ``cancel`` are as for ``generate``.
+        """
+        request = {'text': text, 'speaker': speaker, 'context': context, 'max_audio_length_ms': max_audio_length_ms,
+                   'voice': voice, 'stop_callback': stop_callback, 'cancel': cancel}
+        with self._lock:
+            return self._generate_frames([request], temperature, topk)[0]
+
+    def decode_frames(self, frames, timings=None):
+        """
+        Decode frames from ``generate_frames`` into watermarked audio on the CPU.
+
+        When ``timings`` is a dict, the seconds spent decoding audio tokens and
+        watermarking are stored in it under ``'decode'`` and ``'watermark'``.
+        """
+        with self._decode_lock:
+            start = time.perf_counter()
+            audio = self._decode_tokens(frames)
+            decoded = time.perf_counter()
+            audio = self._watermark(audio).cpu()
+            if timings is not None:
+                timings['decode'] = decoded - start
+                timings['watermark'] = time.perf_counter() - decoded
+            return audio
+
+    def tokenize_reference(self, text, speaker, audio):
+        """Tokenize a reference clip (mono audio at ``sample_rate``) and its transcript, on the CPU"""
+        from generator import Segment
+        
+        tokens, tokens_mask = self._model._tokenize_segment(Segment(speaker=speaker, text=text, audio=audio))
+        return tokens.cpu(), tokens_mask.cpu()
+
+    def frames_to_context(self, text, speaker, frames):
+        """
+        Build a pre-tokenized context entry from generated frames.
+
+        The result can be passed in ``context`` alongside ``Segment`` objects
+        and is equivalent to a Segment holding the decoded audio, minus the
+        cost of re-encoding it.
+        """
+        text_tokens, text_tokens_mask = self._model._tokenize_text_segment(text, speaker)
+        
+        # (num_frames, num_codebooks) plus the EOS frame that closes every audio segment
+        codes = torch.stack(frames).cpu() if frames else torch.zeros(0, 32, dtype=torch.long)
+        codes = torch.cat([codes, torch.zeros(1, codes.size(1), dtype=torch.long)], dim=0)
+        audio_tokens = torch.zeros(codes.size(0), 33, dtype=torch.long)
+        audio_tokens_mask = torch.zeros(codes.size(0), 33, dtype=torch.bool)
+        audio_tokens[:, :-1] = codes
+        audio_tokens_mask[:, :-1] = True
+        
+        return (
+            torch.cat([text_tokens.cpu(), audio_tokens], dim=0),
+            torch.cat([text_tokens_mask.cpu(), audio_tokens_mask], dim=0)
+        )
+
+    def generate_stream(self, text, speaker, context=None, max_audio_length_ms=10000, temperature=0.9, topk=50,
+                        first_chunk_frames=4, chunk_frames=12, voice=None, stop_callback=None, cancel=None):
+        """
+        Generate speech incrementally, yielding audio chunks as frames arrive.
+
+        The first chunk is kept short to minimise time-to-first-audio; later
+        chunks are ``chunk_frames`` frames (80ms each) long. The generator
+        holds the model until it is exhausted or closed, so consume it promptly.
+        ``stop_callback`` and ``cancel`` are as for ``generate``, but a
+        runaway's repeated tail may already have been sent.
+        """
+        request = {'text': text, 'speaker': speaker, 'context': context, 'max_audio_length_ms': max_audio_length_ms,
+                   'voice': voice, 'stop_callback': stop_callback, 'cancel': cancel}
+        
+        # Mimi keeps its decoder state between calls in streaming mode, avoiding clicks at chunk edges
+        if hasattr(self._audio_tokenizer, 'streaming'):
+            decoder_state = self._audio_tokenizer.streaming(1)
+        else:
+            decoder_state = contextlib.nullcontext()
+        
+        try:
+            with self._lock, self._decode_lock, decoder_state:
+                pending = []
+                chunk_size = first_chunk_frames
+                for step in self._frame_steps([request], temperature, topk):
+                    if step[0] is not None:
+                        pending.append(step[0])
+                    if len(pending) >= chunk_size:
+                        yield self._decode_frames(pending).cpu()
+                        pending = []
+                        chunk_size = chunk_frames
+                if pending:
+                    yield self._decode_frames(pending).cpu()
+                    
+        except Exception as e:
+            logger.error(f"Error streaming speech: {str(e)}")
+            raise
+
+    def _autocast(self):
+        """Half-precision autocast on CUDA when enabled, otherwise a no-op"""
+        if self.device == "cuda" and self.use_half_precision:
+            return torch.cuda.amp.autocast()
+        return contextlib.nullcontext()
+
+    def _tokenize_prompt(self, text, speaker, context, voice=None):
+        """Tokenize the voice prompt and context segments followed by the text to generate"""
+        tokens, tokens_mask = [], []
+        if voice is not None:
+            tokens.append(voice.tokens)
+            tokens_mask.append(voice.tokens_mask)
+        for segment in context or []:
+            if isinstance(segment, tuple):
+                # Already tokenized, e.g. by frames_to_context
+                segment_tokens, segment_tokens_mask = segment
+            else:
+                segment_tokens, segment_tokens_mask = self._model._tokenize_segment(segment)
+            tokens.append(segment_tokens.cpu())
+            tokens_mask.append(segment_tokens_mask.cpu())
+
+        text_tokens, text_tokens_mask = self._model._tokenize_text_segment(text, speaker)
+        tokens.append(text_tokens.cpu())
+        tokens_mask.append(text_tokens_mask.cpu())
+
+        return torch.cat(tokens, dim=0).long(), torch.cat(tokens_mask, dim=0).bool()
+
+    def _setup_caches(self, batch_size):
+        """Resize the backbone/decoder KV caches when the batch size changes"""
+        if self._cache_batch_size != batch_size:
+            model = self._model._model
+            # torchtune skips layers whose cache is already set up, so drop the old caches first
+            for module in model.modules():
+                if getattr(module, 'kv_cache', None) is not None:
+                    module.kv_cache = None
+            model.setup_caches(batch_size)
+            self._cache_batch_size = batch_size
+
+    def _backbone_caches(self):
+        """The backbone's KV caches, or None if they cannot be snapshotted and restored"""
+        backbone = getattr(self._model._model, 'backbone', None)
+        if backbone is None:
+            return None
+        caches = [m for m in backbone.modules() if hasattr(m, 'k_cache') and hasattr(m, 'cache_pos')]
+        return caches or None
+
+    def _prefix_state(self, voice):
+        """
+        Return the backbone KV state after ``voice``'s prompt, computing it on first use.
+
+        The prompt is run once through the backbone with batch size 1 and the
+        key/value entries it leaves in each layer's cache are kept, so later
+        requests for the voice only prefill their own text. Returns None when
+        the model's caches do not support this.
+        """
+        state = self._prefix_states.get(voice.key)
+        if state is not None:
+            self._prefix_states.move_to_end(voice.key)
+            self.prefix_hits += 1
+            return state
+        if self.max_cached_prefixes <= 0 or self._backbone_caches() is None:
+            return None
+
+        model = self._model._model
+        device = next(model.parameters()).device
+        prefix_len = voice.tokens.size(0)
+        self._setup_caches(1)
+        model.reset_caches()
+
+        # The frame sampled after the prompt is thrown away, so keep it from advancing the RNG
+        with torch.random.fork_rng(devices=[device] if device.type == 'cuda' else []), self._autocast():
+            model.generate_frame(
+                voice.tokens.unsqueeze(0).to(device),
+                voice.tokens_mask.unsqueeze(0).to(device),
+                torch.arange(0, prefix_len).unsqueeze(0).long().to(device),
+                1.0,
+                1
+            )
+        state = [
+            (cache.k_cache[:, :, :prefix_len].clone(), cache.v_cache[:, :, :prefix_len].clone())
+            for cache in self._backbone_caches()
+        ]
+
+        self.prefix_misses += 1
+        self._prefix_states[voice.key] = state
+        while len(self._prefix_states) > self.max_cached_prefixes:
+            self._prefix_states.popitem(last=False)
+        return state
+
+    def _restore_prefix(self, state):
+        """Load a voice prompt's KV entries into every row of the freshly reset caches"""
+        for cache, (k, v) in zip(self._backbone_caches(), state):
+            prefix_len = k.size(2)
+            cache.k_cache[:, :, :prefix_len] = k
+            cache.v_cache[:, :, :prefix_len] = v
+            cache.cache_pos.add_(prefix_len)
+
+    def prefix_cache_stats(self):
+        """Return how often voice prompts were served from cached attention state"""
+        return {
+            'entries': len(self._prefix_states),
+            'max_entries': self.max_cached_prefixes,
+            'hits': self.prefix_hits,
+            'misses': self.prefix_misses,
+        }
+
+    def _generate_frames(self, requests, temperature, topk):
+        """Run the frame loop for a batch of requests and collect each row's frames"""
+        frames = [[] for _ in requests]
+        loop_frames = [0] * len(requests)
+        for step in self._frame_steps(requests, temperature, topk, loop_frames):
+            for request_frames, frame in zip(frames, step):
+                if frame is not None:
+                    request_frames.append(frame)
+        # Keep one cycle of a runaway loop and drop the repeats
+        return [request_frames[:len(request_frames) - n] for request_frames, n in zip(frames, loop_frames)]
+
+    @torch.inference_mode()
+    def _frame_steps(self, requests, temperature, topk, loop_frames=None):
+        """
+        Run the frame loop for a batch of requests, yielding after every step.
+
+        Each step yields one entry per request: the new frame, or None once that
+        row has finished. Prompts are left-padded with empty frames so every
+        row ends on its last text token, and the padded cache slots are masked
+        out of each row's backbone attention, so a row generates the same
+        frames as it would alone. Each row stops independently on its EOS
+        frame, its budget, or once its semantic (first codebook) tokens have
+        cycled with a short period for ``runaway_frames`` frames, which is how
+        a missed EOS or a held silence shows up. A row whose ``cancel`` is set
+        stops before the next frame. ``loop_frames``, when given, receives the
+        number of repeated frames at the end of each runaway row.
+
+        When every request uses the same voice profile, its prompt is not
+        re-run: the cached KV state is restored into all rows and only the
+        rest of each prompt is prefilled after it.
+        """
+        model = self._model._model
+        # The half-precision path moves the model after loading, so ask the weights
+        device = next(model.parameters()).device
+
+        voice = requests[0].get('voice')
+        prefix_state = None
+        if voice is not None and all(
+            r.get('voice') is not None and r['voice'].key == voice.key for r in requests
+        ):
+            prefix_state = self._prefix_state(voice)
+        prefix_len = voice.tokens.size(0) if prefix_state is not None else 0
+
+        prompts = [
+            self._tokenize_prompt(
+                r['text'], r['speaker'], r.get('context'), None if prefix_state is not None else r.get('voice')
+            )
+            for r in requests
+        ]
+        max_frames = [int(r.get('max_audio_length_ms', 10000) / FRAME_MS) for r in requests]
+
+        batch_size = len(prompts)
+        prompt_len = max(tokens.size(0) for tokens, _ in prompts)
+        max_context_len = min(prompt_token_limit(r.get('max_audio_length_ms', 10000)) for r in requests)
+        if prefix_len + prompt_len >= max_context_len:
+            raise ValueError(
+                f"Inputs too long, must be below max_seq_len - max_generation_len: {max_context_len}"
+            )
+
+        curr_tokens = torch.zeros(batch_size, prompt_len, 33, dtype=torch.long)
+        curr_tokens_mask = torch.zeros(batch_size, prompt_len, 33, dtype=torch.bool)
+        # Cache slots each row may attend to; a row's padding sits right after the shared voice prefix
+        key_valid = torch.ones(batch_size, MAX_SEQ_LEN, dtype=torch.bool)
+        for i, (tokens, tokens_mask) in enumerate(prompts):
+            padding = prompt_len - tokens.size(0)
+            curr_tokens[i, padding:] = tokens.cpu()
+            curr_tokens_mask[i, padding:] = tokens_mask.cpu()
+            key_valid[i, prefix_len:prefix_len + padding] = False
+        curr_tokens = curr_tokens.to(device)
+        curr_tokens_mask = curr_tokens_mask.to(device)
+        curr_pos = torch.arange(prefix_len, prefix_len + prompt_len).unsqueeze(0).repeat(batch_size, 1).long().to(device)
+
+        self._setup_caches(batch_size)
+        model.reset_caches()
+        if prefix_state is not None:
+            self._restore_prefix(prefix_state)
+
+        num_frames = [0] * batch_size
+        done = [False] * batch_size
+        progress = [r.get('progress_callback') for r in requests]
+        cancels = [r.get('cancel') for r in requests]
+        estimated_frames = [estimate_frames(r['text'], limit) for r, limit in zip(requests, max_frames)]
+        semantic = [collections.deque(maxlen=self.runaway_frames) for _ in range(batch_size)]
+
+        def stop(i, reason):
+            done[i] = True
+            callback = requests[i].get('stop_callback')
+            if callback is not None:
+                callback(reason, num_frames[i])
+
+        # Padding only exists when prompt lengths differ
+        with self._key_padding(None if key_valid.all() else key_valid.to(device)):
+            for _ in range(max(max_frames)):
+                for i, cancel in enumerate(cancels):
+                    if not done[i] and cancel is not None and cancel.is_set():
+                        stop(i, 'cancelled')
+                if all(done):
+                    break
+                with self._autocast():
+                    sample = model.generate_frame(curr_tokens, curr_tokens_mask, curr_pos, temperature, topk)
+                eos = torch.all(sample == 0, dim=1).tolist()
+                semantic_tokens = sample[:, 0].tolist() if self.runaway_frames > 0 else None
+
+                step = [None] * batch_size
+                for i in range(batch_size):
+                    if done[i]:
+                        continue
+                    if eos[i]:
+                        stop(i, 'eos')
+                        continue
+                    step[i] = sample[i]
+                    num_frames[i] += 1
+                    if semantic_tokens is not None:
+                        semantic[i].append(semantic_tokens[i])
+                        period = find_loop(semantic[i], self.runaway_frames)
+                        if period is not None:
+                            if loop_frames is not None:
+                                loop_frames[i] = self.runaway_frames - period
+                            stop(i, 'runaway')
+                            continue
+                    if num_frames[i] >= max_frames[i]:
+                        stop(i, 'budget')
+                for i, callback in enumerate(progress):
+                    if callback is not None and (step[i] is not None or done[i]):
+                        # Past the estimate, the total stays one frame ahead until the row finishes
+                        total = num_frames[i] if done[i] else max(estimated_frames[i], num_frames[i] + 1)
+                        callback(num_frames[i], total)
+                        if done[i]:
+                            progress[i] = None
+                yield step
+                if all(done):
+                    break
+
+                # Finished rows keep decoding alongside the others but their frames are dropped
+                padding = torch.zeros(batch_size, 1, dtype=torch.long, device=device)
+                curr_tokens = torch.cat([sample, padding], dim=1).unsqueeze(1)
+                curr_tokens_mask = torch.cat(
+                    [torch.ones_like(sample).bool(), padding.bool()], dim=1
+                ).unsqueeze(1)
+                curr_pos = curr_pos[:, -1:] + 1
+
+    @contextlib.contextmanager
+    def _key_padding(self, key_valid):
+        """
+        Mask cache slots out of the backbone's attention while the block runs.
+
+        ``key_valid`` is a (batch, MAX_SEQ_LEN) bool tensor, or None for no
+        padding. The upstream model builds its backbone mask from the causal
+        mask alone, so it is narrowed on the way into the backbone.
+        """
+        backbone = getattr(self._model._model, 'backbone', None)
+        if key_valid is None or backbone is None:
+            yield
+            return
+
+        def mask_padding(module, args, kwargs):
+            mask = kwargs.get('mask')
+            if mask is not None:
+                kwargs['mask'] = mask & key_valid[:, None, :mask.size(-1)]
+            return args, kwargs
+
+        handle = backbone.register_forward_pre_hook(mask_padding, with_kwargs=True)
+        try:
+            yield
+        finally:
+            handle.remove()
+
+    def _decode_frames(self, frames):
+        """Decode audio tokens to a waveform and apply the CSM watermark"""
+        return self._watermark(self._decode_tokens(frames))
+
+    @torch.inference_mode()
+    def _decode_tokens(self, frames):
+        """Decode audio tokens to a waveform with the audio tokenizer"""
+        if not frames:
+            return torch.zeros(0)
+
+        # (num_codebooks, num_frames) -> (1, num_codebooks, num_frames)
+        # The audio tokenizer stays wherever the generator was loaded
+        codes = torch.stack(frames).permute(1, 0).unsqueeze(0).to(self._model.device)
+        return self._audio_tokenizer.decode(codes).squeeze(0).squeeze(0)
+
+    @torch.inference_mode()
+    def _watermark(self, audio):
+        """Apply the CSM watermark, returning audio at the generator's sample rate"""
+        from watermarking import CSM_1B_GH_WATERMARK, watermark
+        
+        if audio.numel() == 0:
+            return audio
+
+        # This applies an imperceptible watermark to identify audio as AI-generated.
+        audio, wm_sample_rate = watermark(self._watermarker, audio, self.sample_rate, CSM_1B_GH_WATERMARK)
+        return torchaudio.functional.resample(audio, orig_freq=wm_sample_rate, new_freq=self.sample_rate)
     
     def cleanup(self):
         """Clean up memory"""
@@ -136,6 +763,17 @@ class CSMGenerator:
             torch.cuda.ipc_collect()
         gc.collect()
 
-def load_csm_generator(device="cpu", use_half_precision=False):
+def model_id_for(device, use_half_precision, quantization="none"):
+    """Identify the weights and precision a generator with these settings would use"""
+    precision = "fp16" if device == "cuda" and use_half_precision else "bf16"
+    if device == "cpu" and quantization != "none":
+        precision = quantization
+    return f"csm-1b/{device}/{precision}"
+
+def load_csm_generator(device="cpu", use_half_precision=False, max_cached_prefixes=4, snapshot_dir=None,
+                       runaway_frames=25, quantization="none"):
     """Load the CSM generator with memory optimizations"""
-    return CSMGenerator(device=device, use_half_precision=use_half_precision)
\ No newline at end of file
+    return CSMGenerator(
+        device=device, use_half_precision=use_half_precision, max_cached_prefixes=max_cached_prefixes,
+        snapshot_dir=snapshot_dir, runaway_frames=runaway_frames, quantization=quantization
+    )
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Per-request generation budgets from the length of the text, calibrated per voice
+"""
+import threading
+
+# Extra spoken length, in characters, of the pause each punctuation mark introduces
+PAUSE_CHARS = {',': 2, ';': 3, ':': 3, '.': 4, '!': 4, '?': 4, '\n': 4}
+
+
+def spoken_chars(text):
+    """Count letters and digits, plus a character-equivalent for every pause, as a proxy for phonemes"""
+    return sum(1 if c.isalnum() else PAUSE_CHARS.get(c, 0) for c in text)
+
+
+class DurationEstimator:
+    """
+    Predicts how long the speech for a text will be and turns that into a frame budget.
+
+    Every voice (a built-in speaker or a voice profile) has its own ratio of
+    seconds per spoken character, starting from ``seconds_per_char`` and
+    moved towards each finished generation that ended on its own EOS frame.
+    The budget is the prediction times ``margin`` plus ``slack_ms``, capped
+    at ``max_ms``, so a prompt that misses EOS stops long before the cap
+    while normal variation in pace never reaches the budget.
+    """
+
+    def __init__(self, seconds_per_char=0.08, margin=1.5, slack_ms=1000, max_ms=20_000, smoothing=0.1,
+                 ratio_bounds=(0.03, 0.3)):
+        self.seconds_per_char = seconds_per_char
+        self.margin = margin
+        self.slack_ms = slack_ms
+        self.max_ms = max_ms
+        self.smoothing = smoothing
+        # Observations outside these bounds are clipped, so one glitch cannot shrink every later budget
+        self.ratio_bounds = ratio_bounds
+
+        self._ratios = {}
+        self._observations = {}
+        self._lock = threading.Lock()
+
+    def ratio(self, voice):
+        """Seconds per spoken character for ``voice``"""
+        with self._lock:
+            return self._ratios.get(voice, self.seconds_per_char)
+
+    def estimate_ms(self, text, voice):
+        """Expected length of the speech for ``text``, in milliseconds"""
+        return spoken_chars(text) * self.ratio(voice) * 1000
+
+    def budget_ms(self, text, voice):
+        """Longest audio to generate for ``text`` before cutting it off"""
+        return min(self.max_ms, self.estimate_ms(text, voice) * self.margin + self.slack_ms)
+
+    def observe(self, text, voice, audio_ms):
+        """Calibrate ``voice`` from a generation of ``text`` that ended naturally after ``audio_ms``"""
+        chars = spoken_chars(text)
+        if chars == 0:
+            return
+        low, high = self.ratio_bounds
+        observed = min(high, max(low, audio_ms / 1000 / chars))
+        with self._lock:
+            count = self._observations.get(voice, 0)
+            current = self._ratios.get(voice, self.seconds_per_char)
+            # Average the first few exactly, then track drift with an exponential moving average
+            weight = max(self.smoothing, 1 / (count + 1))
+            self._ratios[voice] = current + weight * (observed - current)
+            self._observations[voice] = count + 1
+
+    def stats(self):
+        """Return the settings and the calibrated ratio of every voice seen so far"""
+        with self._lock:
+            return {
+                'default_seconds_per_char': self.seconds_per_char,
+                'margin': self.margin,
+                'slack_ms': self.slack_ms,
+                'max_ms': self.max_ms,
+                'voices': {
+                    str(voice): {'seconds_per_char': round(ratio, 4), 'observations': self._observations[voice]}
+                    for voice, ratio in self._ratios.items()
+                },
+            }
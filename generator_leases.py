@@ -0,0 +1,58 @@
+"""
+Reference counts of the jobs using each model generator, so a replaced one is released only once idle
+"""
+import collections
+import threading
+import time
+
+
+class GeneratorLeases:
+    """
+    Tracks how many jobs hold each generator.
+
+    A job calls ``acquire`` when it picks up the serving generator and
+    ``release`` when it is done with it. After a new generator takes over,
+    ``wait_idle`` blocks until the old one's last job has released it, so
+    it can be freed without failing the jobs still running on it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._counts = collections.Counter()
+
+    def acquire(self, generator):
+        with self._cond:
+            self._counts[id(generator)] += 1
+
+    def release(self, generator):
+        with self._cond:
+            self._counts[id(generator)] -= 1
+            if self._counts[id(generator)] <= 0:
+                del self._counts[id(generator)]
+            self._cond.notify_all()
+
+    def in_use(self, generator):
+        """Number of jobs currently holding ``generator``"""
+        with self._cond:
+            return self._counts.get(id(generator), 0)
+
+    def wait_idle(self, generator, timeout=None, on_change=None):
+        """
+        Block until no job holds ``generator``; return False if ``timeout`` passes first.
+
+        ``on_change(count)`` is called with the number of holders whenever it changes.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            last = None
+            while True:
+                count = self._counts.get(id(generator), 0)
+                if count != last and on_change is not None:
+                    on_change(count)
+                last = count
+                if count == 0:
+                    return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
@@ -0,0 +1,66 @@
+"""
+Change notifications for job status, served to clients as Server-Sent Events
+"""
+import asyncio
+import json
+import threading
+
+
+def format_event(event, data):
+    """Encode one Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Sent while nothing changes, so proxies do not close an idle event stream
+KEEPALIVE = ": keep-alive\n\n"
+
+
+class JobEvents:
+    """
+    Wakes event-stream listeners whenever any job changes.
+
+    Publishers call ``publish`` after updating a job; listeners keep the
+    version they last saw and block in ``wait`` (or await ``wait_async`` on
+    an event loop) until it moves on. One shared version covers every job,
+    because starting one job also moves the queue position of every job
+    behind it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._async_waiters = set()
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self):
+        """Record that a job changed and wake all listeners"""
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+            for loop, event in self._async_waiters:
+                loop.call_soon_threadsafe(event.set)
+
+    def wait(self, version, timeout):
+        """Block until the version differs from ``version`` or ``timeout`` passes; return the current version"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    async def wait_async(self, version, timeout):
+        """Like ``wait``, but suspends the calling coroutine instead of blocking its thread"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            if self._version != version:
+                return self._version
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+        return self._version
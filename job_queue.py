@@ -0,0 +1,220 @@
+"""
+Bounded job queue with priority classes and deadlines, feeding a fixed pool of inference workers
+"""
+import collections
+import logging
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Scheduling classes, highest first: interactive jobs always run before queued bulk work
+PRIORITIES = ('interactive', 'bulk')
+
+
+class QueueFullError(Exception):
+    """Raised when the queue is at capacity and cannot accept another job"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class CancelToken:
+    """
+    Tells a job to stop: set by ``cancel`` or once ``deadline`` (a ``time.time()`` value) passes.
+
+    The model checks ``is_set`` between frames, so a running generation stops
+    within one frame. ``reason`` is ``'cancelled'`` or ``'deadline'`` once set.
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason='cancelled'):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def is_set(self):
+        if not self._event.is_set() and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel('deadline')
+        return self._event.is_set()
+
+
+class JobQueue:
+    """
+    Bounded queue drained by a fixed number of worker threads.
+
+    Every worker calls ``handler(job_id, *args)`` for one job at a time, so the
+    amount of concurrent model work is capped at ``num_workers`` no matter how
+    many requests arrive. When ``max_size`` jobs are already waiting,
+    ``submit`` raises ``QueueFullError`` instead of accepting more work.
+
+    Jobs wait in one FIFO per priority class, and workers take from the
+    ``interactive`` FIFO before touching ``bulk`` work. A job may carry a
+    deadline and an estimate of how long it runs; when a worker looks for
+    work, jobs that could no longer finish in time are dropped and handed
+    to ``on_expired(job_id)`` instead of being run.
+    """
+
+    def __init__(self, handler, max_size=16, num_workers=1, on_expired=None):
+        self.handler = handler
+        self.max_size = max_size
+        self.num_workers = num_workers
+        self.on_expired = on_expired
+
+        self._pending = {priority: collections.deque() for priority in PRIORITIES}
+        self._running = set()
+        self._cond = threading.Condition()
+        self._workers = []
+        self.expired = 0
+        self.cancelled = 0
+
+        # Moving average of how long a job holds a worker, used for Retry-After
+        self._avg_service_time = None
+
+    def _ensure_started(self):
+        """Start the worker threads on first use"""
+        if self._workers:
+            return
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"inference-worker-{i}")
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {self.num_workers} inference worker(s), queue size {self.max_size}")
+
+    def submit(self, job_id, *args, task=None, priority='interactive', deadline=None, expected_seconds=0.0):
+        """
+        Enqueue a job and return its position in the queue (0 = next to run).
+
+        ``task`` replaces the default handler for this job only. A job with a
+        ``deadline`` (a ``time.time()`` value) is dropped if it cannot start
+        at least ``expected_seconds`` before it.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        with self._cond:
+            self._ensure_started()
+            if self._queued() >= self.max_size:
+                raise QueueFullError(self.retry_after())
+            self._pending[priority].append((job_id, task or self.handler, args, deadline, expected_seconds))
+            self._cond.notify()
+            return self._position(job_id)
+
+    def cancel(self, job_id):
+        """Remove a job that is still waiting; return False if it already started or is unknown"""
+        with self._cond:
+            for pending in self._pending.values():
+                for entry in pending:
+                    if entry[0] == job_id:
+                        pending.remove(entry)
+                        self.cancelled += 1
+                        return True
+        return False
+
+    def prioritize(self, job_id, priority):
+        """Move a waiting job to the back of ``priority``'s FIFO, unless it is already in that class"""
+        with self._cond:
+            for current, pending in self._pending.items():
+                for entry in pending:
+                    if entry[0] == job_id:
+                        if current != priority:
+                            pending.remove(entry)
+                            self._pending[priority].append(entry)
+                        return True
+        return False
+
+    def position(self, job_id):
+        """Return the queue position of a waiting job, or None if it is not waiting"""
+        with self._cond:
+            return self._position(job_id)
+
+    def _position(self, job_id):
+        i = 0
+        for priority in PRIORITIES:
+            for entry in self._pending[priority]:
+                if entry[0] == job_id:
+                    return i
+                i += 1
+        return None
+
+    def _queued(self):
+        return sum(len(pending) for pending in self._pending.values())
+
+    def _take(self):
+        """Pop the next job to run and every job that can no longer meet its deadline; call with the lock held"""
+        now = time.time()
+        expired = []
+        for priority in PRIORITIES:
+            pending = self._pending[priority]
+            for entry in list(pending):
+                deadline, expected_seconds = entry[3], entry[4]
+                if deadline is not None and now + expected_seconds > deadline:
+                    pending.remove(entry)
+                    expired.append(entry[0])
+        for priority in PRIORITIES:
+            if self._pending[priority]:
+                return self._pending[priority].popleft(), expired
+        return None, expired
+
+    def retry_after(self):
+        """Estimate how many seconds until a queue slot frees up"""
+        service_time = self._avg_service_time or 1.0
+        return max(1, int(round(service_time / max(1, self.num_workers))))
+
+    def stats(self):
+        """Return a snapshot of queue depth and worker usage"""
+        with self._cond:
+            return {
+                'queued': self._queued(),
+                'queued_by_priority': {priority: len(pending) for priority, pending in self._pending.items()},
+                'expired': self.expired,
+                'cancelled': self.cancelled,
+                'running': len(self._running),
+                'max_size': self.max_size,
+                'workers': self.num_workers,
+                'avg_service_time': self._avg_service_time,
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._queued():
+                    self._cond.wait()
+                # Either a job to run or at least one expired job comes back
+                entry, expired = self._take()
+                self.expired += len(expired)
+                if entry is not None:
+                    job_id, handler, args = entry[:3]
+                    self._running.add(job_id)
+
+            for expired_id in expired:
+                logger.info(f"Dropping job {expired_id}, it can no longer meet its deadline")
+                if self.on_expired is not None:
+                    try:
+                        self.on_expired(expired_id)
+                    except Exception as e:
+                        logger.error(f"Error expiring job {expired_id}: {str(e)}")
+                        logger.error("Stack trace:", exc_info=True)
+            if entry is None:
+                continue
+
+            start = time.time()
+            try:
+                handler(job_id, *args)
+            except Exception as e:
+                logger.error(f"Unhandled error in job {job_id}: {str(e)}")
+                logger.error("Stack trace:", exc_info=True)
+            finally:
+                elapsed = time.time() - start
+                with self._cond:
+                    self._running.discard(job_id)
+                    if self._avg_service_time is None:
+                        self._avg_service_time = elapsed
+                    else:
+                        self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * elapsed
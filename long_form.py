@@ -0,0 +1,192 @@
+"""
+Long-form synthesis: sentence segmentation, pipelined generation and crossfaded concatenation
+"""
+import functools
+import logging
+import queue
+import re
+import threading
+
+import soundfile as sf
+import torch
+
+from audio_effects import TimeStretcher
+from csm_generator import max_text_tokens, prompt_token_limit
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Sentence ends, then clause boundaries, used in that order to split long text
+SENTENCE_END = re.compile(r'(?<=[.!?…])["\')\]]*\s+')
+CLAUSE_END = re.compile(r'(?<=[,;:—])\s+')
+
+
+def split_text(text, max_chars=200):
+    """Split text into sentence-sized segments of at most ``max_chars`` characters"""
+    segments = []
+    for sentence in SENTENCE_END.split(" ".join(text.split())):
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            segments.append(sentence)
+            continue
+
+        # Break long sentences at clause boundaries, then at word boundaries
+        current = ""
+        for clause in CLAUSE_END.split(sentence):
+            for word in clause.split(" "):
+                candidate = f"{current} {word}" if current else word
+                if len(candidate) > max_chars and current:
+                    segments.append(current)
+                    current = word
+                else:
+                    current = candidate
+            if len(current) > max_chars // 2:
+                segments.append(current)
+                current = ""
+        if current:
+            segments.append(current)
+    return segments
+
+
+class LongFormSynthesizer:
+    """
+    Synthesizes arbitrarily long text one segment at a time.
+
+    The calling thread generates frames for segment N+1 while a writer thread
+    decodes segment N, crossfades it onto the previous one and appends it to
+    the output file. Only the last ``context_segments`` segments are fed back
+    as context, fewer if a long voice prompt leaves no room for them, and at
+    most ``max_pending`` undecoded segments are buffered, so memory use does
+    not grow with the length of the document.
+    """
+
+    def __init__(self, generator, context_segments=2, crossfade_ms=40, max_segment_ms=20_000, max_pending=2):
+        self.generator = generator
+        self.context_segments = context_segments
+        self.crossfade_ms = crossfade_ms
+        self.max_segment_ms = max_segment_ms
+        self.max_pending = max_pending
+
+    def synthesize(self, text, speaker, output_path, temperature=0.9, topk=50, speed=1.0, progress_callback=None,
+                   max_chars=200, voice=None, cancel=None, budget_ms=None, stop_callback=None):
+        """
+        Synthesize ``text`` into a WAV file at ``output_path``.
+
+        ``speed`` changes the tempo of the stitched audio as it is written, in
+        one continuous stretch, so no seam is left at the segment joins.
+        ``progress_callback(done, total)`` is called after each
+        segment is written. ``voice`` is a ``VoiceProfile`` whose prompt
+        precedes the context of every segment. Once ``cancel`` (anything
+        with ``is_set()``) is set, the current segment stops between frames
+        and no further segments are generated. ``budget_ms(segment_text)``
+        sizes each segment's frame budget, capped at ``max_segment_ms``, which
+        every segment gets without it. ``stop_callback(segment_text, reason,
+        frames)`` is called as each segment's generation stops. Returns the
+        number of samples written.
+        """
+        segments = split_text(text, max_chars=max_chars)
+        if not segments:
+            raise ValueError("No text to synthesize")
+        logger.info(f"Long-form synthesis of {len(text)} chars in {len(segments)} segment(s)")
+
+        pending = queue.Queue(maxsize=self.max_pending)
+        writer_state = {'samples': 0, 'error': None}
+        writer = threading.Thread(
+            target=self._write_segments,
+            args=(pending, output_path, len(segments), speed, progress_callback, writer_state)
+        )
+        writer.daemon = True
+        writer.start()
+
+        context = []
+        try:
+            for segment_text in segments:
+                if writer_state['error'] is not None or (cancel is not None and cancel.is_set()):
+                    break
+                segment_ms = self.max_segment_ms
+                if budget_ms is not None:
+                    segment_ms = min(segment_ms, budget_ms(segment_text))
+                context = self._fit_context(segment_text, speaker, context, voice, segment_ms)
+                frames = self.generator.generate_frames(
+                    text=segment_text,
+                    speaker=speaker,
+                    context=context,
+                    max_audio_length_ms=segment_ms,
+                    temperature=temperature,
+                    topk=topk,
+                    voice=voice,
+                    stop_callback=None if stop_callback is None else functools.partial(stop_callback, segment_text),
+                    cancel=cancel,
+                )
+                pending.put(frames)
+
+                # Condition the next segment on the most recent ones to keep the voice consistent
+                context.append(self.generator.frames_to_context(segment_text, speaker, frames))
+                context = context[-self.context_segments:]
+        finally:
+            pending.put(None)
+            writer.join()
+
+        if writer_state['error'] is not None:
+            raise writer_state['error']
+        return writer_state['samples']
+
+    def _fit_context(self, text, speaker, context, voice, max_audio_length_ms):
+        """Drop the oldest context segments until the prompt fits in the model's sequence with its frames"""
+        limit = prompt_token_limit(max_audio_length_ms)
+        fixed = max_text_tokens(text, speaker) + (voice.tokens.size(0) if voice is not None else 0)
+        while context and fixed + sum(tokens.size(0) for tokens, _ in context) >= limit:
+            context = context[1:]
+        return context
+
+    def _write_segments(self, pending, output_path, total, speed, progress_callback, state):
+        """Decode, crossfade, stretch and append segments until the sentinel arrives"""
+        sample_rate = self.generator.sample_rate
+        stretcher = TimeStretcher(sample_rate, speed)
+        fade_len = int(sample_rate * self.crossfade_ms / 1000)
+        tail = None
+        done = 0
+        finished = False
+
+        try:
+            with sf.SoundFile(output_path, 'w', samplerate=sample_rate, channels=1, subtype='FLOAT') as out:
+                while True:
+                    frames = pending.get()
+                    if frames is None:
+                        finished = True
+                        break
+
+                    audio = self.generator.decode_frames(frames)
+
+                    if tail is not None:
+                        overlap = min(fade_len, tail.shape[0], audio.shape[0])
+                        if overlap > 0:
+                            fade_in = torch.linspace(0.0, 1.0, overlap)
+                            mixed = tail[tail.shape[0] - overlap:] * (1.0 - fade_in) + audio[:overlap] * fade_in
+                            audio = torch.cat([tail[:tail.shape[0] - overlap], mixed, audio[overlap:]])
+                        else:
+                            audio = torch.cat([tail, audio])
+
+                    # Hold back the end of this segment to crossfade it with the next one
+                    keep = min(fade_len, audio.shape[0])
+                    head, tail = audio[:audio.shape[0] - keep], audio[audio.shape[0] - keep:]
+                    head = stretcher.process(head)
+                    out.write(head.numpy())
+                    state['samples'] += head.shape[0]
+
+                    done += 1
+                    if progress_callback is not None:
+                        progress_callback(done, total)
+
+                if tail is not None:
+                    tail = torch.cat([stretcher.process(tail), stretcher.flush()])
+                    out.write(tail.numpy())
+                    state['samples'] += tail.shape[0]
+
+        except Exception as e:
+            logger.error(f"Error writing long-form audio: {str(e)}")
+            state['error'] = e
+            # Keep draining so the generating thread never blocks on a full queue
+            while not finished and pending.get() is not None:
+                pass
@@ -0,0 +1,122 @@
+"""
+Pressure-driven memory reclamation instead of unconditional gc/empty_cache calls
+"""
+import gc
+import logging
+import os
+import resource
+import threading
+import time
+
+import torch
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _total_system_memory():
+    """Total physical memory in bytes, or None if it cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # No procfs (e.g. macOS): fall back to the peak, which ru_maxrss reports in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class MemoryManager:
+    """
+    Reclaims memory only when usage crosses a high-water mark.
+
+    A full ``gc.collect()`` costs latency, and ``torch.cuda.empty_cache()``
+    hands blocks back to the driver that the caching allocator would
+    otherwise reuse for the next request. Instead, ``maybe_reclaim`` checks
+    process RSS and, on CUDA, reserved allocator memory against configurable
+    limits, and only then collects. It counts how often that happened and
+    how long it took.
+    """
+
+    def __init__(self, rss_high_water_bytes=None, cuda_high_water_fraction=0.7):
+        if rss_high_water_bytes is None:
+            total = _total_system_memory()
+            rss_high_water_bytes = int(total * 0.8) if total else None
+        self.rss_high_water_bytes = rss_high_water_bytes
+        self.cuda_high_water_fraction = cuda_high_water_fraction
+
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.reclaims = 0
+        self.reclaim_seconds = 0.0
+        self.last_reclaim_reason = None
+        self.rss_freed_bytes = 0
+
+    def _cuda_pressure(self):
+        """Fraction of device memory held by the caching allocator"""
+        if not torch.cuda.is_available():
+            return None
+        total = torch.cuda.get_device_properties(0).total_memory
+        return torch.cuda.memory_reserved(0) / total
+
+    def pressure_reason(self):
+        """Return why memory should be reclaimed now, or None if usage is fine"""
+        if self.rss_high_water_bytes and current_rss() > self.rss_high_water_bytes:
+            return 'rss'
+        cuda_pressure = self._cuda_pressure()
+        if cuda_pressure is not None and cuda_pressure > self.cuda_high_water_fraction:
+            return 'cuda'
+        return None
+
+    def maybe_reclaim(self):
+        """Reclaim memory if a high-water mark has been crossed; returns whether it did"""
+        with self._lock:
+            self.checks += 1
+        reason = self.pressure_reason()
+        if reason is None:
+            return False
+        self.reclaim(reason)
+        return True
+
+    def reclaim(self, reason='manual'):
+        """Run a full collection and release cached CUDA blocks"""
+        with self._lock:
+            rss_before = current_rss()
+            start = time.perf_counter()
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+                torch.cuda.ipc_collect()
+            elapsed = time.perf_counter() - start
+
+            self.reclaims += 1
+            self.reclaim_seconds += elapsed
+            self.last_reclaim_reason = reason
+            self.rss_freed_bytes += max(0, rss_before - current_rss())
+        logger.info(f"Reclaimed memory ({reason}) in {elapsed * 1000:.1f}ms")
+
+    def stats(self):
+        """Return usage, limits and reclamation counters"""
+        with self._lock:
+            stats = {
+                'rss_mb': current_rss() / (1024 ** 2),
+                'rss_high_water_mb': self.rss_high_water_bytes / (1024 ** 2) if self.rss_high_water_bytes else None,
+                'checks': self.checks,
+                'reclaims': self.reclaims,
+                'reclaim_seconds_total': self.reclaim_seconds,
+                'reclaim_ms_avg': self.reclaim_seconds * 1000 / self.reclaims if self.reclaims else 0.0,
+                'last_reclaim_reason': self.last_reclaim_reason,
+                'rss_freed_mb': self.rss_freed_bytes / (1024 ** 2),
+            }
+        cuda_pressure = self._cuda_pressure()
+        if cuda_pressure is not None:
+            stats['cuda_reserved_fraction'] = cuda_pressure
+            stats['cuda_high_water_fraction'] = self.cuda_high_water_fraction
+        return stats
@@ -0,0 +1,283 @@
+"""
+On-demand profiling of synthesis jobs: torch operator traces and sampled Python stacks
+"""
+import collections
+import json
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+import uuid
+
+import torch
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Files written for each capture, by kind
+CAPTURE_FILES = {
+    # torch compresses the trace for a .gz path; Perfetto and chrome://tracing open it as is
+    'trace': '.trace.json.gz',
+    'pstats': '.pstats',
+}
+
+
+def _frame_key(code):
+    """Identify a function the way ``pstats`` does"""
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of a set of threads at a fixed interval.
+
+    Unlike ``cProfile`` it adds nothing to the profiled threads themselves,
+    and it sees every thread it is given rather than only the one it was
+    started on. ``get_threads`` is called before every sample, so threads
+    that start during the capture are sampled too. ``stats()`` returns the
+    samples in the format ``pstats`` loads, counting each sample as one call
+    lasting one interval.
+    """
+
+    def __init__(self, get_threads, interval=0.005):
+        self.get_threads = get_threads
+        self.interval = interval
+        self.samples = 0
+        # function -> [samples in the stack, samples at the top, {caller: samples}]
+        self._functions = collections.defaultdict(lambda: [0, 0, collections.Counter()])
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread in self.get_threads():
+                frame = frames.get(thread.ident)
+                if frame is not None:
+                    self._record(frame)
+
+    def _record(self, frame):
+        self.samples += 1
+        self._functions[_frame_key(frame.f_code)][1] += 1
+        seen = set()
+        while frame is not None:
+            key = _frame_key(frame.f_code)
+            # Recursive calls count once per sample, like cProfile's cumulative time
+            if key not in seen:
+                seen.add(key)
+                self._functions[key][0] += 1
+            if frame.f_back is not None:
+                self._functions[key][2][_frame_key(frame.f_back.f_code)] += 1
+            frame = frame.f_back
+
+    def stats(self):
+        """The samples as a ``pstats`` stats dict"""
+        stats = {}
+        for key, (total, top, callers) in self._functions.items():
+            stats[key] = (
+                total, total, top * self.interval, total * self.interval,
+                {caller: (n, n, 0.0, n * self.interval) for caller, n in callers.items()}
+            )
+        return stats
+
+
+class JobProfiler:
+    """
+    Profiles the next jobs to start once armed, keeping the last few captures on disk.
+
+    ``arm`` covers the next ``jobs`` jobs, the jobs that start in the next
+    ``seconds``, or whichever runs out first. Each profiled job gets a torch
+    profiler trace (Chrome trace format) and a sampled Python profile
+    (``pstats`` format) of the threads it runs on. Only one job is profiled
+    at a time, so jobs that start while another is being captured run
+    unprofiled and do not use up the armed count.
+
+    Jobs that start while a capture runs are listed in its
+    ``concurrent_jobs``: in a micro-batch they share the profiled job's
+    engine threads, so their work shows up in its trace.
+
+    ``start`` returns None straight away when the profiler is neither armed
+    nor capturing, so jobs pay nothing for it then. Captures beyond ``keep``
+    are deleted, oldest first; the ones already on disk are picked up again
+    on restart.
+    """
+
+    def __init__(self, directory, keep=10, sample_interval=0.005):
+        self.directory = directory
+        self.keep = keep
+        self.sample_interval = sample_interval
+
+        self._lock = threading.Lock()
+        self._armed = None
+        self._active = None
+        self._concurrent_jobs = []
+        self._captures = collections.OrderedDict()
+        self._load_captures()
+
+    def _load_captures(self):
+        if not os.path.isdir(self.directory):
+            return
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    found.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable profile {name}: {str(e)}")
+        for capture in sorted(found, key=lambda c: c['started_at']):
+            self._captures[capture['id']] = capture
+        self._trim()
+
+    def arm(self, jobs=None, seconds=None):
+        """Profile the next ``jobs`` jobs and/or the jobs starting in the next ``seconds``"""
+        if jobs is None and seconds is None:
+            raise ValueError("Give a number of jobs, a number of seconds or both")
+        with self._lock:
+            self._armed = {
+                'jobs_left': jobs,
+                'until': time.time() + seconds if seconds is not None else None,
+            }
+            return dict(self._armed)
+
+    def disarm(self):
+        with self._lock:
+            self._armed = None
+
+    def _armed_state(self):
+        """The arming settings, or None once they have run out; call with the lock held"""
+        armed = self._armed
+        if armed is not None and armed['until'] is not None and time.time() >= armed['until']:
+            self._armed = armed = None
+        return armed
+
+    def start(self, job_id, threads=list):
+        """
+        Start profiling ``job_id`` if the profiler is armed and idle, returning the capture or None.
+
+        ``threads`` returns the threads besides the caller's whose Python
+        stacks are sampled, such as the batching engine's. Pass the capture to
+        ``finish`` from the same thread once the job is done.
+        """
+        if self._armed is None and self._active is None:
+            return None
+        with self._lock:
+            if self._active is not None:
+                self._concurrent_jobs.append(job_id)
+                return None
+            armed = self._armed_state()
+            if armed is None:
+                return None
+            if armed['jobs_left'] is not None:
+                armed['jobs_left'] -= 1
+                if armed['jobs_left'] <= 0:
+                    self._armed = None
+            capture = self._active = {
+                'id': uuid.uuid4().hex[:12],
+                'job_id': job_id,
+                'started_at': time.time(),
+            }
+            self._concurrent_jobs = []
+
+        try:
+            caller = threading.current_thread()
+            capture['sampler'] = StackSampler(lambda: [caller] + threads(), self.sample_interval)
+            capture['torch'] = torch.profiler.profile(activities=self._activities(), **self._all_threads())
+            capture['torch'].start()
+            capture['sampler'].start()
+            capture['perf_start'] = time.perf_counter()
+        except Exception as e:
+            logger.error(f"Error starting profiler for job {job_id}: {str(e)}")
+            logger.error("Stack trace:", exc_info=True)
+            with self._lock:
+                self._active = None
+            return None
+        return capture
+
+    def finish(self, capture):
+        """Stop a capture from ``start`` and write its files; never raises, so jobs are unaffected"""
+        try:
+            duration = time.perf_counter() - capture.pop('perf_start')
+            sampler, profile = capture.pop('sampler'), capture.pop('torch')
+            sampler.stop()
+            profile.stop()
+            with self._lock:
+                capture['concurrent_jobs'], self._concurrent_jobs = self._concurrent_jobs, []
+
+            os.makedirs(self.directory, exist_ok=True)
+            profile.export_chrome_trace(self.path(capture['id'], 'trace'))
+            with open(self.path(capture['id'], 'pstats'), 'wb') as f:
+                marshal.dump(sampler.stats(), f)
+
+            capture.update({
+                'duration_seconds': duration,
+                'python_samples': sampler.samples,
+                'sizes': {kind: os.path.getsize(self.path(capture['id'], kind)) for kind in CAPTURE_FILES},
+            })
+            # The metadata goes last, so a capture is only picked up on restart once complete
+            with open(os.path.join(self.directory, capture['id'] + '.json'), 'w') as f:
+                json.dump(capture, f)
+            logger.info(f"Profiled job {capture['job_id']} in {duration:.2f}s as {capture['id']}")
+
+            with self._lock:
+                self._captures[capture['id']] = capture
+                self._trim()
+        except Exception as e:
+            logger.error(f"Error saving profile of job {capture['job_id']}: {str(e)}")
+            logger.error("Stack trace:", exc_info=True)
+        finally:
+            with self._lock:
+                self._active = None
+
+    def _trim(self):
+        while len(self._captures) > self.keep:
+            capture_id, _ = self._captures.popitem(last=False)
+            for path in [self.path(capture_id, kind) for kind in CAPTURE_FILES] + [
+                os.path.join(self.directory, capture_id + '.json')
+            ]:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def path(self, capture_id, kind):
+        """Path of one of a capture's files; ``kind`` is a key of ``CAPTURE_FILES``"""
+        return os.path.join(self.directory, capture_id + CAPTURE_FILES[kind])
+
+    def get(self, capture_id):
+        with self._lock:
+            return self._captures.get(capture_id)
+
+    def stats(self):
+        with self._lock:
+            armed = self._armed_state()
+            return {
+                'armed': dict(armed) if armed is not None else None,
+                'profiling_job': self._active['job_id'] if self._active is not None else None,
+                'keep': self.keep,
+                'captures': [dict(capture) for capture in reversed(self._captures.values())],
+            }
+
+    def _activities(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        return activities
+
+    def _all_threads(self):
+        """Record operators from every thread, e.g. the post-processing one, where torch supports it"""
+        try:
+            return {'experimental_config': torch._C._profiler._ExperimentalConfig(profile_all_threads=True)}
+        except (AttributeError, TypeError):
+            return {}
@@ -0,0 +1,415 @@
+"""
+Model replicas in worker processes, with least-loaded routing and crash recovery
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+import replica_worker
+from long_form import split_text
+from replica_worker import discard_shared, from_shared
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Messages that end a request; anything else (chunks, progress, stop reasons) is intermediate
+TERMINAL_KINDS = ('result', 'done', 'error')
+
+# How often a waiting caller checks whether its request was cancelled
+CANCEL_POLL_SECONDS = 0.05
+
+# A replica that exits this many times in a row before loading its model is not restarted again
+MAX_START_FAILURES = 5
+
+# Serializes the ``__main__`` swap in ``ReplicaPool._start`` across pools
+_spawn_lock = threading.Lock()
+
+
+class ReplicaCrashedError(RuntimeError):
+    """The replica running a request exited before answering it"""
+
+
+class ReplicaStartError(RuntimeError):
+    """Every replica failed to load the model ``max_start_failures`` times in a row"""
+
+
+class _Call:
+    """Parent-side state of one request: where its messages go and whether anyone still wants them"""
+
+    def __init__(self, replica, request_id):
+        self.replica = replica
+        self.request_id = request_id
+        self.messages = queue.Queue()
+        self.abandoned = False
+        self.cancel_sent = False
+
+
+class _Replica:
+    def __init__(self, index, cores):
+        self.index = index
+        self.cores = cores
+        self.process = None
+        self.requests = None
+        self.responses = None
+        self.calls = {}
+        self.dispatched = 0
+        self.restarts = 0
+        self.start_failures = 0
+        self.start_error = None
+        self.gave_up = False
+        self.ready = threading.Event()
+        self.sample_rate = None
+
+
+class ReplicaPool:
+    """
+    Runs ``num_replicas`` copies of the model in separate processes.
+
+    Each replica is pinned to its own slice of the available cores and uses
+    ``threads_per_replica`` intra-op threads, so replicas do not fight over
+    cores and Python-level orchestration is not limited by one GIL. Requests
+    go to the replica with the fewest in flight; inside a replica they are
+    micro-batched as in the single-process server.
+
+    Audio comes back through shared memory blocks rather than pickled
+    tensors. A replica that exits is restarted, and the requests it was
+    running fail with ``ReplicaCrashedError``. A replica that exits
+    ``max_start_failures`` times in a row without loading its model is left
+    down; once every replica is, waiting for the pool raises
+    ``ReplicaStartError`` instead of blocking forever.
+
+    The pool mirrors the parts of ``CSMGenerator`` the server uses
+    (``generate``, ``generate_stream``, ``tokenize_reference`` and
+    ``sample_rate``), plus ``synthesize_long_form``.
+    """
+
+    def __init__(self, num_replicas, threads_per_replica=None, generator_options=None, batching_options=None,
+                 max_start_failures=MAX_START_FAILURES):
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        if threads_per_replica is None:
+            threads_per_replica = max(1, len(available) // num_replicas)
+        self.num_replicas = num_replicas
+        self.threads_per_replica = threads_per_replica
+        self.generator_options = generator_options or {}
+        self.batching_options = batching_options or {}
+        self.max_start_failures = max_start_failures
+
+        # Pin each replica to its own cores when there are enough to go around
+        oversubscribed = num_replicas * threads_per_replica > len(available)
+        self._replicas = [
+            _Replica(i, None if oversubscribed else available[i * threads_per_replica:(i + 1) * threads_per_replica])
+            for i in range(num_replicas)
+        ]
+        # Spawn, not fork: forking a process that has started torch threads or CUDA is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        # Notified whenever a replica becomes ready or is given up on
+        self._replicas_changed = threading.Condition(self._lock)
+        self._request_ids = itertools.count()
+        self._closed = False
+
+        for replica in self._replicas:
+            self._new_queues(replica)
+            self._start(replica)
+
+    @property
+    def sample_rate(self):
+        """Sample rate reported by the first replica to finish loading"""
+        with self._replicas_changed:
+            self._replicas_changed.wait_for(
+                lambda: any(replica.ready.is_set() for replica in self._replicas) or self._all_gave_up()
+            )
+            for replica in self._replicas:
+                if replica.ready.is_set():
+                    return replica.sample_rate
+            raise self._start_error()
+
+    def wait_ready(self, timeout=None):
+        """
+        Block until every replica has loaded and warmed up its model, or been given up on.
+
+        Returns False if ``timeout`` passes first, and raises ``ReplicaStartError``
+        if no replica could load the model.
+        """
+        with self._replicas_changed:
+            settled = self._replicas_changed.wait_for(
+                lambda: all(replica.ready.is_set() or replica.gave_up for replica in self._replicas), timeout
+            )
+            if settled and self._all_gave_up():
+                raise self._start_error()
+            return settled
+
+    def _all_gave_up(self):
+        return all(replica.gave_up for replica in self._replicas)
+
+    def _start_error(self):
+        errors = '; '.join(f"replica {replica.index}: {replica.start_error}" for replica in self._replicas)
+        return ReplicaStartError(
+            f"No replica could load the model after {self.max_start_failures} attempts each ({errors})"
+        )
+
+    def _new_queues(self, replica):
+        replica.requests = self._context.Queue()
+        replica.responses = self._context.Queue()
+
+    def _start(self, replica):
+        replica.ready.clear()
+        replica.process = self._context.Process(
+            target=replica_worker.replica_main,
+            args=(
+                replica.index, replica.cores, self.threads_per_replica,
+                self.generator_options, self.batching_options, replica.requests, replica.responses
+            ),
+            name=f"tts-replica-{replica.index}",
+            daemon=True,
+        )
+        # A spawned process first re-imports the parent's __main__ (the server, with its
+        # caches, queues and web app), so the replica gets the small worker module instead
+        with _spawn_lock:
+            main = sys.modules['__main__']
+            sys.modules['__main__'] = replica_worker
+            try:
+                replica.process.start()
+            finally:
+                sys.modules['__main__'] = main
+        logger.info(f"Started replica {replica.index} (pid {replica.process.pid}, cores {replica.cores})")
+
+        reader = threading.Thread(
+            target=self._read_responses, args=(replica, replica.process, replica.responses),
+            name=f"tts-replica-{replica.index}-reader"
+        )
+        reader.daemon = True
+        reader.start()
+
+    def _read_responses(self, replica, process, responses):
+        """Deliver a replica's messages to their callers; restart the replica if it dies"""
+        while True:
+            try:
+                kind, request_id, payload = responses.get(timeout=0.5)
+            except queue.Empty:
+                if self._closed:
+                    return
+                if not process.is_alive():
+                    self._handle_crash(replica, process)
+                    return
+                continue
+
+            if kind == 'ready':
+                with self._replicas_changed:
+                    replica.sample_rate = payload
+                    replica.start_failures = 0
+                    replica.start_error = None
+                    replica.ready.set()
+                    self._replicas_changed.notify_all()
+                continue
+            if request_id is None:
+                # Loading the model failed; the process exits and is restarted above
+                logger.error(f"Replica {replica.index} failed to start: {str(payload)}")
+                replica.start_error = str(payload)
+                continue
+
+            with self._lock:
+                call = replica.calls.get(request_id)
+                if call is not None and kind in TERMINAL_KINDS:
+                    del replica.calls[request_id]
+                if call is not None and not call.abandoned:
+                    call.messages.put((kind, payload))
+                    continue
+            if kind == 'chunk':
+                discard_shared(payload)
+
+    def _handle_crash(self, replica, process):
+        with self._lock:
+            calls = list(replica.calls.values())
+            replica.calls.clear()
+            # A dead process can leave the old queues locked; new requests wait in fresh ones
+            self._new_queues(replica)
+        logger.error(
+            f"Replica {replica.index} (pid {process.pid}) exited with code {process.exitcode}, "
+            f"failing {len(calls)} request(s)"
+        )
+        error = ReplicaCrashedError(f"Replica {replica.index} exited with code {process.exitcode}")
+        for call in calls:
+            call.messages.put(('error', error))
+
+        if not replica.ready.is_set():
+            replica.start_failures += 1
+            if replica.start_error is None:
+                replica.start_error = f"exited with code {process.exitcode} while loading"
+            if replica.start_failures >= self.max_start_failures:
+                logger.error(
+                    f"Replica {replica.index} failed to start {replica.start_failures} times in a row, "
+                    f"not restarting it"
+                )
+                with self._replicas_changed:
+                    replica.gave_up = True
+                    # Requests routed here while it was loading would otherwise never be answered
+                    stranded = list(replica.calls.values())
+                    replica.calls.clear()
+                    self._replicas_changed.notify_all()
+                error = ReplicaCrashedError(f"Replica {replica.index} could not load the model: {replica.start_error}")
+                for call in stranded:
+                    call.messages.put(('error', error))
+                return
+
+        # Back off if the replica keeps dying, e.g. because the model cannot be loaded
+        replica.restarts += 1
+        time.sleep(min(30.0, 0.5 * 2 ** min(replica.restarts - 1, 6)))
+        if not self._closed:
+            self._start(replica)
+
+    def _submit(self, kind, kwargs):
+        """Send a request to the least-loaded replica and return its call"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Replica pool is shut down")
+            if self._all_gave_up():
+                raise self._start_error()
+            replica = min(
+                (r for r in self._replicas if not r.gave_up), key=lambda r: (len(r.calls), r.dispatched)
+            )
+            request_id = next(self._request_ids)
+            call = _Call(replica, request_id)
+            replica.calls[request_id] = call
+            replica.dispatched += 1
+            replica.requests.put((kind, request_id, kwargs))
+        return call
+
+    def _next_message(self, call, cancel=None):
+        """Wait for the call's next message, telling its replica to stop once ``cancel`` is set"""
+        while True:
+            if cancel is not None and not call.cancel_sent and cancel.is_set():
+                call.cancel_sent = True
+                call.replica.requests.put(('cancel', call.request_id, None))
+            if cancel is None or call.cancel_sent:
+                return call.messages.get()
+            try:
+                return call.messages.get(timeout=CANCEL_POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def _wait(self, call, progress_callback=None, stop_callback=None, cancel=None, timings=None):
+        """Block until the call's terminal message, forwarding progress updates, stop reasons and stage timings"""
+        while True:
+            kind, payload = self._next_message(call, cancel)
+            if kind == 'error':
+                raise payload
+            if kind == 'timings':
+                if timings is not None:
+                    timings.update(payload)
+                continue
+            if kind == 'progress':
+                if progress_callback is not None:
+                    progress_callback(*payload)
+                continue
+            if kind == 'stopped':
+                if stop_callback is not None:
+                    stop_callback(*payload)
+                continue
+            return payload
+
+    def generate(self, text, speaker, context=None, max_audio_length_ms=10000, temperature=0.9, topk=50, seed=None,
+                 voice=None, progress_callback=None, stop_callback=None, cancel=None, timings=None):
+        """Generate speech on the least-loaded replica"""
+        call = self._submit('generate', {
+            'text': text, 'speaker': speaker, 'context': context, 'max_audio_length_ms': max_audio_length_ms,
+            'temperature': temperature, 'topk': topk, 'seed': seed, 'voice': voice,
+            'progress': progress_callback is not None, 'stops': stop_callback is not None,
+            'cancellable': cancel is not None, 'timed': timings is not None,
+        })
+        return from_shared(*self._wait(call, progress_callback, stop_callback, cancel, timings))
+
+    def generate_stream(self, text, speaker, context=None, max_audio_length_ms=10000, temperature=0.9, topk=50,
+                        first_chunk_frames=4, chunk_frames=12, voice=None, stop_callback=None, cancel=None):
+        """Yield audio chunks as a replica decodes them; closing the generator or setting ``cancel`` cancels the request"""
+        call = self._submit('stream', {
+            'text': text, 'speaker': speaker, 'context': context, 'max_audio_length_ms': max_audio_length_ms,
+            'temperature': temperature, 'topk': topk, 'first_chunk_frames': first_chunk_frames,
+            'chunk_frames': chunk_frames, 'voice': voice, 'stops': stop_callback is not None,
+            'cancellable': cancel is not None,
+        })
+        finished = False
+        try:
+            while True:
+                kind, payload = self._next_message(call, cancel)
+                if kind == 'error':
+                    finished = True
+                    raise payload
+                if kind == 'done':
+                    finished = True
+                    return
+                if kind == 'stopped':
+                    if stop_callback is not None:
+                        stop_callback(*payload)
+                    continue
+                yield from_shared(*payload)
+        finally:
+            if not finished:
+                # Chunks still on their way are freed by the reader thread
+                with self._lock:
+                    call.abandoned = True
+                call.replica.requests.put(('cancel', call.request_id, None))
+                while not call.messages.empty():
+                    kind, payload = call.messages.get()
+                    if kind == 'chunk':
+                        discard_shared(payload)
+
+    def synthesize_long_form(self, text, speaker, output_path, temperature=0.9, topk=50, speed=1.0,
+                             progress_callback=None, max_chars=200, voice=None, cancel=None, budget_ms=None,
+                             stop_callback=None):
+        """Run ``LongFormSynthesizer.synthesize`` on a replica, writing to ``output_path``"""
+        # The budget function stays in this process; the replica gets each segment's budget
+        budgets = None
+        if budget_ms is not None:
+            budgets = {segment: budget_ms(segment) for segment in split_text(text, max_chars=max_chars)}
+        call = self._submit('long_form', {
+            'text': text, 'speaker': speaker, 'output_path': output_path, 'temperature': temperature,
+            'topk': topk, 'speed': speed, 'max_chars': max_chars, 'voice': voice, 'budgets': budgets,
+            'stops': stop_callback is not None, 'cancellable': cancel is not None,
+        })
+        return self._wait(call, progress_callback, stop_callback, cancel=cancel)
+
+    def tokenize_reference(self, text, speaker, audio):
+        call = self._submit('tokenize_reference', {'text': text, 'speaker': speaker, 'audio': audio})
+        return self._wait(call)
+
+    def stats(self):
+        """Return per-replica process, load and restart information"""
+        with self._lock:
+            return {
+                'replicas': [
+                    {
+                        'index': replica.index,
+                        'pid': replica.process.pid,
+                        'alive': replica.process.is_alive(),
+                        'ready': replica.ready.is_set(),
+                        'cores': replica.cores,
+                        'in_flight': len(replica.calls),
+                        'dispatched': replica.dispatched,
+                        'restarts': replica.restarts,
+                        'gave_up': replica.gave_up,
+                    }
+                    for replica in self._replicas
+                ],
+                'threads_per_replica': self.threads_per_replica,
+            }
+
+    def shutdown(self, timeout=10.0):
+        """Stop every replica; requests still running fail"""
+        with self._lock:
+            self._closed = True
+            calls = [call for replica in self._replicas for call in replica.calls.values()]
+            for replica in self._replicas:
+                replica.calls.clear()
+                replica.requests.put(None)
+        for call in calls:
+            call.messages.put(('error', RuntimeError("Replica pool is shutting down")))
+        for replica in self._replicas:
+            replica.process.join(timeout)
+            if replica.process.is_alive():
+                replica.process.terminate()
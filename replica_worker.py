@@ -0,0 +1,165 @@
+"""
+Entry point of the replica processes started by ``ReplicaPool``, and the shared memory helpers both sides use.
+
+Spawned processes import the module that started them again. ``ReplicaPool``
+starts replicas with this module standing in as ``__main__``, so a replica
+only imports what it needs to run the model, not the server and its caches,
+queues and web app.
+"""
+import logging
+import os
+import pickle
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import torch
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def to_shared(audio):
+    """Copy a 1-D float tensor into a new shared memory block that the parent takes ownership of"""
+    array = audio.detach().cpu().float().contiguous().numpy()
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=np.float32, buffer=block.buf)[:] = array
+    # The parent unlinks the block once it has read it, so this process must not clean it up at exit
+    resource_tracker.unregister(block._name, 'shared_memory')
+    block.close()
+    return block.name, array.shape[0]
+
+
+def from_shared(name, num_samples):
+    """Read audio written by ``to_shared`` and free the block"""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return torch.from_numpy(np.ndarray((num_samples,), dtype=np.float32, buffer=block.buf).copy())
+    finally:
+        block.close()
+        block.unlink()
+
+
+def discard_shared(payload):
+    """Free a block written by ``to_shared`` whose audio nobody wants"""
+    try:
+        block = shared_memory.SharedMemory(name=payload[0])
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+def send_error(responses, request_id, error):
+    """Send an exception back, falling back to its message if it cannot be pickled"""
+    try:
+        pickle.dumps(error)
+    except Exception:
+        error = RuntimeError(f"{type(error).__name__}: {error}")
+    responses.put(('error', request_id, error))
+
+
+class _CancelFlag:
+    """Replica-side ``cancel`` of one request: set once the parent sends a cancel message for it"""
+
+    def __init__(self, request_id, cancelled):
+        self.request_id = request_id
+        self.cancelled = cancelled
+
+    def is_set(self):
+        return self.request_id in self.cancelled
+
+
+def _serve_request(generator, engine, kind, request_id, kwargs, responses, cancelled):
+    """Run one request inside a replica and send its result back"""
+    try:
+        if kwargs.pop('cancellable', False):
+            kwargs['cancel'] = _CancelFlag(request_id, cancelled)
+        if kwargs.pop('stops', False):
+            kwargs['stop_callback'] = lambda *stop: responses.put(('stopped', request_id, stop))
+
+        if kind == 'generate':
+            if kwargs.pop('progress', False):
+                kwargs['progress_callback'] = lambda done, total: responses.put(('progress', request_id, (done, total)))
+            if kwargs.pop('timed', False):
+                kwargs['timings'] = {}
+            seed = kwargs.pop('seed', None)
+            if seed is not None:
+                # Seeded requests run on their own so the seed fully determines the output
+                audio = generator.generate(seed=seed, **kwargs)
+            else:
+                audio = engine.generate(**kwargs)
+            if kwargs.get('timings') is not None:
+                responses.put(('timings', request_id, kwargs['timings']))
+            responses.put(('result', request_id, to_shared(audio)))
+
+        elif kind == 'stream':
+            stream = generator.generate_stream(**kwargs)
+            try:
+                for audio in stream:
+                    if request_id in cancelled:
+                        break
+                    responses.put(('chunk', request_id, to_shared(audio)))
+            finally:
+                stream.close()
+            responses.put(('done', request_id, None))
+
+        elif kind == 'long_form':
+            from long_form import LongFormSynthesizer
+
+            budgets = kwargs.pop('budgets', None)
+            if budgets is not None:
+                kwargs['budget_ms'] = budgets.__getitem__
+            samples = LongFormSynthesizer(generator).synthesize(
+                progress_callback=lambda done, total: responses.put(('progress', request_id, (done, total))),
+                **kwargs
+            )
+            responses.put(('result', request_id, samples))
+
+        elif kind == 'tokenize_reference':
+            responses.put(('result', request_id, generator.tokenize_reference(**kwargs)))
+
+        else:
+            raise ValueError(f"Unknown request kind {kind}")
+
+    except Exception as e:
+        logger.error(f"Error serving {kind} request in replica: {str(e)}")
+        send_error(responses, request_id, e)
+    finally:
+        cancelled.discard(request_id)
+
+
+def replica_main(index, cores, threads, generator_options, batching_options, requests, responses):
+    """Entry point of a replica process: load the model, then serve requests until told to stop"""
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+
+    from batching import BatchingEngine
+    from csm_generator import load_csm_generator
+
+    try:
+        generator = load_csm_generator(**generator_options)
+        generator.warm_up()
+    except Exception as e:
+        send_error(responses, None, e)
+        return
+    engine = BatchingEngine(lambda: generator, **batching_options)
+    responses.put(('ready', None, generator.sample_rate))
+
+    cancelled = set()
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        kind, request_id, kwargs = message
+        if kind == 'cancel':
+            cancelled.add(request_id)
+            continue
+        # Requests run on their own threads so concurrent ones can share a batch
+        thread = threading.Thread(
+            target=_serve_request,
+            args=(generator, engine, kind, request_id, kwargs, responses, cancelled)
+        )
+        thread.daemon = True
+        thread.start()
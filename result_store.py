@@ -0,0 +1,153 @@
+"""
+In-memory store for encoded job results, with optional spill to memory-mapped files
+"""
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class StoredResult:
+    """
+    Encoded audio held in a buffer that can be sliced without copying.
+
+    ``buffer`` is anything supporting the buffer protocol: bytes, a
+    ``BytesIO.getbuffer()`` view or an ``mmap`` of a spilled file.
+    """
+
+    def __init__(self, buffer, mimetype, spilled=False):
+        self._buffer = buffer
+        self.view = memoryview(buffer)
+        self.size = self.view.nbytes
+        self.mimetype = mimetype
+        self.spilled = spilled
+        self.created_at = time.time()
+        
+        # Re-encoded copies of this result, by format name
+        self.variants = {}
+        self._variants_lock = threading.Lock()
+
+    def variant(self, name, encode, mimetype):
+        """Return this result re-encoded as ``name``, running ``encode`` only the first time"""
+        with self._variants_lock:
+            variant = self.variants.get(name)
+            if variant is None:
+                variant = StoredResult(encode(self.view), mimetype)
+                self.variants[name] = variant
+            return variant
+
+    def iter_range(self, start=0, end=None, chunk_size=64 * 1024):
+        """Yield the bytes in [start, end) one chunk at a time"""
+        end = self.size if end is None else end
+        for offset in range(start, end, chunk_size):
+            # WSGI servers only accept bytes, so just the chunk being written is copied
+            yield self.view[offset:min(offset + chunk_size, end)].tobytes()
+
+    def tobytes(self):
+        return self.view.tobytes()
+
+
+class ResultStore:
+    """
+    Keeps each job's encoded audio in memory until it is deleted or expires.
+
+    Removing a result only drops the store's reference, so downloads already in
+    progress finish normally and the buffer or mapping is freed afterwards.
+
+    Results larger than ``spill_threshold_bytes`` are moved to a memory-mapped
+    file that is unlinked as soon as it is mapped, so the kernel pages it in
+    and out on demand and nothing is left behind in the temp directory.
+    """
+
+    def __init__(self, spill_threshold_bytes=8 * 1024 * 1024, spill_dir=None, ttl_seconds=1800):
+        self.spill_threshold_bytes = spill_threshold_bytes
+        self.spill_dir = spill_dir or tempfile.gettempdir()
+        self.ttl_seconds = ttl_seconds
+
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, buffer, mimetype='audio/wav'):
+        """Store an encoded result, spilling it to a mapped file if it is large"""
+        if memoryview(buffer).nbytes > self.spill_threshold_bytes:
+            fd, path = tempfile.mkstemp(suffix='.bin', dir=self.spill_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(buffer)
+                result = self._map_file(path, mimetype)
+            finally:
+                os.unlink(path)
+        else:
+            result = StoredResult(buffer, mimetype)
+        self._add(key, result)
+        return result
+
+    def put_file(self, key, path, mimetype='audio/wav'):
+        """Take ownership of an encoded file on disk, mapping it or reading it into memory"""
+        try:
+            if os.path.getsize(path) > self.spill_threshold_bytes:
+                result = self._map_file(path, mimetype)
+            else:
+                with open(path, 'rb') as f:
+                    result = StoredResult(f.read(), mimetype)
+        finally:
+            os.unlink(path)
+        self._add(key, result)
+        return result
+
+    def link(self, key, result):
+        """Store a result that is already held under another key; both keys share one buffer"""
+        self._add(key, result)
+        return result
+
+    def spill_path(self, suffix='.wav'):
+        """Return a fresh path in the spill directory for results written straight to disk"""
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.spill_dir)
+        os.close(fd)
+        return path
+
+    def _map_file(self, path, mimetype):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return StoredResult(mapped, mimetype, spilled=True)
+
+    def _add(self, key, result):
+        with self._lock:
+            self._results[key] = result
+        self.expire()
+
+    def get(self, key):
+        with self._lock:
+            return self._results.get(key)
+
+    def delete(self, key):
+        with self._lock:
+            return self._results.pop(key, None) is not None
+
+    def expire(self):
+        """Drop results older than the TTL, in case clients never clean up"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [key for key, result in self._results.items() if result.created_at < cutoff]
+            for key in expired:
+                del self._results[key]
+        if expired:
+            logger.info(f"Expired {len(expired)} stored result(s)")
+
+    def stats(self):
+        with self._lock:
+            keys = len(self._results)
+            # Linked keys share one result, so count each buffer once
+            results = list({id(r): r for r in self._results.values()}.values())
+        variants = [v for r in results for v in list(r.variants.values())]
+        return {
+            'results': keys,
+            'variants': len(variants),
+            'memory_bytes': sum(r.size for r in results + variants if not r.spilled),
+            'spilled_bytes': sum(r.size for r in results if r.spilled),
+        }
@@ -5,6 +5,7 @@ export NO_TORCH_COMPILE=1
 export PYTORCH_CUDA_ALLOC_CONF=expandable_segments:True
 export DEFAULT_DEVICE=cuda
 USE_CPU=false
+SERVER_SCRIPT=server.py
 
 # Parse command line arguments
 while [[ $# -gt 0 ]]; do
@@ -13,11 +14,16 @@ while [[ $# -gt 0 ]]; do
             USE_CPU=true
             shift
             ;;
+        --asgi)
+            SERVER_SCRIPT=asgi_app.py
+            shift
+            ;;
         --help)
             echo "Usage: ./run_server.sh [options]"
             echo ""
             echo "Options:"
             echo "  --cpu       Force CPU usage even if CUDA is available"
+            echo "  --asgi      Serve through the asynchronous ASGI front-end (uvicorn)"
             echo "  --help      Show this help message"
             exit 0
             ;;
@@ -71,4 +77,4 @@ echo
 cd "$(dirname "$0")"
 
 # Run the server
-$PYTHON_CMD server.py
\ No newline at end of file
+$PYTHON_CMD $SERVER_SCRIPT
\ No newline at end of file
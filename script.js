@@ -10,6 +10,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const settingsPanel = document.getElementById('settingsPanel');
     const deviceSelect = document.getElementById('deviceSelect');
     const memoryOptimization = document.getElementById('memoryOptimization');
+    const quantizationSelect = document.getElementById('quantizationSelect');
     const applySettings = document.getElementById('applySettings');
     const settingsStatus = document.getElementById('settingsStatus');
     const progressContainer = document.getElementById('progressContainer');
@@ -20,7 +21,7 @@ document.addEventListener('DOMContentLoaded', () => {
     let isGenerating = false;
     let currentAudio = null;
     let currentJobId = null;
-    let jobCheckInterval = null;
+    let jobEventSource = null;
     let serverStatus = null;
 
     // Check for saved dark mode preference
@@ -50,6 +51,7 @@ document.addEventListener('DOMContentLoaded', () => {
     applySettings.addEventListener('click', async () => {
         const device = deviceSelect.value;
         const optimization = memoryOptimization.checked;
+        const quantization = quantizationSelect.value;
         const apiUrl = window.location.origin;
         
         settingsStatus.textContent = "Applying settings...";
@@ -62,15 +64,23 @@ document.addEventListener('DOMContentLoaded', () => {
                 },
                 body: JSON.stringify({
                     device: device,
-                    optimization: optimization
+                    optimization: optimization,
+                    quantization: quantization
                 })
             });
             
+            const result = await response.json();
             if (!response.ok) {
-                throw new Error('Failed to update settings');
+                throw new Error(result.error || 'Failed to update settings');
             }
             
-            const result = await response.json();
+            // Device and precision changes load a new model while the current one keeps serving
+            if (result.reload) {
+                const reload = await waitForReload(apiUrl, result.reload.reload_id);
+                if (reload.phase === 'failed') {
+                    throw new Error(reload.error || 'Model reload failed');
+                }
+            }
             settingsStatus.textContent = "Settings applied successfully!";
             
             // Update server status
@@ -87,6 +97,22 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Poll a model reload until it completes or fails
+    async function waitForReload(apiUrl, reloadId) {
+        while (true) {
+            const response = await fetch(`${apiUrl}/memory-settings/reload/${reloadId}`);
+            if (!response.ok) throw new Error('Failed to check reload progress');
+            const reload = await response.json();
+            if (reload.phase === 'completed' || reload.phase === 'failed') {
+                return reload;
+            }
+            const draining = reload.phase === 'draining' && reload.draining_jobs
+                ? ` (${reload.draining_jobs} job(s) finishing on the old model)` : '';
+            settingsStatus.textContent = `Reloading model: ${reload.phase.replace('_', ' ')}${draining}...`;
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
     // Fetch server status
     async function fetchServerStatus() {
         try {
@@ -99,6 +125,7 @@ document.addEventListener('DOMContentLoaded', () => {
             // Update UI based on server status
             deviceSelect.value = serverStatus.device;
             memoryOptimization.checked = serverStatus.memory_optimization;
+            quantizationSelect.value = serverStatus.quantization;
             
             // Display GPU memory info if available
             if (serverStatus.gpu_memory) {
@@ -174,64 +201,83 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // Function to poll job status
-    async function pollJobStatus(jobId) {
-        try {
-            const apiUrl = window.location.origin;
-            const response = await fetch(`${apiUrl}/job/${jobId}`);
-            
-            if (!response.ok) {
-                throw new Error('Failed to get job status');
-            }
-            
-            const jobStatus = await response.json();
-            
-            // Update UI based on job status
-            if (jobStatus.status === 'completed') {
-                // Job is complete, download the audio
-                clearInterval(jobCheckInterval);
-                await downloadAndPlayAudio(jobId);
-            } else if (jobStatus.status === 'error') {
-                // Job failed
-                clearInterval(jobCheckInterval);
-                highlightedText.innerHTML = `<p style="color: red;">Error: ${jobStatus.error || 'Failed to generate speech'}</p>`;
-                
-                // Hide progress
-                progressContainer.classList.add('hidden');
-                
-                isGenerating = false;
-                updatePlayButtonState();
-            } else {
-                // Job is still processing, update the UI
-                const elapsedTime = Math.floor((Date.now() - (jobStatus.created_at * 1000)) / 1000);
-                
-                // Update progress bar (simulate progress)
-                // Since we don't know the actual progress, we'll simulate it
-                // Cap at 90% until complete
-                const simulatedProgress = Math.min(90, elapsedTime * 2);
-                progressBar.style.width = `${simulatedProgress}%`;
-                progressText.textContent = `Generating speech... (${elapsedTime}s)`;
-                
-                // Show progress container if not already visible
-                if (progressContainer.classList.contains('hidden')) {
-                    progressContainer.classList.remove('hidden');
-                }
-                
+    // Function to follow a job's status and progress over Server-Sent Events
+    function watchJobEvents(jobId) {
+        const apiUrl = window.location.origin;
+        const source = new EventSource(`${apiUrl}/job/${jobId}/events`);
+        jobEventSource = source;
+        
+        // Show progress container if not already visible
+        if (progressContainer.classList.contains('hidden')) {
+            progressContainer.classList.remove('hidden');
+        }
+        
+        source.addEventListener('status', (e) => {
+            const jobStatus = JSON.parse(e.data);
+            if (jobStatus.status === 'queued') {
+                const position = jobStatus.queue_position;
+                progressText.textContent = position ? `Waiting in queue (position ${position + 1})...` : 'Waiting in queue...';
+            } else if (jobStatus.status === 'generating') {
+                progressText.textContent = 'Generating speech...';
                 highlightedText.innerHTML = `<p>Processing text: "${textInput.value.substring(0, 50)}${textInput.value.length > 50 ? '...' : ''}"</p>
                                             <p>This may take 1-2 minutes on CPU. Please be patient.</p>`;
             }
-            
-        } catch (error) {
-            console.error('Error polling job status:', error);
-            // Don't stop polling on network errors, as they might be temporary
+        });
+        
+        source.addEventListener('progress', (e) => {
+            // Short texts report frames, long texts report sentence segments
+            const progress = JSON.parse(e.data);
+            const done = progress.frames_done ?? progress.segments_done;
+            const total = progress.frames_total ?? progress.segments_total;
+            // Hold the last percent back for encoding and download
+            const percent = Math.min(95, Math.round(100 * done / Math.max(1, total)));
+            progressBar.style.width = `${percent}%`;
+            progressText.textContent = `Generating speech... ${percent}%`;
+        });
+        
+        source.addEventListener('completed', async () => {
+            stopWatchingJob();
+            await downloadAndPlayAudio(jobId);
+        });
+        
+        source.addEventListener('failed', (e) => {
+            stopWatchingJob();
+            const jobStatus = JSON.parse(e.data);
+            showJobError(jobStatus.error || 'Failed to generate speech');
+        });
+        
+        // Dropped connections are retried by the browser; a closed source means the server refused the stream
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) {
+                stopWatchingJob();
+                showJobError('Lost track of the speech generation job');
+            }
+        };
+    }
+    
+    function stopWatchingJob() {
+        if (jobEventSource) {
+            jobEventSource.close();
+            jobEventSource = null;
         }
     }
     
+    function showJobError(message) {
+        highlightedText.innerHTML = `<p style="color: red;">Error: ${message}</p>`;
+        
+        // Hide progress
+        progressContainer.classList.add('hidden');
+        
+        isGenerating = false;
+        updatePlayButtonState();
+    }
+    
     // Function to download and play audio
     async function downloadAndPlayAudio(jobId) {
         try {
             const apiUrl = window.location.origin;
-            const response = await fetch(`${apiUrl}/job/${jobId}?download=true`);
+            // 16-bit PCM is half the size of the float WAV and plays everywhere
+            const response = await fetch(`${apiUrl}/job/${jobId}?download=true&format=wav16`);
             
             if (!response.ok) {
                 throw new Error('Failed to download audio');
@@ -341,11 +387,8 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
-        // Stop any existing polling
-        if (jobCheckInterval) {
-            clearInterval(jobCheckInterval);
-            jobCheckInterval = null;
-        }
+        // Stop following any earlier job
+        stopWatchingJob();
 
         isGenerating = true;
         updatePlayButtonState();
@@ -385,9 +428,9 @@ document.addEventListener('DOMContentLoaded', () => {
             const jobData = await response.json();
             currentJobId = jobData.job_id;
             
-            // Start polling for job status
+            // Follow the job's progress; the server pushes updates until it finishes
             highlightedText.innerHTML = '<p>Generating speech with CSM... This may take a minute or two on CPU. Please be patient.</p>';
-            jobCheckInterval = setInterval(() => pollJobStatus(currentJobId), 1000);
+            watchJobEvents(currentJobId);
 
         } catch (error) {
             console.error('Error:', error);
@@ -408,6 +451,13 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Cancel a job still being generated when the page goes away, so the server stops working on it
+    window.addEventListener('pagehide', () => {
+        if (isGenerating && currentJobId) {
+            fetch(`${window.location.origin}/job/${currentJobId}`, { method: 'DELETE', keepalive: true });
+        }
+    });
+
     // Volume control
     volumeControl.addEventListener('input', (e) => {
         const volume = parseFloat(e.target.value);
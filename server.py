@@ -1,25 +1,48 @@
-from flask import Flask, request, send_file, jsonify, render_template, send_from_directory
+import time
+
+# Startup timings are measured from here, so they include importing torch and Flask
+STARTUP_BEGAN = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory
 from flask_cors import CORS
+import contextlib
 import io
+import queue
+import struct
 import threading
 import tempfile
 import os
 import logging
 import sys
+import soundfile as sf
 import torch
-import gc
 import torchaudio
-import time
 import uuid
-from threading import Thread
 
 # Set PyTorch memory management options
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
 
-# Import CSM modules
+# Import CSM modules; csm_generator defers the heavy CSM imports until the model loads
 sys.path.append('../csm')  # Add the CSM directory to the path
-from generator import Segment
-from csm_generator import load_csm_generator
+from csm_generator import (
+    FRAME_MS, QUANTIZATION_MODES, load_csm_generator, max_text_tokens, model_id_for, prompt_token_limit
+)
+from job_queue import PRIORITIES, CancelToken, JobQueue, QueueFullError
+from job_events import KEEPALIVE, JobEvents, format_event
+from batching import BatchingEngine
+from audio_cache import AudioCache, make_cache_key
+from long_form import LongFormSynthesizer, split_text
+from duration_estimator import DurationEstimator
+from generator_leases import GeneratorLeases
+from single_flight import SingleFlight
+from replica_pool import ReplicaPool
+from result_store import ResultStore
+from memory_manager import MemoryManager
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from profiling import CAPTURE_FILES, JobProfiler
+from voice_profiles import VoiceProfileStore, build_voice_profile
+from audio_effects import MAX_SPEED, MIN_SPEED, TimeStretcher, apply_speed
+from audio_encoding import DEFAULT_FORMAT, FORMATS, extension_for, mimetype_for, negotiate_format, transcode
 
 # Configure logging to output to console
 logging.basicConfig(
@@ -51,12 +74,136 @@ AVAILABLE_VOICES = {
 # Current CSM generator instance
 current_generator = None
 generator_lock = threading.Lock()
+# Jobs holding each generator; a replaced generator is freed once none do
+generator_leases = GeneratorLeases()
+# Model reloads started through /memory-settings, by id, and the one in progress
+reloads = {}
+active_reload = None
 
 # Memory optimization settings
 memory_optimization_enabled = True
+# Weight format on the CPU: "none" or "int8" linear layers in the backbone and decoder
+quantization_mode = os.environ.get("TTS_QUANTIZATION", "none")
 
-# Job tracking
+# Job tracking; event-stream listeners are woken through job_events whenever a job changes
 active_jobs = {}
+job_events = JobEvents()
+
+# Idle event streams send a comment this often so proxies keep them open
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENT_STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# Micro-batching settings: bigger batches and longer waits trade latency for throughput
+MAX_BATCH_SIZE = int(os.environ.get("TTS_MAX_BATCH_SIZE", "4"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("TTS_MAX_BATCH_WAIT_MS", "25"))
+# Generated batches that may wait for decoding and watermarking while the next one runs
+MAX_PENDING_DECODES = int(os.environ.get("TTS_MAX_PENDING_DECODES", "2"))
+
+# Synthesized-audio cache budgets, per tier
+CACHE_MEMORY_MB = float(os.environ.get("TTS_CACHE_MEMORY_MB", "64"))
+CACHE_DISK_MB = float(os.environ.get("TTS_CACHE_DISK_MB", "512"))
+CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tts-v3-cache"))
+
+# Streaming: a short first chunk for time-to-first-audio, then larger chunks (80ms frames)
+STREAM_FIRST_CHUNK_FRAMES = int(os.environ.get("TTS_STREAM_FIRST_CHUNK_FRAMES", "4"))
+STREAM_CHUNK_FRAMES = int(os.environ.get("TTS_STREAM_CHUNK_FRAMES", "12"))
+
+# Text longer than this is split into sentences and stitched; documents are capped at MAX_TEXT_CHARS
+LONG_FORM_CHARS = int(os.environ.get("TTS_LONG_FORM_CHARS", "300"))
+LONG_FORM_SEGMENT_CHARS = int(os.environ.get("TTS_LONG_FORM_SEGMENT_CHARS", "200"))
+MAX_TEXT_CHARS = int(os.environ.get("TTS_MAX_TEXT_CHARS", "100000"))
+
+# Results larger than this are spilled to memory-mapped files; all results expire after the TTL
+RESULT_SPILL_MB = float(os.environ.get("TTS_RESULT_SPILL_MB", "8"))
+RESULT_TTL_SECONDS = int(os.environ.get("TTS_RESULT_TTL_SECONDS", "1800"))
+
+# Memory high-water marks; below them the allocator caches are left alone between jobs
+RSS_HIGH_WATER_MB = float(os.environ.get("TTS_RSS_HIGH_WATER_MB", "0"))  # 0 = 80% of system memory
+CUDA_HIGH_WATER_FRACTION = float(os.environ.get("TTS_CUDA_HIGH_WATER_FRACTION", "0.7"))
+
+# Model replicas in worker processes (0 = one model in this process) and torch threads for each
+REPLICAS = int(os.environ.get("TTS_REPLICAS", "0"))
+REPLICA_THREADS = int(os.environ.get("TTS_REPLICA_THREADS", "0"))  # 0 = split the cores evenly
+
+# Scheduler settings: enough inference workers to fill one batch per model replica
+QUEUE_MAX_SIZE = int(os.environ.get("TTS_QUEUE_SIZE", "16"))
+INFERENCE_WORKERS = int(os.environ.get("TTS_INFERENCE_WORKERS", str(MAX_BATCH_SIZE * max(1, REPLICAS))))
+
+# Custom voice profiles, and how many of their prompt KV states the generator keeps
+VOICE_DIR = os.environ.get("TTS_VOICE_DIR", "voices")
+VOICE_PREFIX_CACHE = int(os.environ.get("TTS_VOICE_PREFIX_CACHE", "4"))
+
+# Generation budgets: the predicted length times the margin plus the slack, never above the cap
+MAX_AUDIO_LENGTH_MS = 20_000
+BUDGET_MARGIN = float(os.environ.get("TTS_BUDGET_MARGIN", "1.5"))
+BUDGET_SLACK_MS = float(os.environ.get("TTS_BUDGET_SLACK_MS", "1000"))
+# Frames of repeating semantic tokens after which generation is cut short (0 disables)
+RUNAWAY_FRAMES = int(os.environ.get("TTS_RUNAWAY_FRAMES", "25"))
+
+# Port both front-ends listen on
+PORT = int(os.environ.get("TTS_PORT", "5000"))
+
+# Prepared weights in their final dtype, memory-mapped on later starts ("" disables)
+SNAPSHOT_DIR = os.environ.get("TTS_SNAPSHOT_DIR", "snapshots")
+
+# On-demand job profiles, kept on disk up to this many captures
+PROFILE_DIR = os.environ.get("TTS_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "tts-v3-profiles"))
+PROFILE_KEEP = int(os.environ.get("TTS_PROFILE_KEEP", "10"))
+
+# Background model loading progress, reported by /readyz
+startup_state = {
+    'phase': 'starting',
+    'ready': False,
+    'error': None,
+    'timings': {'imports': time.perf_counter() - STARTUP_BEGAN},
+}
+
+def record_startup_phase(name, seconds):
+    startup_state['timings'][name] = seconds
+    logger.info(f"Startup phase '{name}' took {seconds:.2f}s")
+
+def resolve_device():
+    """Return the configured device, falling back to CPU when CUDA is unavailable"""
+    device = DEFAULT_DEVICE
+    if device == "cuda" and not torch.cuda.is_available():
+        device = "cpu"
+    return device
+
+def generator_options_for(device, optimization, quantization):
+    """Options for ``load_csm_generator`` (or each replica) under the given memory settings"""
+    return {
+        'device': device,
+        # Load model with memory optimizations if using CUDA
+        'use_half_precision': device == "cuda" and optimization,
+        # Quantized weights are a CPU-only mode
+        'quantization': quantization if device == "cpu" else "none",
+        'max_cached_prefixes': VOICE_PREFIX_CACHE,
+        'snapshot_dir': SNAPSHOT_DIR or None,
+        'runaway_frames': RUNAWAY_FRAMES,
+    }
+
+def build_generator(generator_options):
+    """Load a generator with these options, as a pool of replica processes when TTS_REPLICAS is set"""
+    if REPLICAS > 0:
+        # Each replica process loads its own copy and batches its own requests
+        return ReplicaPool(
+            REPLICAS,
+            threads_per_replica=REPLICA_THREADS or None,
+            generator_options=generator_options,
+            batching_options={
+                'max_batch_size': batching_engine.max_batch_size,
+                'max_wait_ms': batching_engine.max_wait_ms,
+                'max_pending_batches': batching_engine.max_pending_batches,
+            }
+        )
+    return load_csm_generator(**generator_options)
+
+def release_model(generator):
+    """Free a generator that no longer serves: stop its replicas, or drop it and reclaim its memory"""
+    if isinstance(generator, ReplicaPool):
+        generator.shutdown()
+    # Dropping the model frees a lot at once, so reclaim unconditionally
+    memory_manager.reclaim('reconfigure')
 
 def get_generator():
     """Get or create CSM generator instance"""
@@ -67,22 +214,16 @@ def get_generator():
             logger.info("Initializing CSM generator...")
             
             # Try to use CUDA with memory optimizations if available
-            device = DEFAULT_DEVICE
-            dtype = torch.float32
-            
-            # Check if CUDA is available
-            if device == "cuda" and not torch.cuda.is_available():
+            device = resolve_device()
+            if device != DEFAULT_DEVICE:
                 logger.warning("CUDA requested but not available, falling back to CPU")
-                device = "cpu"
             
             logger.info(f"Using device: {device}")
             
             # Load the CSM model
             try:
-                # Load model with memory optimizations if using CUDA
-                current_generator = load_csm_generator(
-                    device=device, 
-                    use_half_precision=(device == "cuda" and memory_optimization_enabled)
+                current_generator = build_generator(
+                    generator_options_for(device, memory_optimization_enabled, quantization_mode)
                 )
                 logger.info("CSM generator initialized successfully")
             except Exception as e:
@@ -92,31 +233,270 @@ def get_generator():
                 
     return current_generator
 
+def acquire_generator():
+    """Get the serving generator and hold it until ``release_generator``, so a reload lets this job finish on it"""
+    get_generator()
+    with generator_lock:
+        generator = current_generator
+        generator_leases.acquire(generator)
+    return generator
+
+def release_generator(generator):
+    """Hand back a generator taken with ``acquire_generator``"""
+    generator_leases.release(generator)
+
+def load_model_in_background():
+    """Load and warm up the model on a background thread while the HTTP server comes up"""
+    def load():
+        startup_state.update({'phase': 'loading_model', 'ready': False, 'error': None})
+        try:
+            start = time.perf_counter()
+            generator = get_generator()
+            record_startup_phase('load_model', time.perf_counter() - start)
+            
+            startup_state['phase'] = 'warming_up'
+            start = time.perf_counter()
+            if isinstance(generator, ReplicaPool):
+                # Each replica warms itself up before reporting ready
+                generator.wait_ready()
+            else:
+                for phase, seconds in generator.load_timings.items():
+                    record_startup_phase(f'model_{phase}', seconds)
+                generator.warm_up()
+            record_startup_phase('warm_up', time.perf_counter() - start)
+            
+            startup_state.update({'phase': 'ready', 'ready': True})
+            logger.info(f"Server ready {time.perf_counter() - STARTUP_BEGAN:.2f}s after startup")
+        except Exception as e:
+            logger.error(f"Failed to load the model in the background: {str(e)}")
+            logger.error("Stack trace:", exc_info=True)
+            startup_state.update({'phase': 'failed', 'error': str(e)})
+            logger.info("Server will continue running, but model will be loaded on first request")
+    
+    thread = threading.Thread(target=load, name="model-loader")
+    thread.daemon = True
+    thread.start()
+
+# Reference-clip voices, tokenized once and loaded from disk at startup
+voice_profiles = VoiceProfileStore(VOICE_DIR)
+
+# Predicts each request's audio length to size its frame budget, learning each voice's pace
+duration_estimator = DurationEstimator(margin=BUDGET_MARGIN, slack_ms=BUDGET_SLACK_MS, max_ms=MAX_AUDIO_LENGTH_MS)
+
+# Groups concurrent requests into padded batches for the current generator
+batching_engine = BatchingEngine(
+    get_generator, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS,
+    max_pending_batches=MAX_PENDING_DECODES
+)
+
+# Profiles the next jobs once armed through /profile; does nothing otherwise
+job_profiler = JobProfiler(PROFILE_DIR, keep=PROFILE_KEEP)
+
+# Metrics exposed on /metrics; all of these are safe to update from worker threads
+metrics_registry = Registry()
+request_counter = metrics_registry.counter(
+    'tts_requests_total', 'Synthesis requests by outcome', labelnames=['outcome']
+)
+stage_latency = metrics_registry.histogram(
+    'tts_stage_seconds', 'Time spent in each stage of a synthesis job', labelnames=['stage']
+)
+rtf_histogram = metrics_registry.histogram(
+    'tts_real_time_factor', 'Seconds of audio generated per wall-clock second',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16)
+)
+fps_histogram = metrics_registry.histogram(
+    'tts_frames_per_second', 'Audio frames (80ms each) generated per wall-clock second',
+    buckets=(1, 2.5, 5, 10, 12.5, 25, 50, 100, 200)
+)
+audio_seconds_counter = metrics_registry.counter(
+    'tts_audio_seconds_total', 'Seconds of audio generated'
+)
+generation_stops = metrics_registry.counter(
+    'tts_generation_stops_total', 'Generations by what ended them: eos, budget, runaway or cancelled',
+    labelnames=['reason']
+)
+audio_avoided_counter = metrics_registry.counter(
+    'tts_wasted_audio_seconds_avoided_total',
+    'Estimated seconds of audio not generated because jobs were cancelled or missed their deadline',
+    labelnames=['reason']
+)
+metrics_registry.gauge(
+    'tts_queue_depth', 'Jobs waiting for an inference worker', fn=lambda: job_queue.stats()['queued']
+)
+metrics_registry.gauge(
+    'tts_active_jobs', 'Jobs running on an inference worker', fn=lambda: job_queue.stats()['running']
+)
+
+def voice_key(speaker_id, voice):
+    """Identify the voice of a generation, whose speaking rate the duration estimator learns"""
+    return voice.key if voice is not None else f"speaker:{speaker_id}"
+
+def make_stop_callback(text, speaker_id, voice):
+    """Count what ended a generation, and calibrate the voice's pace from the ones that ended on EOS"""
+    def on_stop(reason, frames):
+        generation_stops.inc(reason=reason)
+        if reason == 'eos':
+            duration_estimator.observe(text, voice_key(speaker_id, voice), frames * FRAME_MS)
+    return on_stop
+
+def expected_run_seconds(audio_seconds):
+    """Rough wall time to generate ``audio_seconds`` of audio, from the real-time factor so far"""
+    rtf = rtf_histogram.mean()
+    return audio_seconds / rtf if rtf else 0.0
+
+def record_avoided(job, reason, generated_seconds=0.0):
+    """Count the audio a cancelled or expired job did not have to generate"""
+    audio_avoided_counter.inc(max(0.0, job['expected_audio_seconds'] - generated_seconds), reason=reason)
+
+def record_generation(audio_seconds, wall_seconds):
+    """Record real-time factor and frame throughput for one generation"""
+    audio_seconds_counter.inc(audio_seconds)
+    if wall_seconds > 0:
+        rtf_histogram.observe(audio_seconds / wall_seconds)
+        fps_histogram.observe(audio_seconds * 1000 / FRAME_MS / wall_seconds)
+
+# Reclaims memory only when RSS or the CUDA allocator crosses its high-water mark
+memory_manager = MemoryManager(
+    rss_high_water_bytes=int(RSS_HIGH_WATER_MB * 1024 * 1024) if RSS_HIGH_WATER_MB else None,
+    cuda_high_water_fraction=CUDA_HIGH_WATER_FRACTION
+)
+
 def cleanup_memory():
-    """Clean up memory after generation"""
-    if torch.cuda.is_available():
-        if current_generator:
-            current_generator.cleanup()
-        torch.cuda.empty_cache()
-    gc.collect()
+    """Clean up memory after generation, if usage is above the high-water marks"""
+    memory_manager.maybe_reclaim()
+
+def start_reload(settings):
+    """
+    Load a generator with new memory settings beside the serving one, then switch traffic to it.
+
+    The old generator keeps serving while the new one loads and warms up.
+    Jobs move over atomically and the new settings take effect at the same
+    moment; the old generator is freed once the jobs still holding it finish.
+    Returns the reload's status record, which /memory-settings/reload/<id> reports.
+    """
+    global active_reload
+    reload = {
+        'reload_id': str(uuid.uuid4()),
+        'phase': 'loading',
+        'settings': settings,
+        'started_at': time.time(),
+        'finished_at': None,
+        'timings': {},
+        'draining_jobs': None,
+        'error': None,
+    }
+    reloads[reload['reload_id']] = reload
+    active_reload = reload['reload_id']
+    
+    thread = threading.Thread(target=run_reload, args=(reload,), name="model-reloader")
+    thread.daemon = True
+    thread.start()
+    return reload
+
+def run_reload(reload):
+    """Body of the background reload started by ``start_reload``"""
+    global current_generator, DEFAULT_DEVICE, memory_optimization_enabled, quantization_mode, active_reload
+    settings = reload['settings']
+    new_generator = None
+    try:
+        device = settings['device']
+        if device == "cuda" and not torch.cuda.is_available():
+            logger.warning("CUDA requested but not available, reloading on CPU")
+            device = "cpu"
+        
+        start = time.perf_counter()
+        new_generator = build_generator(
+            generator_options_for(device, settings['optimization'], settings['quantization'])
+        )
+        reload['timings']['load_model'] = time.perf_counter() - start
+        
+        reload['phase'] = 'warming_up'
+        start = time.perf_counter()
+        if isinstance(new_generator, ReplicaPool):
+            new_generator.wait_ready()
+        else:
+            new_generator.warm_up()
+        reload['timings']['warm_up'] = time.perf_counter() - start
+        
+        # Jobs that start from here on get the new generator
+        with generator_lock:
+            old_generator = current_generator
+            current_generator = new_generator
+            DEFAULT_DEVICE = settings['device']
+            memory_optimization_enabled = settings['optimization']
+            quantization_mode = settings['quantization']
+        logger.info(f"Switched to a generator on {device} after {sum(reload['timings'].values()):.2f}s")
+        if not startup_state['ready']:
+            startup_state.update({'phase': 'ready', 'ready': True, 'error': None})
+        
+        if old_generator is not None:
+            reload['phase'] = 'draining'
+            start = time.perf_counter()
+            generator_leases.wait_idle(
+                old_generator, on_change=lambda count: reload.update({'draining_jobs': count})
+            )
+            release_model(old_generator)
+            reload['timings']['drain'] = time.perf_counter() - start
+        
+        reload.update({'phase': 'completed', 'finished_at': time.time()})
+        
+    except Exception as e:
+        logger.error(f"Error reloading the model: {str(e)}")
+        logger.error("Stack trace:", exc_info=True)
+        # The old generator never stopped serving; only the half-loaded one is discarded
+        if new_generator is not None and new_generator is not current_generator:
+            release_model(new_generator)
+        reload.update({'phase': 'failed', 'error': str(e), 'finished_at': time.time()})
+    finally:
+        active_reload = None
 
 @app.route('/memory-settings', methods=['POST'])
 def update_memory_settings():
-    """Update memory optimization settings"""
-    global memory_optimization_enabled, DEFAULT_DEVICE, current_generator
-    
+    """
+    Update memory optimization settings.
+
+    Batching settings apply at once. Device, precision and quantization
+    changes load a new generator in the background while the current one
+    keeps serving; the response is 202 with a reload handle to poll.
+    """
     data = request.json
-    if 'optimization' in data:
-        memory_optimization_enabled = bool(data['optimization'])
-    if 'device' in data:
-        DEFAULT_DEVICE = data['device']
+    if 'quantization' in data and data['quantization'] not in QUANTIZATION_MODES:
+        return jsonify({'error': f"quantization must be one of {', '.join(QUANTIZATION_MODES)}"}), 400
+    if 'device' in data and data['device'] not in ('cuda', 'cpu'):
+        return jsonify({'error': "device must be cuda or cpu"}), 400
+    if 'max_batch_size' in data:
+        batching_engine.max_batch_size = max(1, int(data['max_batch_size']))
+    if 'max_batch_wait_ms' in data:
+        batching_engine.max_wait_ms = max(0.0, float(data['max_batch_wait_ms']))
+    
+    settings = {
+        'device': data.get('device', DEFAULT_DEVICE),
+        'optimization': bool(data.get('optimization', memory_optimization_enabled)),
+        'quantization': data.get('quantization', quantization_mode),
+    }
+    response = dict(settings, success=True, batching=batching_engine.stats())
+    serving = {'device': DEFAULT_DEVICE, 'optimization': memory_optimization_enabled, 'quantization': quantization_mode}
+    if settings == serving and current_generator is not None:
+        # Nothing to reload
+        return jsonify(response)
     
-    # Reset generator to apply new settings
     with generator_lock:
-        current_generator = None
-        cleanup_memory()
-        
-    return jsonify({'success': True, 'optimization': memory_optimization_enabled, 'device': DEFAULT_DEVICE})
+        if active_reload is not None:
+            return jsonify({'error': 'A model reload is already in progress', 'reload': reloads[active_reload]}), 409
+        if startup_state['phase'] in ('loading_model', 'warming_up'):
+            return jsonify({'error': 'The model is still loading, try again once /readyz reports ready'}), 409
+        reload = start_reload(settings)
+    
+    response['reload'] = reload
+    return jsonify(response), 202, {'Location': f"/memory-settings/reload/{reload['reload_id']}"}
+
+@app.route('/memory-settings/reload/<reload_id>', methods=['GET'])
+def get_reload(reload_id):
+    """Progress of a model reload: loading, warming_up, draining, then completed or failed"""
+    reload = reloads.get(reload_id)
+    if reload is None:
+        return jsonify({'error': 'Reload not found'}), 404
+    return jsonify(reload)
 
 @app.route('/voices', methods=['GET'])
 def list_voices():
@@ -126,128 +506,844 @@ def list_voices():
             {'id': k, 'name': v['name']} 
             for k, v in AVAILABLE_VOICES.items()
         ]
+        voices.extend(profile.info() for profile in voice_profiles.list())
         logger.info(f"Available voices: {voices}")
         return jsonify({'voices': voices})
     except Exception as e:
         logger.error(f"Error in list_voices: {str(e)}")
         logger.error("Stack trace:", exc_info=True)
         return jsonify({'error': str(e)}), 500
-        
-def generate_speech_task(job_id, text, speaker_id, speed):
-    """Background task for speech generation"""
-    try:
-        # Get CSM generator
-        generator = get_generator()
 
-        # Ensure we have clean memory before generation
-        cleanup_memory()
+@app.route('/voices', methods=['POST'])
+def create_voice():
+    """Create a voice profile from reference clips (multipart: name, speaker, audio[], transcript[])"""
+    try:
+        name = request.form.get('name', '')
+        speaker = int(request.form.get('speaker', 0))
+        description = request.form.get('description', '')
+        files = request.files.getlist('audio')
+        transcripts = request.form.getlist('transcript')
         
-        # Update job status
-        active_jobs[job_id]['status'] = 'generating'
+        if name in AVAILABLE_VOICES:
+            return jsonify({'error': f'{name} is a built-in voice'}), 400
+        if len(files) != len(transcripts):
+            return jsonify({'error': 'Every audio clip needs exactly one transcript'}), 400
         
-        # Generate speech with CSM
-        audio = generator.generate(
-            text=text,
-            speaker=speaker_id,
-            context=[],  # Empty context
-            max_audio_length_ms=20_000,  # 20 seconds max
-            temperature=0.9,  # Default temperature
-            topk=50,  # Default topk
+        clips = []
+        for file, transcript in zip(files, transcripts):
+            try:
+                data, sample_rate = sf.read(file, dtype='float32', always_2d=True)
+            except RuntimeError as e:
+                return jsonify({'error': f'Unreadable audio clip {file.filename}: {str(e)}'}), 400
+            # Mix down to mono
+            clips.append((torch.from_numpy(data.mean(axis=1)), sample_rate, transcript))
+        
+        generator = acquire_generator()
+        try:
+            profile = build_voice_profile(generator, name, speaker, clips, description=description)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        finally:
+            release_generator(generator)
+        voice_profiles.add(profile)
+        
+        logger.info(f"Created voice profile {name} from {len(clips)} clip(s), {profile.num_rows} prompt tokens")
+        return jsonify(profile.info()), 201
+    except Exception as e:
+        logger.error(f"Error in create_voice: {str(e)}")
+        logger.error("Stack trace:", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/voices/<name>', methods=['DELETE'])
+def delete_voice(name):
+    """Delete a custom voice profile"""
+    if not voice_profiles.delete(name):
+        return jsonify({'error': 'Voice not found'}), 404
+    return jsonify({'deleted': name})
+        
+def parse_synthesis_request(data):
+    """Validate and normalise the parameters of a synthesis request"""
+    text = data['text']
+    voice_id = data.get('voice', 'SPEAKER_0')  # Default to SPEAKER_0 if not specified
+    seed = data.get('seed')
+    
+    # Get the speaker ID for the voice, or the custom profile that defines it
+    voice_info = AVAILABLE_VOICES.get(voice_id)
+    voice_profile = None
+    if voice_info:
+        speaker_id = voice_info['id']
+    else:
+        voice_profile = voice_profiles.get(voice_id)
+        if voice_profile is None:
+            raise ValueError(f'Invalid voice ID: {voice_id}')
+        speaker_id = voice_profile.speaker
+    
+    # Long text goes through the long-form pipeline; only reject absurd documents
+    if len(text) > MAX_TEXT_CHARS:
+        raise ValueError(f'Text too long ({len(text)} chars), the limit is {MAX_TEXT_CHARS}')
+    
+    check_prompt_length(text, speaker_id, voice_profile)
+    
+    priority = data.get('priority', 'interactive')
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    deadline_ms = data.get('deadline_ms')
+    if deadline_ms is not None and float(deadline_ms) <= 0:
+        raise ValueError('deadline_ms must be positive')
+    
+    speed = float(data.get('speed', 1.0))
+    if not MIN_SPEED <= speed <= MAX_SPEED:
+        raise ValueError(f'speed must be between {MIN_SPEED} and {MAX_SPEED}')
+    
+    return {
+        'text': text,
+        'speed': speed,
+        'temperature': float(data.get('temperature', 0.9)),
+        'topk': int(data.get('topk', 50)),
+        'seed': int(seed) if seed is not None else None,
+        'voice_id': voice_id,
+        'speaker_id': speaker_id,
+        'voice_profile': voice_profile,
+        'priority': priority,
+        'deadline_ms': float(deadline_ms) if deadline_ms is not None else None,
+    }
+
+def check_prompt_length(text, speaker_id, voice):
+    """
+    Raise ValueError if the voice prompt and text leave no room in the model's sequence for the audio.
+    
+    Long text is generated a segment at a time and drops the context of earlier
+    segments when it does not fit, so only its longest segment has to fit.
+    """
+    pieces = split_text(text, LONG_FORM_SEGMENT_CHARS) if len(text) > LONG_FORM_CHARS else [text]
+    prompt_tokens = max((max_text_tokens(piece, speaker_id) for piece in pieces), default=0)
+    if voice is not None:
+        prompt_tokens += voice.tokens.size(0)
+    limit = prompt_token_limit(MAX_AUDIO_LENGTH_MS)
+    if prompt_tokens >= limit:
+        raise ValueError(
+            f'Voice prompt and text need up to {prompt_tokens} tokens, the limit is {limit - 1}; '
+            f'use a shorter voice prompt or text'
         )
+
+def wav_stream_header(sample_rate, num_channels=1, bits_per_sample=16):
+    """WAV header for a PCM stream of unknown length"""
+    byte_rate = sample_rate * num_channels * bits_per_sample // 8
+    block_align = num_channels * bits_per_sample // 8
+    return (
+        b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', 0xFFFFFFFF)
+    )
+
+class JobCancelledError(Exception):
+    """Raised inside a task whose job was cancelled or ran past its deadline"""
+
+    def __init__(self, reason, generated_seconds=0.0):
+        super().__init__('Deadline passed before the audio was ready' if reason == 'deadline' else 'Cancelled')
+        self.reason = reason
+        self.generated_seconds = generated_seconds
+
+def finish_cancelled(job_id, reason):
+    """Finish a job that was cancelled (reason ``'cancelled'``) or missed its deadline (``'deadline'``)"""
+    job = active_jobs.get(job_id)
+    if job is None or 'finished_at' in job:
+        return
+    status = 'expired' if reason == 'deadline' else 'cancelled'
+    request_counter.inc(outcome=status)
+    job.update(status=status, error=str(JobCancelledError(reason)), finished_at=time.time())
+    job_events.publish()
+
+def expire_job(job_id):
+    """Called by the queue for a job it dropped because its deadline can no longer be met"""
+    job = active_jobs.get(job_id)
+    if job is not None:
+        record_avoided(job, 'deadline')
+        finish_cancelled(job_id, 'deadline')
+
+def generate_speech_task(job_id, text, speaker_id, speed, temperature=0.9, topk=50, seed=None, cache_key=None,
+                         voice=None, job_key=None):
+    """Background task for speech generation; jobs that coalesced onto it under ``job_key`` share its result"""
+    # Writes go to the entry itself, so a job deleted while it runs cannot break the task
+    job = active_jobs[job_id]
+    cancel = job['cancel']
+    started_at = time.time()
+    job['started_at'] = started_at
+    stage_latency.observe(started_at - job['created_at'], stage='queue_wait')
+    generator = None
+    # Also samples the batching engine's threads, where this job's frames are generated and decoded
+    capture = job_profiler.start(job_id, threads=batching_engine.threads)
+    try:
+        # Get CSM generator; a reload that starts now waits for this job before freeing it
+        generator = acquire_generator()
+        if cancel.is_set():
+            raise JobCancelledError(cancel.reason)
+        
+        # Update job status, unless its client cancelled it and the run only goes on for coalesced jobs
+        if 'finished_at' not in job:
+            job['status'] = 'generating'
+        job_events.publish()
         
-        # Apply speed modification if needed
-        if speed != 1.0:
-            # Resample the audio to change the speed
-            orig_length = audio.shape[0]
-            target_length = int(orig_length / speed)
-            audio = torchaudio.functional.resample(
-                audio, 
-                orig_freq=generator.sample_rate, 
-                new_freq=int(generator.sample_rate * speed)
+        if len(text) > LONG_FORM_CHARS:
+            # Long text is generated sentence by sentence and stitched straight into a spill file
+            def report_progress(done, total):
+                job['progress'] = {'segments_done': done, 'segments_total': total}
+                job_events.publish()
+            
+            # Every segment gets its own budget, and calibrates the voice, like a short request
+            def segment_budget_ms(segment):
+                return duration_estimator.budget_ms(segment, voice_key(speaker_id, voice))
+            
+            def on_segment_stop(segment, reason, frames):
+                make_stop_callback(segment, speaker_id, voice)(reason, frames)
+            
+            spill_path = result_store.spill_path()
+            generate_start = time.perf_counter()
+            try:
+                if isinstance(generator, ReplicaPool):
+                    samples = generator.synthesize_long_form(
+                        text,
+                        speaker_id,
+                        spill_path,
+                        temperature=temperature,
+                        topk=topk,
+                        speed=speed,
+                        progress_callback=report_progress,
+                        max_chars=LONG_FORM_SEGMENT_CHARS,
+                        voice=voice,
+                        cancel=cancel,
+                        budget_ms=segment_budget_ms,
+                        stop_callback=on_segment_stop,
+                    )
+                else:
+                    long_form = LongFormSynthesizer(generator)
+                    samples = long_form.synthesize(
+                        text,
+                        speaker_id,
+                        spill_path,
+                        temperature=temperature,
+                        topk=topk,
+                        speed=speed,
+                        progress_callback=report_progress,
+                        max_chars=LONG_FORM_SEGMENT_CHARS,
+                        voice=voice,
+                        cancel=cancel,
+                        budget_ms=segment_budget_ms,
+                        stop_callback=on_segment_stop,
+                    )
+                if cancel.reason is not None:
+                    raise JobCancelledError(cancel.reason, samples * speed / generator.sample_rate)
+            except Exception:
+                # The file may never have been created; that must not hide why the job stopped
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(spill_path)
+                raise
+            # Speed and decoding are folded into the pipeline, so it counts as one generate stage
+            generate_seconds = time.perf_counter() - generate_start
+            stage_latency.observe(generate_seconds, stage='generate')
+            record_generation(samples * speed / generator.sample_rate, generate_seconds)
+            
+            with stage_latency.time(stage='encode'):
+                result = result_store.put_file(job_id, spill_path)
+        else:
+            # A tight budget stops a generation that misses EOS long before the 20 second cap
+            budget_ms = duration_estimator.budget_ms(text, voice_key(speaker_id, voice))
+            stop_callback = make_stop_callback(text, speaker_id, voice)
+            
+            # The generator guesses the total from a fixed pace; the estimator has learned this voice's
+            expected_ms = min(budget_ms, duration_estimator.estimate_ms(text, voice_key(speaker_id, voice)))
+            expected_frames = max(1, int(expected_ms / FRAME_MS))
+            def report_frames(done, total):
+                if total > done:
+                    total = max(done + 1, expected_frames)
+                job['progress'] = {'frames_done': done, 'frames_total': total}
+                job_events.publish()
+            
+            # Seconds per pipeline stage, filled in as the model and post-processing threads finish them
+            timings = job['timings'] = {}
+            generate_start = time.perf_counter()
+            if seed is not None or isinstance(generator, ReplicaPool):
+                # Seeded requests run on their own so the seed fully determines the output;
+                # replicas batch concurrent requests themselves
+                audio = generator.generate(
+                    text=text,
+                    speaker=speaker_id,
+                    context=[],  # Empty context
+                    max_audio_length_ms=budget_ms,
+                    temperature=temperature,
+                    topk=topk,
+                    seed=seed,
+                    voice=voice,
+                    progress_callback=report_frames,
+                    stop_callback=stop_callback,
+                    cancel=cancel,
+                    timings=timings,
+                )
+            else:
+                # Generate speech with CSM, batched with any concurrent requests
+                audio = batching_engine.generate(
+                    text=text,
+                    speaker=speaker_id,
+                    context=[],  # Empty context
+                    max_audio_length_ms=budget_ms,
+                    temperature=temperature,
+                    topk=topk,
+                    voice=voice,
+                    progress_callback=report_frames,
+                    stop_callback=stop_callback,
+                    generator=generator,
+                    cancel=cancel,
+                    timings=timings,
+                )
+            if cancel.reason is not None:
+                raise JobCancelledError(cancel.reason, audio.shape[0] / generator.sample_rate)
+            
+            generate_seconds = time.perf_counter() - generate_start
+            stage_latency.observe(generate_seconds, stage='generate')
+            record_generation(audio.shape[0] / generator.sample_rate, generate_seconds)
+            
+            # Apply speed modification if needed
+            stage_start = time.perf_counter()
+            audio = apply_speed(audio, generator.sample_rate, speed)
+            timings['speed'] = time.perf_counter() - stage_start
+            
+            # Encode the audio in memory; the store serves views of this buffer directly
+            stage_start = time.perf_counter()
+            buffer = io.BytesIO()
+            torchaudio.save(
+                buffer,
+                audio.unsqueeze(0).cpu(),
+                generator.sample_rate,
+                format='wav'
             )
+            result = result_store.put(job_id, buffer.getbuffer())
+            timings['encode'] = time.perf_counter() - stage_start
+            
+            for stage, seconds in timings.items():
+                stage_latency.observe(seconds, stage=stage)
         
-        # Create a temporary file to store the audio
-        temp_file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
-        temp_path = temp_file.name
-        temp_file.close()
+        # Keep a copy for repeat requests; spilled results stay on disk rather than being read back into memory
+        if cache_key is not None and not result.spilled:
+            audio_cache.put(cache_key, result.tobytes())
         
-        # Save the audio to the temporary file
-        torchaudio.save(
-            temp_path,
-            audio.unsqueeze(0).cpu(),
-            generator.sample_rate
-        )
+        # Identical jobs that arrived meanwhile finish first, so none shows completed before its audio is there
+        finish_coalesced(job_id, job_key, {
+            'status': 'completed',
+            'started_at': started_at,
+            'sample_rate': generator.sample_rate
+        }, result)
         
-        # Update job status with file path
-        active_jobs[job_id]['status'] = 'completed'
-        active_jobs[job_id]['file_path'] = temp_path
-        active_jobs[job_id]['sample_rate'] = generator.sample_rate
+        # Update job status
+        if 'finished_at' in job:
+            # Cancelled by its client; the audio was only finished for the jobs coalesced onto it
+            result_store.delete(job_id)
+        else:
+            job['status'] = 'completed'
+            job['sample_rate'] = generator.sample_rate
+            request_counter.inc(outcome='completed')
         
+    except JobCancelledError as e:
+        logger.info(f"Stopped job {job_id} ({e.reason}) after {e.generated_seconds:.2f}s of audio")
+        record_avoided(job, e.reason, e.generated_seconds)
+        finish_coalesced(job_id, job_key, {'status': 'cancelled', 'error': str(e)})
+        finish_cancelled(job_id, e.reason)
     except Exception as e:
         logger.error(f"Error in speech generation task: {str(e)}")
         logger.error("Stack trace:", exc_info=True)
-        active_jobs[job_id]['status'] = 'error'
-        active_jobs[job_id]['error'] = str(e)
+        finish_coalesced(job_id, job_key, {'status': 'error', 'started_at': started_at, 'error': str(e)})
+        if 'finished_at' not in job:
+            job['status'] = 'error'
+            job['error'] = str(e)
+            request_counter.inc(outcome='error')
     finally:
+        if capture is not None:
+            job_profiler.finish(capture)
+        if generator is not None:
+            release_generator(generator)
+        job.setdefault('finished_at', time.time())
+        job_events.publish()
         # Clean up memory
         cleanup_memory()
 
+def stream_speech_task(job_id, text, speaker_id, speed, temperature, topk, chunks, client_gone, voice=None):
+    """Background task that pushes WAV bytes to a streaming response as frames are decoded"""
+    job = active_jobs[job_id]
+    cancel = job['cancel']
+    started_at = time.time()
+    job['started_at'] = started_at
+    stage_latency.observe(started_at - job['created_at'], stage='queue_wait')
+    generator = None
+    try:
+        generator = acquire_generator()
+        if cancel.is_set():
+            raise JobCancelledError(cancel.reason)
+        job['status'] = 'generating'
+        job_events.publish()
+        chunks.put(wav_stream_header(generator.sample_rate))
+        
+        stream = generator.generate_stream(
+            text=text,
+            speaker=speaker_id,
+            context=[],  # Empty context
+            max_audio_length_ms=duration_estimator.budget_ms(text, voice_key(speaker_id, voice)),
+            temperature=temperature,
+            topk=topk,
+            first_chunk_frames=STREAM_FIRST_CHUNK_FRAMES,
+            chunk_frames=STREAM_CHUNK_FRAMES,
+            voice=voice,
+            stop_callback=make_stop_callback(text, speaker_id, voice),
+            cancel=cancel,
+        )
+        def send(audio):
+            pcm = (audio.clamp(-1.0, 1.0) * 32767).to(torch.int16)
+            chunks.put(pcm.numpy().tobytes())
+        
+        # One stretcher for the whole stream, so chunk boundaries leave no seam
+        stretcher = TimeStretcher(generator.sample_rate, speed)
+        generate_start = time.perf_counter()
+        audio_seconds = 0.0
+        try:
+            for audio in stream:
+                audio_seconds += audio.shape[0] / generator.sample_rate
+                if client_gone.is_set():
+                    logger.info(f"Client disconnected, stopping stream for job {job_id}")
+                    break
+                send(stretcher.process(audio))
+            else:
+                send(stretcher.flush())
+        finally:
+            # Closing the stream releases the model for the next job
+            stream.close()
+        
+        generate_seconds = time.perf_counter() - generate_start
+        stage_latency.observe(generate_seconds, stage='stream')
+        record_generation(audio_seconds, generate_seconds)
+        if cancel.reason is not None:
+            raise JobCancelledError(cancel.reason, audio_seconds)
+        job['status'] = 'completed'
+        request_counter.inc(outcome='completed')
+        
+    except JobCancelledError as e:
+        logger.info(f"Stopped streaming job {job_id} ({e.reason}) after {e.generated_seconds:.2f}s of audio")
+        record_avoided(job, e.reason, e.generated_seconds)
+        finish_cancelled(job_id, e.reason)
+    except Exception as e:
+        logger.error(f"Error in speech streaming task: {str(e)}")
+        logger.error("Stack trace:", exc_info=True)
+        job['status'] = 'error'
+        job['error'] = str(e)
+        request_counter.inc(outcome='error')
+    finally:
+        if generator is not None:
+            release_generator(generator)
+        job.setdefault('finished_at', time.time())
+        job_events.publish()
+        chunks.put(None)
+        cleanup_memory()
+
+# Finished audio lives here until the client cleans up or it expires
+result_store = ResultStore(spill_threshold_bytes=int(RESULT_SPILL_MB * 1024 * 1024), ttl_seconds=RESULT_TTL_SECONDS)
+
+# Repeated prompts are served from here without touching the model
+audio_cache = AudioCache(
+    memory_budget_bytes=int(CACHE_MEMORY_MB * 1024 * 1024),
+    disk_budget_bytes=int(CACHE_DISK_MB * 1024 * 1024),
+    disk_dir=CACHE_DIR
+)
+
+# Bounded FIFO queue in front of the inference workers
+job_queue = JobQueue(
+    generate_speech_task, max_size=QUEUE_MAX_SIZE, num_workers=INFERENCE_WORKERS, on_expired=expire_job
+)
+
+# Identical jobs that arrive while one is queued or running attach to it instead of running again
+single_flight = SingleFlight()
+
+def finish_coalesced(run_id, job_key, outcome, result=None):
+    """Finish every job that coalesced onto the run ``run_id`` for ``job_key``, sharing the run's stored audio"""
+    for follower_id in single_flight.finish(job_key, run_id):
+        follower = active_jobs.get(follower_id)
+        # Jobs cancelled while they waited keep their own outcome
+        if follower is None or 'finished_at' in follower:
+            continue
+        if result is not None:
+            # Another reference to the same buffer, so cleaning up one job leaves the others intact
+            result_store.link(follower_id, result)
+        follower.update(outcome, finished_at=time.time())
+
+def stop_run(run_id):
+    """Stop the work behind job ``run_id`` once neither its client nor any job coalesced onto it still wants it"""
+    run = active_jobs.get(run_id)
+    if run is None or 'finished_at' not in run:
+        return
+    run_key = run.get('run_key')
+    if run_key is not None:
+        followers = [active_jobs.get(follower_id) for follower_id in single_flight.followers(run_key, run_id)]
+        if any(follower is not None and 'finished_at' not in follower for follower in followers):
+            return
+        # Identical requests from now on start a fresh run rather than joining one that is stopping
+        single_flight.finish(run_key, run_id)
+    
+    # A waiting job just leaves the queue; a running one stops before its next frame
+    if job_queue.cancel(run_id):
+        record_avoided(run, 'cancelled')
+    else:
+        run['cancel'].cancel()
+
+def cancel_job(job_id):
+    """
+    Cancel a job, or delete a finished one and its audio.
+    
+    A waiting job leaves the queue and a running one stops before its next
+    frame. Work that other jobs coalesced onto carries on until none of them
+    wants it. Returns the JSON payload and HTTP status.
+    """
+    job = active_jobs.get(job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+    if 'finished_at' in job:
+        result_store.delete(job_id)
+        active_jobs.pop(job_id, None)
+        return {'job_id': job_id, 'status': 'deleted'}, 200
+    
+    logger.info(f"Cancelling job {job_id}")
+    if job.get('streaming'):
+        # The task has to close the response either way, so it finishes the job itself
+        job['cancel'].cancel()
+    else:
+        finish_cancelled(job_id, 'cancelled')
+        stop_run(job.get('coalesced_with', job_id))
+    return {'job_id': job_id, 'status': 'cancelled'}, 200
+
+def live_job(job_id, job):
+    """The job id and entry whose progress ``job`` reports: the run it coalesced onto, until it finishes"""
+    run_id = job.get('coalesced_with')
+    if run_id is not None and 'finished_at' not in job:
+        run = active_jobs.get(run_id)
+        if run is not None:
+            return run_id, run
+    return job_id, job
+
+def submit_synthesis(data):
+    """
+    Validate a /synthesize body and queue its job, or serve it from the audio cache.
+    
+    Returns the JSON payload, HTTP status and extra headers, so the Flask and
+    ASGI front-ends answer identically.
+    """
+    if not data or 'text' not in data:
+        return {'error': 'No text provided'}, 400, {}
+    
+    try:
+        params = parse_synthesis_request(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400, {}
+    text = params['text']
+    speed = params['speed']
+    temperature = params['temperature']
+    topk = params['topk']
+    seed = params['seed']
+    voice_id = params['voice_id']
+    speaker_id = params['speaker_id']
+    voice_profile = params['voice_profile']
+    priority = params['priority']
+    deadline = time.time() + params['deadline_ms'] / 1000 if params['deadline_ms'] is not None else None
+    
+    logger.info(f"Synthesizing text: {text} with speed: {speed} using voice: {voice_id} (speaker ID: {speaker_id})")
+
+    # Create a job ID
+    job_id = str(uuid.uuid4())
+    
+    # Create a job entry
+    active_jobs[job_id] = {
+        'status': 'queued',
+        'text': text,
+        'speaker_id': speaker_id,
+        'speed': speed,
+        'priority': priority,
+        'deadline': deadline,
+        'cancel': CancelToken(deadline),
+        'expected_audio_seconds': duration_estimator.estimate_ms(text, voice_key(speaker_id, voice_profile)) / 1000,
+        'created_at': time.time()
+    }
+    
+    # Identical requests share one run while it is in flight, whatever their caching
+    job_key = make_cache_key(
+        text, voice_profile.key if voice_profile else speaker_id, speed, temperature, topk,
+        model_id_for(resolve_device(), memory_optimization_enabled, quantization_mode), seed
+    )
+    
+    # Sampling is stochastic, so only reuse audio when asked to or when a seed pins it down
+    cache_key = None
+    if data.get('cache') or seed is not None:
+        cache_key = job_key
+        cached_audio = audio_cache.get(cache_key)
+        if cached_audio is not None:
+            logger.info(f"Serving job {job_id} from the audio cache")
+            request_counter.inc(outcome='cached')
+            result_store.put(job_id, cached_audio)
+            active_jobs[job_id].update({
+                'status': 'completed',
+                'cached': True,
+                'finished_at': time.time()
+            })
+            return {'job_id': job_id, 'status': 'completed', 'cached': True}, 200, {}
+    
+    # A job with a deadline runs on its own, so its deadline only ever drops its own work
+    if deadline is None:
+        run_id = single_flight.join(job_key, job_id)
+        if run_id is not None:
+            logger.info(f"Job {job_id} coalesced onto job {run_id}")
+            request_counter.inc(outcome='coalesced')
+            active_jobs[job_id]['coalesced_with'] = run_id
+            if priority == 'interactive':
+                # An interactive caller must not wait behind bulk work for the run it shares
+                job_queue.prioritize(run_id, 'interactive')
+            return {'job_id': job_id, 'status': 'queued', 'coalesced': True}, 200, {}
+        active_jobs[job_id]['run_key'] = job_key
+    
+    # Hand the job to the inference workers, pushing back if the queue is full
+    try:
+        position = job_queue.submit(
+            job_id, text, speaker_id, speed, temperature, topk, seed, cache_key, voice_profile,
+            job_key if deadline is None else None,
+            priority=priority,
+            deadline=deadline,
+            expected_seconds=expected_run_seconds(active_jobs[job_id]['expected_audio_seconds'])
+        )
+    except QueueFullError as e:
+        del active_jobs[job_id]
+        # Jobs that attached in the meantime cannot run either
+        finish_coalesced(job_id, job_key, {'status': 'error', 'error': 'Server is busy, please retry later'})
+        request_counter.inc(outcome='rejected')
+        logger.warning(f"Rejecting job, queue full (retry after {e.retry_after}s)")
+        return (
+            {'error': 'Server is busy, please retry later', 'retry_after': e.retry_after},
+            429,
+            {'Retry-After': str(e.retry_after)}
+        )
+    
+    # Return the job ID immediately
+    return {'job_id': job_id, 'status': 'queued', 'queue_position': position, 'priority': priority}, 200, {}
+
 @app.route('/synthesize', methods=['POST'])
 def synthesize():
+    try:
+        payload, status_code, headers = submit_synthesis(request.json)
+        return jsonify(payload), status_code, headers
+            
+    except Exception as e:
+        logger.error(f"Error in synthesis: {str(e)}")
+        logger.error("Stack trace:", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/synthesize/stream', methods=['POST'])
+def synthesize_stream():
+    """Synthesize speech and stream it back as a WAV body while it is generated"""
     try:
         data = request.json
         if not data or 'text' not in data:
             return jsonify({'error': 'No text provided'}), 400
-
-        text = data['text']
-        speed = float(data.get('speed', 1.0))
-        voice_id = data.get('voice', 'SPEAKER_0')  # Default to SPEAKER_0 if not specified
         
-        # Get the speaker ID for the voice
-        voice_info = AVAILABLE_VOICES.get(voice_id)
-        if not voice_info:
-            return jsonify({'error': f'Invalid voice ID: {voice_id}'}), 400
-            
-        speaker_id = voice_info['id']
+        try:
+            params = parse_synthesis_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Limit text length to prevent OOM errors
-        if len(text) > 500:
-            logger.warning(f"Text too long ({len(text)} chars), truncating to 500 chars")
-            text = text[:500]
+        # Streaming runs a single generation, so limit text length to prevent OOM errors
+        if len(params['text']) > 500:
+            logger.warning(f"Text too long ({len(params['text'])} chars), truncating to 500 chars")
+            params['text'] = params['text'][:500]
+            try:
+                check_prompt_length(params['text'], params['speaker_id'], params['voice_profile'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
-        logger.info(f"Synthesizing text: {text} with speed: {speed} using voice: {voice_id} (speaker ID: {speaker_id})")
-
-        # Create a job ID
-        job_id = str(uuid.uuid4())
+        logger.info(f"Streaming text: {params['text']} with speed: {params['speed']} using voice: {params['voice_id']}")
         
-        # Create a job entry
+        job_id = str(uuid.uuid4())
         active_jobs[job_id] = {
             'status': 'queued',
-            'text': text,
-            'speaker_id': speaker_id,
-            'speed': speed,
+            'text': params['text'],
+            'speaker_id': params['speaker_id'],
+            'speed': params['speed'],
+            'streaming': True,
+            'cancel': CancelToken(),
+            'expected_audio_seconds': duration_estimator.estimate_ms(
+                params['text'], voice_key(params['speaker_id'], params['voice_profile'])
+            ) / 1000,
             'created_at': time.time()
         }
         
-        # Start a background thread for generation
-        thread = Thread(
-            target=generate_speech_task,
-            args=(job_id, text, speaker_id, speed)
-        )
-        thread.daemon = True
-        thread.start()
+        chunks = queue.Queue()
+        client_gone = threading.Event()
+        try:
+            job_queue.submit(
+                job_id, params['text'], params['speaker_id'], params['speed'],
+                params['temperature'], params['topk'], chunks, client_gone, params['voice_profile'],
+                task=stream_speech_task,
+                priority=params['priority']
+            )
+        except QueueFullError as e:
+            del active_jobs[job_id]
+            request_counter.inc(outcome='rejected')
+            response = jsonify({'error': 'Server is busy, please retry later', 'retry_after': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+        
+        def generate():
+            try:
+                while True:
+                    chunk = chunks.get()
+                    if chunk is None:
+                        break
+                    yield chunk
+            finally:
+                client_gone.set()
+        
+        return Response(generate(), mimetype='audio/wav', headers={'X-Job-Id': job_id})
         
-        # Return the job ID immediately
-        return jsonify({
-            'job_id': job_id,
-            'status': 'queued'
-        })
-            
     except Exception as e:
-        logger.error(f"Error in synthesis: {str(e)}")
+        logger.error(f"Error in streaming synthesis: {str(e)}")
         logger.error("Stack trace:", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+class DownloadError(Exception):
+    """Raised when a job's audio cannot be downloaded, carrying the HTTP status to answer with"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def download_url(job_id):
+    return f'/job/{job_id}?download=true'
+
+
+def job_status(job_id, job):
+    """The JSON body /job/<job_id> answers with while not downloading"""
+    run_id, run = live_job(job_id, job)
+    return {
+        'job_id': job_id,
+        'status': run['status'],
+        'created_at': job['created_at'],
+        'queue_position': job_queue.position(run_id),
+        'started_at': run.get('started_at'),
+        'finished_at': job.get('finished_at'),
+        'progress': run.get('progress'),
+        'timings': run.get('timings'),
+        'cached': job.get('cached', False),
+        'coalesced': 'coalesced_with' in job,
+        'priority': job.get('priority', 'interactive'),
+        'deadline': job.get('deadline'),
+        'error': job.get('error')
+    }
+
+
+def prepare_download(job_id, job, format_arg, accept_mimetypes):
+    """
+    Look up a finished job's audio in the negotiated format, encoding it on first use.
+    
+    Returns the stored result and a download file name; raises ``DownloadError``.
+    """
+    # Streamed audio went straight to the client and was never stored
+    if job.get('streaming'):
+        raise DownloadError('Streamed jobs have no stored audio', 404)
+    
+    # Pick the output format from ?format= or the Accept header
+    try:
+        output_format = negotiate_format(format_arg, accept_mimetypes)
+    except ValueError as e:
+        raise DownloadError(str(e), 400)
+    
+    result = result_store.get(job_id)
+    if result is None:
+        raise DownloadError('Audio no longer available', 404)
+    if result.size == 0:
+        raise DownloadError('Audio file is empty', 500)
+    
+    # Encoded variants are kept with the job, so repeat downloads don't re-encode
+    if output_format != DEFAULT_FORMAT:
+        with stage_latency.time(stage='transcode'):
+            result = result.variant(
+                output_format,
+                lambda data: transcode(data, output_format),
+                mimetype_for(output_format)
+            )
+    return result, f'speech.{extension_for(output_format)}'
+
+
+def plan_download(result, download_name, requested_range):
+    """
+    Work out the byte span, status and headers for sending a result.
+    
+    ``requested_range`` is a parsed HTTP ``Range`` header or None. Returns
+    ``(start, end, status, headers)``; status 416 means the range cannot be served.
+    """
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename={download_name}',
+        'Vary': 'Accept',
+    }
+    start, end, status = 0, result.size, 200
+    
+    # Multi-range requests are rare for audio, so those simply get the whole body
+    if requested_range is not None and len(requested_range.ranges) == 1:
+        byte_range = requested_range.range_for_length(result.size)
+        if byte_range is None:
+            headers['Content-Range'] = f'bytes */{result.size}'
+            return 0, 0, 416, headers
+        start, end = byte_range
+        headers['Content-Range'] = requested_range.to_content_range_header(result.size)
+        status = 206
+    
+    headers['Content-Length'] = str(end - start)
+    return start, end, status, headers
+
+
+def send_result(result, start, end):
+    """Yield a result's bytes, recording how long the client took to receive them"""
+    send_start = time.perf_counter()
+    try:
+        yield from result.iter_range(start, end)
+    finally:
+        stage_latency.observe(time.perf_counter() - send_start, stage='download')
+
+
+def job_event_messages(job_id, sent):
+    """
+    Server-Sent Events messages describing what changed in a job since the last call.
+    
+    ``sent`` remembers what earlier calls reported and is updated in place.
+    Returns the messages and whether the job has finished.
+    """
+    job = active_jobs.get(job_id)
+    if job is None:
+        return [format_event('failed', {'job_id': job_id, 'error': 'Job not found'})], True
+    
+    messages = []
+    run_id, run = live_job(job_id, job)
+    status = {'job_id': job_id, 'status': run['status'], 'queue_position': job_queue.position(run_id)}
+    if status != sent.get('status'):
+        messages.append(format_event('status', status))
+        sent['status'] = status
+    progress = run.get('progress')
+    if progress is not None and progress != sent.get('progress'):
+        messages.append(format_event('progress', dict(progress, job_id=job_id)))
+        sent['progress'] = progress
+    
+    if job['status'] == 'completed':
+        messages.append(format_event('completed', {
+            'job_id': job_id,
+            'download_url': None if job.get('streaming') else download_url(job_id),
+            'cached': job.get('cached', False),
+        }))
+        return messages, True
+    if job['status'] in ('error', 'cancelled', 'expired'):
+        messages.append(format_event('failed', {'job_id': job_id, 'status': job['status'], 'error': job.get('error')}))
+        return messages, True
+    return messages, False
+
 @app.route('/job/<job_id>', methods=['GET'])
 def get_job_status(job_id):
     """Get the status of a speech generation job"""
@@ -259,39 +1355,62 @@ def get_job_status(job_id):
         
         # If job is completed, return the audio file
         if job['status'] == 'completed' and request.args.get('download') == 'true':
-            file_path = job['file_path']
+            try:
+                result, download_name = prepare_download(
+                    job_id, job, request.args.get('format'), request.accept_mimetypes
+                )
+            except DownloadError as e:
+                return jsonify({'error': str(e)}), e.status_code
             
-            if not os.path.exists(file_path):
-                return jsonify({'error': 'Audio file not found'}), 404
-                
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                return jsonify({'error': 'Audio file is empty'}), 500
-                
-            # Send the file
-            response = send_file(
-                file_path,
-                mimetype='audio/wav',
-                as_attachment=True,
-                download_name='speech.wav'
+            start, end, status_code, headers = plan_download(result, download_name, request.range)
+            if status_code == 416:
+                return Response(status=416, headers=headers)
+            return Response(
+                send_result(result, start, end),
+                status=status_code,
+                mimetype=result.mimetype,
+                headers=headers,
+                direct_passthrough=True
             )
             
-            # Add content length header
-            response.headers['Content-Length'] = file_size
-            return response
-            
         # Otherwise just return the status
-        return jsonify({
-            'job_id': job_id,
-            'status': job['status'],
-            'created_at': job['created_at'],
-            'error': job.get('error')
-        })
+        return jsonify(job_status(job_id, job))
         
     except Exception as e:
         logger.error(f"Error getting job status: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/job/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """Cancel a queued or running job, or delete a finished one"""
+    try:
+        payload, status_code = cancel_job(job_id)
+        return jsonify(payload), status_code
+    except Exception as e:
+        logger.error(f"Error cancelling job: {str(e)}")
+        logger.error("Stack trace:", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/job/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """Push a job's status changes and progress as Server-Sent Events until it finishes"""
+    if job_id not in active_jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def stream():
+        sent = {}
+        while True:
+            # Read the version first so a change made while this pass runs still wakes the wait
+            version = job_events.version
+            messages, finished = job_event_messages(job_id, sent)
+            yield from messages
+            if finished:
+                return
+            if job_events.wait(version, EVENTS_KEEPALIVE_SECONDS) == version:
+                yield KEEPALIVE
+    
+    return Response(stream(), mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+
 @app.route('/cleanup', methods=['POST'])
 def cleanup_jobs():
     """Clean up completed jobs"""
@@ -302,10 +1421,8 @@ def cleanup_jobs():
         cleaned = 0
         for job_id in job_ids:
             if job_id in active_jobs and active_jobs[job_id]['status'] == 'completed':
-                # Delete the audio file
-                file_path = active_jobs[job_id].get('file_path')
-                if file_path and os.path.exists(file_path):
-                    os.unlink(file_path)
+                # Release the stored audio
+                result_store.delete(job_id)
                 
                 # Remove the job
                 del active_jobs[job_id]
@@ -319,10 +1436,8 @@ def cleanup_jobs():
                 old_jobs.append(job_id)
                 
         for job_id in old_jobs:
-            # Delete the audio file
-            file_path = active_jobs[job_id].get('file_path')
-            if file_path and os.path.exists(file_path):
-                os.unlink(file_path)
+            # Release the stored audio
+            result_store.delete(job_id)
             
             # Remove the job
             del active_jobs[job_id]
@@ -335,30 +1450,126 @@ def cleanup_jobs():
         return jsonify({'error': str(e)}), 500
 
 
+def server_status():
+    """Server status and memory information, as reported by /status"""
+    status = {
+        'device': DEFAULT_DEVICE,
+        'memory_optimization': memory_optimization_enabled,
+        'quantization': quantization_mode,
+        'model_loaded': current_generator is not None,
+        'queue': job_queue.stats(),
+        'batching': batching_engine.stats(),
+        'formats': list(FORMATS),
+        'memory': memory_manager.stats(),
+        'cache': audio_cache.stats(),
+        'results': result_store.stats(),
+        'coalescing': single_flight.stats(),
+        'voices': len(voice_profiles.list()),
+        'duration_estimator': duration_estimator.stats(),
+        'reload': reloads.get(active_reload),
+    }
+    
+    if isinstance(current_generator, ReplicaPool):
+        status['replicas'] = current_generator.stats()
+    elif current_generator is not None:
+        status['voice_prefix_cache'] = current_generator.prefix_cache_stats()
+    
+    if torch.cuda.is_available():
+        free_memory = torch.cuda.get_device_properties(0).total_memory - torch.cuda.memory_allocated(0)
+        free_memory_gb = free_memory / (1024**3)
+        status['gpu_memory'] = {
+            'total_gb': torch.cuda.get_device_properties(0).total_memory / (1024**3),
+            'used_gb': torch.cuda.memory_allocated(0) / (1024**3),
+            'free_gb': free_memory_gb
+        }
+    return status
+
 @app.route('/status', methods=['GET'])
 def get_status():
     """Get server status and memory information"""
     try:
-        status = {
-            'device': DEFAULT_DEVICE,
-            'memory_optimization': memory_optimization_enabled,
-            'model_loaded': current_generator is not None
-        }
-        
-        if torch.cuda.is_available():
-            free_memory = torch.cuda.get_device_properties(0).total_memory - torch.cuda.memory_allocated(0)
-            free_memory_gb = free_memory / (1024**3)
-            status['gpu_memory'] = {
-                'total_gb': torch.cuda.get_device_properties(0).total_memory / (1024**3),
-                'used_gb': torch.cuda.memory_allocated(0) / (1024**3),
-                'free_gb': free_memory_gb
-            }
-            
-        return jsonify(status)
+        return jsonify(server_status())
     except Exception as e:
         logger.error(f"Error in get_status: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving HTTP, whether or not the model is loaded"""
+    return jsonify({'status': 'ok', 'uptime_seconds': time.perf_counter() - STARTUP_BEGAN})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the model is loaded and has completed a warm-up generation"""
+    status_code = 200 if startup_state['ready'] else 503
+    return jsonify(startup_state), status_code
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose queue, request and per-stage latency metrics in Prometheus text format"""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+# Job types POST /profile can be asked for, and why the others cannot be profiled (409)
+PROFILED_JOB_TYPES = ('synthesize',)
+UNPROFILED_JOB_TYPES = {
+    'stream': 'Streaming jobs are not profiled; profile the same text through /synthesize instead',
+}
+
+def profile_status():
+    """The profiler's state, with download URLs for each capture"""
+    status = job_profiler.stats()
+    for capture in status['captures']:
+        capture['files'] = {kind: f"/profile/{capture['id']}/{kind}" for kind in CAPTURE_FILES}
+    return status
+
+@app.route('/profile', methods=['POST'])
+def arm_profiler():
+    """
+    Profile the next ``jobs`` jobs and/or the jobs starting within ``seconds``.
+
+    Each profiled job leaves a torch profiler trace and a sampled Python
+    profile, listed by ``GET /profile``. ``job_type`` names the jobs to
+    profile; types that cannot be profiled get 409 with the reason.
+    """
+    data = request.json or {}
+    job_type = data.get('job_type', 'synthesize')
+    if job_type in UNPROFILED_JOB_TYPES:
+        return jsonify({'error': UNPROFILED_JOB_TYPES[job_type]}), 409
+    if job_type not in PROFILED_JOB_TYPES:
+        job_types = list(PROFILED_JOB_TYPES) + list(UNPROFILED_JOB_TYPES)
+        return jsonify({'error': f"job_type must be one of {', '.join(job_types)}"}), 400
+    try:
+        jobs = int(data['jobs']) if data.get('jobs') is not None else None
+        seconds = float(data['seconds']) if data.get('seconds') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'jobs must be an integer and seconds a number'}), 400
+    if (jobs is None and seconds is None) or (jobs is not None and jobs < 1) or (seconds is not None and seconds <= 0):
+        return jsonify({'error': 'Give a positive number of jobs, of seconds, or both'}), 400
+    
+    job_profiler.arm(jobs=jobs, seconds=seconds)
+    logger.info(f"Profiler armed for jobs={jobs} seconds={seconds}")
+    return jsonify(profile_status())
+
+@app.route('/profile', methods=['DELETE'])
+def disarm_profiler():
+    """Stop profiling new jobs; a capture in progress still completes"""
+    job_profiler.disarm()
+    return jsonify(profile_status())
+
+@app.route('/profile', methods=['GET'])
+def get_profiles():
+    """Whether the profiler is armed, and the captures kept on disk"""
+    return jsonify(profile_status())
+
+@app.route('/profile/<capture_id>/<kind>', methods=['GET'])
+def download_profile(capture_id, kind):
+    """Download a capture's torch trace (``trace``, Chrome trace JSON) or Python profile (``pstats``)"""
+    if kind not in CAPTURE_FILES or job_profiler.get(capture_id) is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_from_directory(
+        job_profiler.directory, capture_id + CAPTURE_FILES[kind], as_attachment=True
+    )
+
 @app.route('/')
 def index():
     """Serve the main HTML page"""
@@ -371,14 +1582,12 @@ if __name__ == '__main__':
         logger.info(f"Memory optimization: {'Enabled' if memory_optimization_enabled else 'Disabled'}")
         logger.info(f"Default device: {DEFAULT_DEVICE}")
         
-        # Pre-load the generator to avoid first-request delay
-        try:
-            get_generator()
-        except Exception as e:
-            logger.error(f"Failed to pre-load generator: {str(e)}")
-            logger.info("Server will continue running, but model will be loaded on first request")
+        # Load the model in the background so /healthz answers while it loads;
+        # the debug reloader's watcher process never serves, so it skips this
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            load_model_in_background()
             
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        app.run(host='0.0.0.0', port=PORT, debug=True)
     except Exception as e:
         logger.error(f"Error starting server: {str(e)}")
         logger.error("Stack trace:", exc_info=True)
@@ -0,0 +1,56 @@
+"""
+Coalescing of identical synthesis jobs onto one model run
+"""
+import threading
+
+
+class SingleFlight:
+    """
+    Tracks which job is producing the audio for each set of request parameters.
+
+    The first job for a key becomes the run; jobs that ``join`` while it is
+    queued or running are attached to it instead of doing the work again.
+    When the run ends, ``finish`` hands back the attached jobs so they can
+    share its result, and the next job for that key starts a new run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (job id of the run, job ids attached to it)
+        self._flights = {}
+        self.coalesced = 0
+
+    def join(self, key, job_id):
+        """Attach ``job_id`` to the run for ``key`` and return the run's job id, or return None if it starts the run"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                self._flights[key] = (job_id, [])
+                return None
+            flight[1].append(job_id)
+            self.coalesced += 1
+            return flight[0]
+
+    def finish(self, key, run_id):
+        """End the run ``run_id`` for ``key`` and return the job ids that were attached to it"""
+        with self._lock:
+            flight = self._flights.get(key)
+            # The key may already belong to a newer run if this one was cancelled
+            if flight is None or flight[0] != run_id:
+                return []
+            del self._flights[key]
+        return flight[1]
+
+    def followers(self, key, run_id):
+        """Job ids attached to the run ``run_id`` for ``key`` so far"""
+        with self._lock:
+            flight = self._flights.get(key)
+            return list(flight[1]) if flight is not None and flight[0] == run_id else []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'waiting': sum(len(followers) for _, followers in self._flights.values()),
+                'coalesced': self.coalesced,
+            }
@@ -0,0 +1,96 @@
+"""
+Deterministic stand-in for the CSM ``generator`` module.
+
+Mirrors the parts of the upstream API that ``CSMGenerator`` uses (``Segment``,
+``load_csm_1b`` and the ``Generator`` internals) without downloading any
+weights, so tests and benchmarks can run on a plain CPU box. Put this
+directory on ``sys.path`` ahead of ``../csm`` to use it.
+"""
+from dataclasses import dataclass
+
+import torch
+
+from models import DECODE_COST_MS, NUM_CODEBOOKS, Model, ModelArgs, spend
+from watermarking import load_watermarker
+
+SAMPLES_PER_FRAME = 1920
+
+
+@dataclass
+class Segment:
+    speaker: int
+    text: str
+    # (num_samples,), sample_rate = 24_000
+    audio: torch.Tensor
+
+
+class _AudioTokenizer:
+    """Stub of the Mimi codec: one frame of codes per 80ms of audio"""
+
+    sample_rate = 24000
+
+    def decode(self, codes):
+        # Every frame decodes on its own, so chunked and full decodes agree
+        b, _, t = codes.shape
+        spend(t * DECODE_COST_MS / 1000.0)
+        phase = (torch.arange(SAMPLES_PER_FRAME).float() / self.sample_rate).repeat(t)
+        freq = 100.0 + codes[:, 0, :].float().repeat_interleave(SAMPLES_PER_FRAME, dim=1) % 400
+        return (0.1 * torch.sin(2 * torch.pi * freq * phase)).unsqueeze(1).expand(b, 1, -1).contiguous()
+
+    def encode(self, audio):
+        b = audio.shape[0]
+        t = audio.shape[-1] // SAMPLES_PER_FRAME
+        frames = audio[..., :t * SAMPLES_PER_FRAME].reshape(b, t, SAMPLES_PER_FRAME)
+        level = (frames.abs().mean(dim=-1) * 1000).long() % 2000 + 1
+        return level.unsqueeze(1).repeat(1, NUM_CODEBOOKS, 1)
+
+
+class _TextTokenizer:
+    """Stub of the Llama tokenizer: one token per whitespace-separated word"""
+
+    def encode(self, text):
+        return [sum(ord(c) for c in word) % 5000 + 1 for word in text.split()] or [1]
+
+
+class Generator:
+    def __init__(self, model):
+        self._model = model
+        self._model.setup_caches(1)
+
+        self._text_tokenizer = _TextTokenizer()
+        self._audio_tokenizer = _AudioTokenizer()
+        self._watermarker = load_watermarker(device="cpu")
+
+        self.sample_rate = self._audio_tokenizer.sample_rate
+        self.device = next(model.parameters()).device
+
+    def _tokenize_text_segment(self, text, speaker):
+        text_tokens = self._text_tokenizer.encode(f"[{speaker}]{text}")
+        text_frame = torch.zeros(len(text_tokens), 33).long()
+        text_frame_mask = torch.zeros(len(text_tokens), 33).bool()
+        text_frame[:, -1] = torch.tensor(text_tokens)
+        text_frame_mask[:, -1] = True
+        return text_frame.to(self.device), text_frame_mask.to(self.device)
+
+    def _tokenize_audio(self, audio):
+        assert audio.ndim == 1, "Audio must be single channel"
+        audio_tokens = self._audio_tokenizer.encode(audio.unsqueeze(0).unsqueeze(0))[0]
+        eos_frame = torch.zeros(audio_tokens.size(0), 1).long()
+        audio_tokens = torch.cat([audio_tokens, eos_frame], dim=1)
+
+        audio_frame = torch.zeros(audio_tokens.size(1), 33).long()
+        audio_frame_mask = torch.zeros(audio_tokens.size(1), 33).bool()
+        audio_frame[:, :-1] = audio_tokens.transpose(0, 1)
+        audio_frame_mask[:, :-1] = True
+        return audio_frame.to(self.device), audio_frame_mask.to(self.device)
+
+    def _tokenize_segment(self, segment):
+        text_tokens, text_masks = self._tokenize_text_segment(segment.text, segment.speaker)
+        audio_tokens, audio_masks = self._tokenize_audio(segment.audio)
+        return torch.cat([text_tokens, audio_tokens], dim=0), torch.cat([text_masks, audio_masks], dim=0)
+
+
+def load_csm_1b(device="cuda"):
+    model = Model(ModelArgs())
+    model.to(device=device)
+    return Generator(model)
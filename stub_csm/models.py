@@ -0,0 +1,239 @@
+"""
+Deterministic stand-in for the CSM ``models`` module (``Model`` and ``ModelArgs``).
+
+Each text token yields ``FRAMES_PER_TOKEN`` audio frames before EOS, and
+``STUB_CSM_FRAME_COST_MS`` sets how long every frame takes to generate. The
+cost is slept off, unless ``STUB_CSM_FRAME_BUSY=1`` spends it running small
+tensor ops, which loads the CPU and the GIL the way the real decoder does.
+``STUB_CSM_DECODE_COST_MS`` and ``STUB_CSM_WATERMARK_COST_MS`` do the same
+for decoding and watermarking each frame's audio.
+"""
+import os
+import time
+from dataclasses import dataclass
+
+import torch
+import torch.nn as nn
+
+NUM_CODEBOOKS = 32
+FRAMES_PER_TOKEN = int(os.environ.get("STUB_CSM_FRAMES_PER_TOKEN", "3"))
+FRAME_COST_MS = float(os.environ.get("STUB_CSM_FRAME_COST_MS", "0"))
+FRAME_BUSY = os.environ.get("STUB_CSM_FRAME_BUSY", "0") == "1"
+DECODE_COST_MS = float(os.environ.get("STUB_CSM_DECODE_COST_MS", "0"))
+WATERMARK_COST_MS = float(os.environ.get("STUB_CSM_WATERMARK_COST_MS", "0"))
+
+
+def _burn(seconds):
+    """Keep the CPU busy for ``seconds`` with the kind of small-op loop the real decoder runs"""
+    deadline = time.perf_counter() + seconds
+    x = torch.full((32, 32), 0.01)
+    while time.perf_counter() < deadline:
+        x = torch.tanh(x @ x)
+
+
+def spend(seconds):
+    """Take ``seconds``, burning CPU if ``STUB_CSM_FRAME_BUSY=1`` and sleeping otherwise"""
+    if seconds <= 0:
+        return
+    if FRAME_BUSY:
+        _burn(seconds)
+    else:
+        time.sleep(seconds)
+
+
+@dataclass
+class ModelArgs:
+    backbone_flavor: str = "llama-1B"
+    decoder_flavor: str = "llama-100M"
+    text_vocab_size: int = 128256
+    audio_vocab_size: int = 2051
+    audio_num_codebooks: int = NUM_CODEBOOKS
+
+
+class KVCache(nn.Module):
+    """Same layout and bookkeeping as torchtune's KVCache"""
+
+    def __init__(self, batch_size, max_seq_len, num_kv_heads=1, head_dim=4, dtype=torch.float32):
+        super().__init__()
+        cache_shape = (batch_size, num_kv_heads, max_seq_len, head_dim)
+        self.register_buffer("k_cache", torch.zeros(cache_shape, dtype=dtype), persistent=False)
+        self.register_buffer("v_cache", torch.zeros(cache_shape, dtype=dtype), persistent=False)
+        self.register_buffer("cache_pos", torch.arange(0, cache_shape[2]), persistent=False)
+        self.batch_size = batch_size
+
+    def reset(self):
+        self.k_cache.zero_()
+        self.v_cache.zero_()
+        self.cache_pos -= self.size
+
+    @property
+    def size(self):
+        return self.cache_pos[0].item()
+
+    def update(self, k_val, v_val):
+        bsz, _, seq_len, _ = k_val.shape
+        if bsz > self.k_cache.shape[0]:
+            raise ValueError(f"The size of the cache is {self.k_cache.shape[0]}, but got batch size {bsz}")
+        assert (self.cache_pos[0] + seq_len) <= self.k_cache.shape[2]
+        self.k_cache[:, :, self.cache_pos[:seq_len]] = k_val
+        self.v_cache[:, :, self.cache_pos[:seq_len]] = v_val
+        self.cache_pos.add_(seq_len)
+        return self.k_cache, self.v_cache
+
+
+class _Attention(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.kv_cache = None
+
+    def setup_cache(self, batch_size, dtype, max_seq_len):
+        # Like torchtune's MultiHeadAttention, an existing cache is kept whatever its batch size
+        if self.kv_cache is not None:
+            return
+        self.kv_cache = KVCache(batch_size, max_seq_len, dtype=dtype)
+
+
+class _Layer(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.attn = _Attention()
+        # Stands in for the layer's projections, so quantization has linear layers to replace
+        self.mlp = nn.Linear(4, 4)
+
+
+class _RotaryEmbedding(nn.Module):
+    """
+    Like torchtune's RoPE: a derived, non-persistent cache rebuilt by ``rope_init``.
+
+    As in torchtune, ``rope_init`` does nothing on the meta device, and using
+    the module before its cache is built raises.
+    """
+
+    def __init__(self, dim=4, max_seq_len=2048):
+        super().__init__()
+        self.dim = dim
+        self.max_seq_len = max_seq_len
+        self.is_cache_built = False
+        self.rope_init()
+
+    def rope_init(self):
+        theta = 1.0 / (10_000 ** (torch.arange(0, self.dim, 2).float() / self.dim))
+        if theta.is_meta:
+            return
+        self.register_buffer("cache", torch.outer(torch.arange(self.max_seq_len).float(), theta), persistent=False)
+        self.is_cache_built = True
+
+    def forward(self, x):
+        if not self.is_cache_built:
+            raise RuntimeError("RoPE cache is not built. Please call rope_init() first.")
+        return x
+
+
+class _Backbone(nn.Module):
+    def __init__(self, num_layers=2):
+        super().__init__()
+        self.layers = nn.ModuleList([_Layer() for _ in range(num_layers)])
+        self.rope = _RotaryEmbedding()
+
+    def setup_caches(self, batch_size, dtype, max_seq_len=2048):
+        for layer in self.layers:
+            layer.attn.setup_cache(batch_size, dtype, max_seq_len)
+
+    def caches_are_enabled(self):
+        return self.layers[0].attn.kv_cache is not None
+
+    def reset_caches(self):
+        for layer in self.layers:
+            layer.attn.kv_cache.reset()
+
+    def forward(self, entry, input_pos=None, mask=None):
+        """Cache each new position's entry and return which cache slots the last position attends to"""
+        entry = self.rope(entry)
+        for layer in self.layers:
+            layer.attn.kv_cache.update(entry, entry)
+        size = self.layers[0].attn.kv_cache.size
+        return mask[:, -1, :size]
+
+
+def _create_causal_mask(seq_len):
+    return torch.tril(torch.ones(seq_len, seq_len, dtype=torch.bool))
+
+
+def _index_causal_mask(mask, input_pos):
+    """(max_seq_len, max_seq_len) causal mask -> (batch_size, seq_len, max_seq_len) rows for ``input_pos``"""
+    return mask[input_pos, :]
+
+
+class Model(nn.Module):
+    """
+    Stub of the CSM backbone/decoder model.
+
+    The KV cache stores each position's summed text token and a text-token
+    flag, so a row's output depends only on its own unpadded history. Like
+    the real backbone, the output also depends on how many positions the
+    attention mask lets the row see, so padding that is not masked out
+    changes a batched row's audio. With the padding masked, results are
+    identical whether a prompt runs alone, in a padded batch or on top of a
+    restored prompt cache.
+    """
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.projection = nn.Linear(4, 4)
+        self.backbone = _Backbone()
+        self.decoder = nn.ModuleList([_Layer()])
+
+    def setup_caches(self, max_batch_size):
+        dtype = next(self.parameters()).dtype
+        self.backbone.setup_caches(max_batch_size, dtype)
+        self.register_buffer("backbone_causal_mask", _create_causal_mask(2048), persistent=False)
+
+    def reset_caches(self):
+        self.backbone.reset_caches()
+
+    def generate_frame(self, tokens, tokens_mask, input_pos, temperature, topk):
+        b, s, _ = tokens.size()
+        assert self.backbone.caches_are_enabled(), "backbone caches are not enabled"
+        kv_cache = self.backbone.layers[0].attn.kv_cache
+        if kv_cache.k_cache.shape[0] != b:
+            raise RuntimeError(f"KV cache holds batch size {kv_cache.k_cache.shape[0]}, got {b}")
+
+        # Record what every new position contributes: (is_text, token value, is_audio)
+        entry = torch.zeros(b, 1, s, 4, dtype=kv_cache.k_cache.dtype)
+        entry[:, 0, :, 0] = tokens_mask[:, :, -1].float()
+        entry[:, 0, :, 1] = (tokens[:, :, -1] * tokens_mask[:, :, -1]).float()
+        entry[:, 0, :, 2] = tokens_mask[:, :, 0].float()
+        # Stands in for attention: every visible slot, padding included, adds to the softmax normaliser
+        visible = self.backbone(entry, input_pos=input_pos, mask=_index_causal_mask(self.backbone_causal_mask, input_pos))
+
+        history = kv_cache.k_cache[:, 0, :kv_cache.size]
+        num_text = history[:, :, 0].sum(dim=1)
+        token_sum = history[:, :, 1].sum(dim=1)
+        # Frames generated after the last text token belong to the current utterance
+        last_text = (history[:, :, 0] > 0).float() * torch.arange(1, history.size(1) + 1)
+        generated = kv_cache.size - last_text.max(dim=1).values
+
+        spend(FRAME_COST_MS / 1000.0)
+
+        # Utterance length scales with the number of tokens in the final text segment
+        seed = (token_sum + generated + visible.sum(dim=1)).long()
+        sample = (seed.unsqueeze(1) + torch.arange(NUM_CODEBOOKS)) % 2000 + 1
+        text_tokens = _last_text_run(history[:, :, 0])
+        sample[generated >= text_tokens * FRAMES_PER_TOKEN] = 0
+        return sample.long()
+
+
+def _last_text_run(is_text):
+    """Length of the final contiguous run of text positions in each row"""
+    counts = []
+    for row in is_text.tolist():
+        count, seen = 0, False
+        for flag in reversed(row):
+            if flag:
+                count += 1
+                seen = True
+            elif seen:
+                break
+        counts.append(count)
+    return torch.tensor(counts)
@@ -0,0 +1,16 @@
+"""
+Stand-in for the CSM ``watermarking`` module; returns audio unchanged.
+"""
+from models import WATERMARK_COST_MS, spend
+
+SAMPLES_PER_FRAME = 1920
+CSM_1B_GH_WATERMARK = [212, 211, 146, 56, 201]
+
+
+def load_watermarker(device="cuda"):
+    return None
+
+
+def watermark(watermarker, audio_array, sample_rate, watermark_key):
+    spend(audio_array.shape[-1] / SAMPLES_PER_FRAME * WATERMARK_COST_MS / 1000.0)
+    return audio_array, sample_rate
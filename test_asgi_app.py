@@ -0,0 +1,35 @@
+from starlette.testclient import TestClient
+
+
+def test_asgi_app_serves_the_flask_api(wait_for):
+    # Imports the server, so it has to load after conftest has set up the stubs and directories
+    import asgi_app
+
+    with TestClient(asgi_app.app) as client:
+        wait_for(lambda: client.get('/readyz').status_code == 200)
+
+        job_id = client.post('/synthesize', json={'text': 'Hello there.'}).json()['job_id']
+        with client.stream('GET', f'/job/{job_id}/events') as events:
+            body = ''.join(events.iter_text())
+        assert 'event: progress' in body
+        assert body.rstrip().split('\n\n')[-1].startswith('event: completed')
+        assert client.get(f'/job/{job_id}').json()['status'] == 'completed'
+
+        full = client.get(f'/job/{job_id}?download=true')
+        assert full.status_code == 200
+        assert full.headers['content-type'] == 'audio/wav'
+        partial = client.get(f'/job/{job_id}?download=true', headers={'Range': 'bytes=0-99'})
+        assert partial.status_code == 206
+        assert partial.content == full.content[:100]
+
+        # Routes without a native handler are answered by the Flask app
+        assert client.get('/voices').status_code == 200
+        assert client.post('/cleanup', json={'job_ids': [job_id]}).json()['cleaned'] == 1
+        assert client.get(f'/job/{job_id}').status_code == 404
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_asgi_app_serves_the_flask_api(conftest.wait_until)
+    print("ASGI app tests passed")
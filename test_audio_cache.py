@@ -0,0 +1,99 @@
+import os
+import tempfile
+
+from audio_cache import AudioCache, make_cache_key
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = AudioCache(memory_budget_bytes=20, disk_budget_bytes=0, disk_dir=tempfile.mkdtemp())
+    cache.put('a', b'a' * 10)
+    cache.put('b', b'b' * 10)
+    assert cache.get('a') == b'a' * 10
+
+    # 'b' is now the least recently used entry, so it makes room for 'c'
+    cache.put('c', b'c' * 10)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['memory_bytes'] == 20
+
+    # An entry over the whole budget is not stored at all
+    cache.put('big', b'x' * 21)
+    assert cache.get('big') is None
+    assert cache.stats()['memory_entries'] == 2
+
+
+def test_disk_tier_keeps_its_budget_and_refills_memory():
+    disk_dir = tempfile.mkdtemp()
+    cache = AudioCache(memory_budget_bytes=10, disk_budget_bytes=25, disk_dir=disk_dir)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key.encode() * 10)
+
+    stats = cache.stats()
+    assert stats['disk_entries'] == 2 and stats['disk_bytes'] == 20
+    assert sorted(os.listdir(disk_dir)) == ['b.bin', 'c.bin']
+    assert stats['memory_entries'] == 1
+
+    # A disk hit is promoted back into memory
+    assert cache.get('b') == b'b' * 10
+    assert cache.stats()['hits'] == 1
+    assert cache.get('a') is None and cache.stats()['misses'] == 1
+
+
+def test_disk_tier_is_trimmed_to_budget_at_startup():
+    disk_dir = tempfile.mkdtemp()
+    cache = AudioCache(memory_budget_bytes=0, disk_budget_bytes=100, disk_dir=disk_dir)
+    for age, key in enumerate(('old', 'middle', 'new')):
+        cache.put(key, b'x' * 10)
+        os.utime(os.path.join(disk_dir, f'{key}.bin'), (1000 + age, 1000 + age))
+
+    restarted = AudioCache(memory_budget_bytes=0, disk_budget_bytes=20, disk_dir=disk_dir)
+    assert sorted(os.listdir(disk_dir)) == ['middle.bin', 'new.bin']
+    assert restarted.get('new') == b'x' * 10
+    assert restarted.get('old') is None
+
+
+def test_cache_key_covers_what_changes_the_audio():
+    key = make_cache_key('Hello  there.', 0, 1.0, 0.9, 50, 'csm-1b/cpu/bf16')
+    assert key == make_cache_key('Hello there.', 0, 1.0, 0.9, 50, 'csm-1b/cpu/bf16')
+    assert key != make_cache_key('Hello there.', 1, 1.0, 0.9, 50, 'csm-1b/cpu/bf16')
+    assert key != make_cache_key('Hello there.', 0, 1.0, 0.9, 50, 'csm-1b/cpu/int8')
+    assert key != make_cache_key('Hello there.', 0, 1.0, 0.9, 50, 'csm-1b/cpu/bf16', seed=1)
+
+
+def test_server_uses_the_cache_only_when_asked(server, wait_for):
+    client = server.app.test_client()
+
+    def synthesize(body):
+        response = client.post('/synthesize', json=body).json
+        wait_for(lambda: client.get(f"/job/{response['job_id']}").json['status'] == 'completed')
+        return response
+
+    # Without "cache" (or a seed) sampling stays fresh every time
+    body = {'text': 'The cache is opt in.'}
+    synthesize(body)
+    assert not synthesize(body).get('cached')
+
+    body = {'text': 'Remember this one, please.', 'cache': True}
+    assert not synthesize(body).get('cached')
+    assert synthesize(body)['cached']
+
+    # Audio spilled to disk stays there rather than being read back into the cache
+    threshold = server.result_store.spill_threshold_bytes
+    server.result_store.spill_threshold_bytes = 1024
+    try:
+        body = {'text': 'Too big to keep in memory.', 'cache': True}
+        assert not synthesize(body).get('cached')
+        assert not synthesize(body).get('cached')
+    finally:
+        server.result_store.spill_threshold_bytes = threshold
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_memory_tier_evicts_least_recently_used()
+    test_disk_tier_keeps_its_budget_and_refills_memory()
+    test_disk_tier_is_trimmed_to_budget_at_startup()
+    test_cache_key_covers_what_changes_the_audio()
+    test_server_uses_the_cache_only_when_asked(conftest.load_server(), conftest.wait_until)
+    print("Audio cache tests passed")
@@ -0,0 +1,72 @@
+import torch
+
+from audio_effects import TimeStretcher, apply_speed, stretched_length, time_stretch
+
+SAMPLE_RATE = 24000
+
+
+def tone(frequency, seconds):
+    t = torch.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return 0.5 * torch.sin(2 * torch.pi * frequency * t)
+
+
+def dominant_frequency(audio):
+    spectrum = torch.fft.rfft(audio * torch.hann_window(audio.shape[0])).abs()
+    return spectrum.argmax().item() * SAMPLE_RATE / audio.shape[0]
+
+
+def test_speed_changes_tempo_but_not_pitch():
+    audio = tone(220, 2.0)
+    for speed in (0.5, 0.8, 1.25, 2.0):
+        stretched = apply_speed(audio, SAMPLE_RATE, speed)
+        assert stretched.shape[0] == stretched_length(audio.shape[0], speed)
+        assert abs(dominant_frequency(stretched) - 220) < 2
+        # Loudness is kept, away from the edges
+        middle = stretched[SAMPLE_RATE // 10:-SAMPLE_RATE // 10]
+        assert abs(middle.abs().max().item() - 0.5) < 0.02
+
+
+def test_batched_clips_match_single_clips():
+    clips = [tone(180, 1.5), tone(300, 0.4), torch.randn(500) * 0.1]
+    batched = time_stretch(clips, SAMPLE_RATE, 1.3)
+    for clip, stretched in zip(clips, batched):
+        assert torch.allclose(stretched, apply_speed(clip, SAMPLE_RATE, 1.3), atol=1e-5)
+
+
+
+def stretch_in_chunks(audio, speed, chunk_size):
+    stretcher = TimeStretcher(SAMPLE_RATE, speed)
+    return torch.cat([stretcher.process(chunk) for chunk in audio.split(chunk_size)] + [stretcher.flush()])
+
+
+def test_chunked_stretch_has_no_seams():
+    audio = tone(220, 2.0)
+    for speed in (0.5, 0.8, 1.25, 2.0):
+        whole = apply_speed(audio, SAMPLE_RATE, speed)
+        # The largest step between neighbouring samples; a click is a much larger one
+        smooth_step = whole.diff().abs().max()
+        for chunk_size in (777, 2000, SAMPLE_RATE):
+            chunked = stretch_in_chunks(audio, speed, chunk_size)
+            assert chunked.shape == whole.shape
+            assert torch.allclose(chunked, whole, atol=1e-3)
+            assert chunked.diff().abs().max() < smooth_step + 1e-3
+
+        # Stretching every chunk on its own jumps at the joins
+        naive = torch.cat([apply_speed(chunk, SAMPLE_RATE, speed) for chunk in audio.split(2000)])
+        assert naive.diff().abs().max() > smooth_step * 5
+
+
+def test_stretcher_handles_short_and_unit_speed_input():
+    for length in (0, 100, 600):
+        audio = torch.randn(length) * 0.1
+        assert stretch_in_chunks(audio, 1.3, 50).shape[0] == stretched_length(length, 1.3)
+    audio = tone(220, 0.5)
+    assert torch.equal(stretch_in_chunks(audio, 1.0, 1000), audio)
+
+
+if __name__ == "__main__":
+    test_speed_changes_tempo_but_not_pitch()
+    test_batched_clips_match_single_clips()
+    test_chunked_stretch_has_no_seams()
+    test_stretcher_handles_short_and_unit_speed_input()
+    print("Audio effects tests passed")
@@ -0,0 +1,72 @@
+import io
+
+import numpy as np
+import soundfile as sf
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from audio_encoding import DEFAULT_FORMAT, FORMATS, encode_audio, mimetype_for, negotiate_format, transcode
+
+SAMPLE_RATE = 24000
+
+
+def accept(header):
+    return parse_accept_header(header, MIMEAccept)
+
+
+def test_explicit_format_wins_over_accept_header():
+    assert negotiate_format('FLAC', accept('audio/ogg')) == 'flac'
+    assert negotiate_format(None, accept('audio/flac')) == 'flac'
+    assert negotiate_format(None, accept('audio/ogg;q=0.5, audio/flac;q=0.9')) == 'flac'
+
+    # No preference, or one nothing matches, falls back to the canonical WAV
+    assert negotiate_format(None, None) == DEFAULT_FORMAT
+    assert negotiate_format(None, accept('*/*')) == DEFAULT_FORMAT
+    assert negotiate_format(None, accept('text/html')) == DEFAULT_FORMAT
+
+
+def test_unknown_format_is_rejected():
+    try:
+        negotiate_format('aiff')
+        assert False, 'an unknown format should raise'
+    except ValueError as e:
+        assert 'aiff' in str(e)
+
+
+def test_every_format_round_trips():
+    t = np.arange(SAMPLE_RATE // 2) / SAMPLE_RATE
+    audio = (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    stored = encode_audio(audio, SAMPLE_RATE, DEFAULT_FORMAT)
+
+    for name in FORMATS:
+        decoded, sample_rate = sf.read(io.BytesIO(transcode(stored, name)), dtype='float32')
+        assert sample_rate == SAMPLE_RATE, name
+        # Lossy codecs add priming or padding, so only compare the start of the signal
+        assert abs(len(decoded) - len(audio)) < SAMPLE_RATE // 10, name
+        if name in ('wav', 'wav16', 'flac'):
+            assert np.abs(decoded - audio).max() < 1e-3, name
+
+
+def test_download_formats(server, wait_for):
+    client = server.app.test_client()
+    job_id = client.post('/synthesize', json={'text': 'Any format you like.'}).json['job_id']
+    wait_for(lambda: client.get(f'/job/{job_id}').json['status'] == 'completed')
+
+    response = client.get(f'/job/{job_id}?download=true&format=flac', headers={'Accept': 'audio/ogg'})
+    assert response.status_code == 200 and response.mimetype == mimetype_for('flac')
+    response = client.get(f'/job/{job_id}?download=true', headers={'Accept': 'audio/flac'})
+    assert response.mimetype == mimetype_for('flac')
+    assert response.headers['Vary'] == 'Accept'
+
+    response = client.get(f'/job/{job_id}?download=true&format=aiff')
+    assert response.status_code == 400 and 'aiff' in response.json['error']
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_explicit_format_wins_over_accept_header()
+    test_unknown_format_is_rejected()
+    test_every_format_round_trips()
+    test_download_formats(conftest.load_server(), conftest.wait_until)
+    print("Audio encoding tests passed")
@@ -0,0 +1,91 @@
+import io
+import json
+import os
+import tempfile
+
+import soundfile as sf
+
+from batch_synthesize import BatchSynthesizer, Journal, load_manifest
+from batching import BatchingEngine
+from csm_generator import load_csm_generator
+
+ENTRIES = [
+    {'text': "Hello there.", 'output': "clips/hello.wav"},
+    {'text': "Your call is important to us.", 'speaker': 1, 'speed': 1.25, 'output': "clips/call.flac"},
+    {'text': "Please stay on the line.", 'seed': 3, 'output': "clips/line.wav"},
+]
+
+
+def write_manifest(directory, entries):
+    path = os.path.join(directory, 'manifest.jsonl')
+    with open(path, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+    return path
+
+
+def run(generator, manifest_path):
+    synthesizer = BatchSynthesizer(
+        generator, engine=BatchingEngine(lambda: generator, max_batch_size=4, max_wait_ms=50), workers=4
+    )
+    journal = Journal(manifest_path + '.journal')
+    out = io.StringIO()
+    try:
+        throughput = synthesizer.run(load_manifest(manifest_path), journal, out=out)
+    finally:
+        journal.close()
+    return throughput, out.getvalue()
+
+
+def test_run_resumes_and_skips_finished_outputs():
+    generator = load_csm_generator(device="cpu")
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest_path = write_manifest(tmp, ENTRIES)
+        throughput, _ = run(generator, manifest_path)
+        assert throughput.done == 3 and throughput.failed == 0
+        for entry in ENTRIES:
+            info = sf.info(os.path.join(tmp, entry['output']))
+            assert info.samplerate == generator.sample_rate and info.frames > 0
+        # Nothing but the outputs is left behind
+        assert sorted(os.listdir(os.path.join(tmp, 'clips'))) == ['call.flac', 'hello.wav', 'line.wav']
+
+        # A rerun only redoes outputs that changed on disk or whose entry changed
+        with open(os.path.join(tmp, 'clips/hello.wav'), 'ab') as f:
+            f.write(b'corrupt')
+        edited = ENTRIES[:2] + [dict(ENTRIES[2], text="Please hold the line.")]
+        manifest_path = write_manifest(tmp, edited)
+        throughput, out = run(generator, manifest_path)
+        assert out.startswith("1 of 3 entries already done, 2 to go")
+        assert throughput.done == 2
+
+        throughput, out = run(generator, manifest_path)
+        assert out.startswith("3 of 3 entries already done, 0 to go")
+
+
+def test_manifest_rejects_bad_entries():
+    with tempfile.TemporaryDirectory() as tmp:
+        bad_manifests = (
+            [ENTRIES[0], ENTRIES[0]],
+            [{'text': "Hi.", 'output': "hi.xyz"}],
+            [{'output': "a.wav"}],
+            [{'text': 42, 'output': "a.wav"}],
+            [{'text': "Hi.", 'output': ["a.wav"]}],
+            [{'text': "Hi.", 'output': "a.wav", 'speaker': "narrator"}],
+            [{'text': "Hi.", 'output': "a.wav", 'speed': 5}],
+            [["Hi.", "a.wav"]],
+        )
+        for entries in bad_manifests:
+            try:
+                load_manifest(write_manifest(tmp, entries))
+            except ValueError as e:
+                assert "manifest.jsonl:" in str(e)
+            else:
+                raise AssertionError(f"{entries} was accepted")
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_run_resumes_and_skips_finished_outputs()
+    test_manifest_rejects_bad_entries()
+    print("Batch synthesis tests passed")
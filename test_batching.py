@@ -0,0 +1,198 @@
+import threading
+
+import torch
+
+from batching import BatchingEngine
+from csm_generator import load_csm_generator
+
+TEXTS = [
+    "Hello there.",
+    "This sentence is quite a bit longer than the first one.",
+    "Short.",
+    "Your call is important to us, please stay on the line.",
+]
+
+
+def test_batch_matches_sequential():
+    generator = load_csm_generator(device="cpu")
+
+    sequential = [generator.generate(text=text, speaker=0, context=[]) for text in TEXTS]
+    batched = generator.generate_batch([{'text': text, 'speaker': 0} for text in TEXTS])
+
+    for single, batch in zip(sequential, batched):
+        # Each row stops on its own EOS frame, so lengths differ per request
+        assert single.shape == batch.shape
+        assert torch.allclose(single, batch)
+    assert len({audio.shape[0] for audio in batched}) > 1
+
+
+def test_padding_does_not_leak_into_rows():
+    generator = load_csm_generator(device="cpu")
+    requests = [{'text': text, 'speaker': 0} for text in TEXTS]
+    sequential = [generator.generate(text=text, speaker=0) for text in TEXTS]
+
+    # Without the padding mask, shorter rows attend to their padding and their audio changes
+    key_padding = generator._key_padding
+    generator._key_padding = lambda key_valid: key_padding(None)
+    try:
+        unmasked = generator.generate_batch(requests)
+    finally:
+        generator._key_padding = key_padding
+    assert not all(
+        single.shape == batch.shape and torch.allclose(single, batch) for single, batch in zip(sequential, unmasked)
+    )
+
+    for single, batch in zip(sequential, generator.generate_batch(requests)):
+        assert single.shape == batch.shape and torch.allclose(single, batch)
+
+
+def test_progress_reports_every_frame():
+    generator = load_csm_generator(device="cpu")
+    reports = {i: [] for i in range(len(TEXTS))}
+    requests = [
+        {'text': text, 'speaker': 0, 'progress_callback': lambda done, total, i=i: reports[i].append((done, total))}
+        for i, text in enumerate(TEXTS)
+    ]
+    audio = generator.generate_batch(requests)
+
+    for i, request_audio in enumerate(audio):
+        num_frames = request_audio.shape[0] * 1000 // (generator.sample_rate * 80)
+        # One report per frame, plus a closing one when the row stops on EOS
+        done = [report[0] for report in reports[i]]
+        assert done[:num_frames] == list(range(1, num_frames + 1))
+        assert all(report_done < total for report_done, total in reports[i][:-1])
+        assert reports[i][-1] == (num_frames, num_frames)
+
+
+def test_stop_reasons_and_runaway_cutoff():
+    generator = load_csm_generator(device="cpu", runaway_frames=10)
+    model = generator._model._model
+    generate_frame = model.generate_frame
+
+    def stuck_last_row(*args):
+        # The last row never reaches EOS and keeps sampling the same frame
+        sample = generate_frame(*args)
+        sample[-1] = 7
+        return sample
+
+    model.generate_frame = stuck_last_row
+    stops = {}
+    requests = [
+        {'text': TEXTS[0], 'speaker': 0},
+        {'text': TEXTS[1], 'speaker': 0, 'max_audio_length_ms': 5 * 80},
+        {'text': TEXTS[2], 'speaker': 0},
+    ]
+    for i, request in enumerate(requests):
+        request['stop_callback'] = lambda reason, frames, i=i: stops.__setitem__(i, (reason, frames))
+    audio = generator.generate_batch(requests)
+
+    assert stops[0][0] == 'eos'
+    assert stops[1] == ('budget', 5)
+    assert stops[2] == ('runaway', 10)
+    # Only one cycle of the loop is kept
+    assert audio[2].shape[0] == generator.sample_rate * 80 // 1000
+
+
+def test_cancel_stops_a_row_between_frames():
+    generator = load_csm_generator(device="cpu")
+    cancel = threading.Event()
+    stops = {}
+
+    def cancel_after_three(done, total):
+        if done == 3:
+            cancel.set()
+
+    requests = [
+        {'text': TEXTS[1], 'speaker': 0},
+        {'text': TEXTS[3], 'speaker': 0, 'cancel': cancel, 'progress_callback': cancel_after_three},
+    ]
+    for i, request in enumerate(requests):
+        request['stop_callback'] = lambda reason, frames, i=i: stops.__setitem__(i, (reason, frames))
+    audio = generator.generate_batch(requests)
+
+    assert stops[1] == ('cancelled', 3)
+    assert audio[1].shape[0] == 3 * generator.sample_rate * 80 // 1000
+    # The rest of the batch is unaffected
+    assert stops[0][0] == 'eos'
+    assert torch.allclose(audio[0], generator.generate(text=TEXTS[1], speaker=0))
+
+
+def test_engine_groups_concurrent_requests():
+    generator = load_csm_generator(device="cpu")
+    engine = BatchingEngine(lambda: generator, max_batch_size=4, max_wait_ms=200)
+
+    results = {}
+
+    def worker(i):
+        results[i] = engine.generate(text=TEXTS[i], speaker=0)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(TEXTS))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert engine.batches_run == 1
+    for i, text in enumerate(TEXTS):
+        expected = generator.generate(text=text, speaker=0)
+        assert torch.allclose(results[i], expected)
+
+
+def test_engine_separates_sampling_settings():
+    generator = load_csm_generator(device="cpu")
+    engine = BatchingEngine(lambda: generator, max_batch_size=4, max_wait_ms=50)
+
+    futures = [
+        engine.submit(TEXTS[0], 0, temperature=0.9),
+        engine.submit(TEXTS[1], 0, temperature=0.5),
+    ]
+    for future in futures:
+        future.result()
+
+    assert engine.batches_run == 2
+
+
+def test_engine_generates_next_batch_while_decoding():
+    generator = load_csm_generator(device="cpu")
+    engine = BatchingEngine(lambda: generator, max_batch_size=4, max_wait_ms=10)
+
+    # Hold the first batch in post-processing
+    decoding, release = threading.Event(), threading.Event()
+    decode_frames = generator.decode_frames
+
+    def slow_decode(frames, timings=None):
+        decoding.set()
+        release.wait()
+        return decode_frames(frames, timings=timings)
+
+    generator.decode_frames = slow_decode
+    timings = {}
+    first = engine.submit(TEXTS[0], 0, timings=timings)
+    assert decoding.wait(10)
+
+    # The backbone is free, so a second batch runs all its frames meanwhile
+    frames_done = threading.Event()
+    second = engine.submit(
+        TEXTS[1], 0, temperature=0.5, progress_callback=lambda done, total: done == total and frames_done.set()
+    )
+    assert frames_done.wait(10)
+    assert not first.done()
+
+    release.set()
+    assert torch.allclose(first.result(), generator.generate(text=TEXTS[0], speaker=0))
+    second.result()
+    assert set(timings) == {'frames', 'post_wait', 'decode', 'watermark'}
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_batch_matches_sequential()
+    test_padding_does_not_leak_into_rows()
+    test_progress_reports_every_frame()
+    test_stop_reasons_and_runaway_cutoff()
+    test_cancel_stops_a_row_between_frames()
+    test_engine_groups_concurrent_requests()
+    test_engine_separates_sampling_settings()
+    test_engine_generates_next_batch_while_decoding()
+    print("Batching tests passed")
@@ -0,0 +1,77 @@
+import threading
+import time
+
+from job_queue import JobQueue
+
+
+def test_queue_runs_interactive_first_and_drops_missed_deadlines(wait_for):
+    gate = threading.Event()
+    ran, expired = [], []
+
+    def handler(job_id):
+        if job_id == 'blocker':
+            gate.wait()
+        ran.append(job_id)
+
+    queue = JobQueue(handler, on_expired=expired.append)
+    queue.submit('blocker')
+    wait_for(lambda: queue.stats()['running'] == 1)
+    queue.submit('bulk', priority='bulk')
+    queue.submit('late', deadline=time.time() + 0.05)
+    queue.submit('too-slow', deadline=time.time() + 60, expected_seconds=120)
+    queue.submit('interactive')
+    queue.submit('gone', priority='bulk')
+    assert queue.position('interactive') == 2 and queue.position('bulk') == 3
+    assert queue.cancel('gone') and not queue.cancel('gone')
+
+    time.sleep(0.1)
+    gate.set()
+    wait_for(lambda: len(ran) == 3)
+    assert ran == ['blocker', 'interactive', 'bulk']
+    assert sorted(expired) == ['late', 'too-slow']
+    assert queue.stats()['expired'] == 2 and queue.stats()['cancelled'] == 1
+
+
+def test_delete_cancels_jobs_but_keeps_runs_others_share(server, wait_for):
+    client = server.app.test_client()
+    avoided = server.audio_avoided_counter.value(reason='cancelled')
+
+    # Hold the first job at the model while the rest are submitted and cancelled
+    gate = threading.Event()
+    acquire_generator = server.acquire_generator
+    server.acquire_generator = lambda: gate.wait() and acquire_generator()
+    try:
+        running = client.post('/synthesize', json={'text': 'Cancel me once I have started.'}).json['job_id']
+        wait_for(lambda: client.get(f'/job/{running}').json['started_at'] is not None)
+        queued = client.post('/synthesize', json={'text': 'Cancel me while I wait.'}).json['job_id']
+        shared = client.post('/synthesize', json={'text': 'Two callers want this one.'}).json['job_id']
+        follower = client.post('/synthesize', json={'text': 'Two callers want this one.'}).json['job_id']
+
+        for job_id in (running, queued, shared):
+            assert client.delete(f'/job/{job_id}').json['status'] == 'cancelled'
+            assert client.get(f'/job/{job_id}').json['status'] == 'cancelled'
+        assert server.job_queue.position(queued) is None
+        # The follower still wants the shared run, so it carries on
+        assert not server.active_jobs[shared]['cancel'].is_set()
+    finally:
+        gate.set()
+        server.acquire_generator = acquire_generator
+
+    wait_for(lambda: client.get(f'/job/{follower}').json['status'] == 'completed')
+    assert client.get(f'/job/{follower}?download=true').status_code == 200
+    assert server.result_store.get(shared) is None
+    # The queued job was never generated and the running one stopped before its first frame
+    assert server.audio_avoided_counter.value(reason='cancelled') > avoided
+
+    # Deleting a finished job removes it
+    assert client.delete(f'/job/{follower}').json['status'] == 'deleted'
+    assert client.get(f'/job/{follower}').status_code == 404
+    assert client.delete(f'/job/{follower}').status_code == 404
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_queue_runs_interactive_first_and_drops_missed_deadlines(conftest.wait_until)
+    test_delete_cancels_jobs_but_keeps_runs_others_share(conftest.load_server(), conftest.wait_until)
+    print("Cancellation tests passed")
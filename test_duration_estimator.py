@@ -0,0 +1,28 @@
+from duration_estimator import DurationEstimator, spoken_chars
+
+
+def test_budget_tracks_each_voice():
+    estimator = DurationEstimator(seconds_per_char=0.08, margin=1.5, slack_ms=1000, max_ms=20_000)
+    text = "Hello there, how are you?"
+    assert spoken_chars(text) == 19 + 2 + 4
+
+    default_budget = estimator.budget_ms(text, "speaker:0")
+    assert abs(default_budget - (25 * 0.08 * 1.5 * 1000 + 1000)) < 1e-6
+
+    # A slow voice gets a longer budget; the others keep the default
+    for _ in range(10):
+        estimator.observe(text, "speaker:1", 25 * 0.12 * 1000)
+    assert abs(estimator.ratio("speaker:1") - 0.12) < 1e-9
+    assert estimator.budget_ms(text, "speaker:1") > default_budget
+    assert estimator.budget_ms(text, "speaker:0") == default_budget
+
+    # One absurd observation is clipped instead of wrecking the calibration
+    estimator.observe(text, "speaker:1", 0)
+    assert estimator.ratio("speaker:1") > 0.1
+
+    assert estimator.budget_ms("word " * 1000, "speaker:0") == 20_000
+
+
+if __name__ == "__main__":
+    test_budget_tracks_each_voice()
+    print("Duration estimator tests passed")
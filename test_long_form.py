@@ -0,0 +1,126 @@
+import os
+import tempfile
+
+import soundfile as sf
+import torch
+
+from audio_effects import stretched_length
+from csm_generator import load_csm_generator, max_text_tokens, prompt_token_limit
+from long_form import LongFormSynthesizer, split_text
+from voice_profiles import VoiceProfile
+
+
+def test_split_text_keeps_sentences_and_bounds_length():
+    text = "First sentence. Second one! " + "A very long clause, " * 30 + "end."
+    segments = split_text(text, max_chars=80)
+
+    assert segments[0] == "First sentence."
+    assert segments[1] == "Second one!"
+    assert all(len(segment) <= 80 for segment in segments)
+    assert " ".join(segments).split() == text.split()
+
+
+def test_long_form_writes_every_segment():
+    generator = load_csm_generator(device="cpu")
+    synthesizer = LongFormSynthesizer(generator, crossfade_ms=10)
+    text = " ".join(f"Sentence number {i} is here." for i in range(12))
+    progress = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "long.wav")
+        samples = synthesizer.synthesize(
+            text, 0, path, progress_callback=lambda done, total: progress.append((done, total))
+        )
+        audio, sample_rate = sf.read(path)
+
+    # Each crossfade overlaps two segments, shortening the total by one fade
+    single = generator.generate(text="Sentence number 0 is here.", speaker=0).shape[0]
+    assert samples == audio.shape[0]
+    assert samples == 12 * single - 11 * int(sample_rate * 10 / 1000)
+    assert progress[-1] == (12, 12)
+
+    # A speed change stretches the stitched audio as one piece
+    with tempfile.TemporaryDirectory() as tmp:
+        fast = synthesizer.synthesize(text, 0, os.path.join(tmp, "fast.wav"), speed=1.25)
+    assert fast == stretched_length(samples, 1.25)
+
+
+def test_segments_get_their_own_budget_and_stop_reason():
+    generator = load_csm_generator(device="cpu")
+    synthesizer = LongFormSynthesizer(generator, crossfade_ms=10)
+    text = "Short one. " + "This second sentence runs on for quite a bit longer than the first."
+    stops = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthesizer.synthesize(
+            text, 0, os.path.join(tmp, "long.wav"),
+            budget_ms=lambda segment: 400 if segment.startswith("This") else 60_000,
+            stop_callback=lambda segment, reason, frames: stops.append((segment, reason, frames)),
+        )
+
+    # The long sentence is cut at its five-frame budget; the short one is capped at max_segment_ms and ends on EOS
+    assert [(segment, reason) for segment, reason, _ in stops] == [
+        ("Short one.", "eos"), (split_text(text)[1], "budget")
+    ]
+    assert stops[1][2] == 5
+
+
+def long_voice(prompt_tokens):
+    """A voice profile whose prompt is ``prompt_tokens`` text rows long"""
+    tokens = torch.zeros(prompt_tokens, 33, dtype=torch.long)
+    tokens_mask = torch.zeros(prompt_tokens, 33, dtype=torch.bool)
+    tokens[:, -1] = 1
+    tokens_mask[:, -1] = True
+    return VoiceProfile.from_tokens('long', 0, tokens, tokens_mask)
+
+
+def test_context_is_dropped_when_the_voice_prompt_leaves_no_room():
+    generator = load_csm_generator(device="cpu")
+    synthesizer = LongFormSynthesizer(generator, crossfade_ms=10)
+    sentence = "Sentence number 0 is here."
+    # Room for the voice prompt and one sentence, but not the previous sentence as context
+    voice = long_voice(prompt_token_limit(synthesizer.max_segment_ms) - max_text_tokens(sentence, 0) - 5)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = synthesizer.synthesize(" ".join([sentence] * 3), 0, os.path.join(tmp, "long.wav"), voice=voice)
+    assert samples > 0
+
+
+def test_server_rejects_prompts_that_cannot_fit(server):
+    server.check_prompt_length("Short enough.", 0, long_voice(100))
+    try:
+        server.check_prompt_length("Short enough.", 0, long_voice(prompt_token_limit(server.MAX_AUDIO_LENGTH_MS)))
+    except ValueError as e:
+        assert "shorter voice prompt" in str(e)
+    else:
+        raise AssertionError("a prompt longer than the model's sequence was accepted")
+
+    # Long text only needs its longest segment to fit
+    server.check_prompt_length("A sentence of a document. " * 400, 0, long_voice(1000))
+
+
+def test_server_runs_long_form_segments_on_their_own_budgets(server, wait_for):
+    client = server.app.test_client()
+    text = " ".join(f"Paragraph sentence number {i} is right here." for i in range(12))
+    segments = split_text(text, server.LONG_FORM_SEGMENT_CHARS)
+
+    def stops():
+        return sum(server.generation_stops.value(reason=reason) for reason in ('eos', 'budget', 'runaway'))
+
+    before = stops()
+    job_id = client.post('/synthesize', json={'text': text}).json['job_id']
+    wait_for(lambda: client.get(f'/job/{job_id}').json['status'] == 'completed')
+    # Every segment reported why it stopped, as a short request does
+    assert stops() - before == len(segments)
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_split_text_keeps_sentences_and_bounds_length()
+    test_long_form_writes_every_segment()
+    test_segments_get_their_own_budget_and_stop_reason()
+    test_context_is_dropped_when_the_voice_prompt_leaves_no_room()
+    test_server_rejects_prompts_that_cannot_fit(conftest.load_server())
+    test_server_runs_long_form_segments_on_their_own_budgets(conftest.load_server(), conftest.wait_until)
+    print("Long-form tests passed")
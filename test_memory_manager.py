@@ -0,0 +1,38 @@
+from memory_manager import MemoryManager, current_rss
+
+
+def test_reclaims_only_above_the_high_water_mark():
+    manager = MemoryManager(rss_high_water_bytes=current_rss() * 100)
+    assert manager.pressure_reason() is None
+    assert not manager.maybe_reclaim()
+    stats = manager.stats()
+    assert stats['checks'] == 1 and stats['reclaims'] == 0 and stats['last_reclaim_reason'] is None
+
+    # Any process is over a one-byte mark
+    manager.rss_high_water_bytes = 1
+    assert manager.pressure_reason() == 'rss'
+    assert manager.maybe_reclaim()
+    stats = manager.stats()
+    assert stats['checks'] == 2 and stats['reclaims'] == 1
+    assert stats['last_reclaim_reason'] == 'rss' and stats['reclaim_seconds_total'] > 0
+
+    # Back under the mark, checks stop reclaiming again
+    manager.rss_high_water_bytes = current_rss() * 100
+    assert not manager.maybe_reclaim()
+    assert manager.stats()['reclaims'] == 1
+
+
+def test_manual_reclaim_is_counted():
+    # A zero mark turns the RSS check off
+    manager = MemoryManager(rss_high_water_bytes=0)
+    assert not manager.maybe_reclaim()
+    manager.reclaim('reconfigure')
+    stats = manager.stats()
+    assert stats['reclaims'] == 1 and stats['last_reclaim_reason'] == 'reconfigure'
+    assert stats['rss_high_water_mb'] is None and stats['rss_freed_mb'] >= 0
+
+
+if __name__ == "__main__":
+    test_reclaims_only_above_the_high_water_mark()
+    test_manual_reclaim_is_counted()
+    print("Memory manager tests passed")
@@ -0,0 +1,70 @@
+from metrics import Registry
+
+
+def test_counter_and_gauge_text_format():
+    registry = Registry()
+    requests = registry.counter('tts_requests_total', 'Synthesis requests by outcome', labelnames=['outcome'])
+    registry.gauge('tts_queue_depth', 'Jobs waiting for an inference worker', fn=lambda: 3)
+    requests.inc(outcome='completed')
+    requests.inc(2, outcome='completed')
+    requests.inc(outcome='error')
+
+    assert requests.value(outcome='completed') == 3.0
+    assert registry.render().splitlines() == [
+        '# HELP tts_requests_total Synthesis requests by outcome',
+        '# TYPE tts_requests_total counter',
+        'tts_requests_total{outcome="completed"} 3.0',
+        'tts_requests_total{outcome="error"} 1.0',
+        '# HELP tts_queue_depth Jobs waiting for an inference worker',
+        '# TYPE tts_queue_depth gauge',
+        'tts_queue_depth 3.0',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    counter = registry.counter('odd_total', 'Odd labels', labelnames=['value'])
+    counter.inc(value='say "hi"\\\nbye')
+    assert 'odd_total{value="say \\"hi\\"\\\\\\nbye"} 1.0' in registry.render().splitlines()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    stages = registry.histogram('tts_stage_seconds', 'Stage time', buckets=(0.1, 1), labelnames=['stage'])
+    for value in (0.05, 0.1, 0.5, 3):
+        stages.observe(value, stage='generate')
+
+    assert stages.mean(stage='generate') == (0.05 + 0.1 + 0.5 + 3) / 4
+    assert stages.mean(stage='encode') is None
+    assert registry.render().splitlines() == [
+        '# HELP tts_stage_seconds Stage time',
+        '# TYPE tts_stage_seconds histogram',
+        'tts_stage_seconds_bucket{stage="generate",le="0.1"} 2',
+        'tts_stage_seconds_bucket{stage="generate",le="1.0"} 3',
+        'tts_stage_seconds_bucket{stage="generate",le="+Inf"} 4',
+        'tts_stage_seconds_sum{stage="generate"} 3.65',
+        'tts_stage_seconds_count{stage="generate"} 4',
+    ]
+
+
+def test_metrics_endpoint(server, wait_for):
+    client = server.app.test_client()
+    job_id = client.post('/synthesize', json={'text': 'Count this one.'}).json['job_id']
+    wait_for(lambda: client.get(f'/job/{job_id}').json['status'] == 'completed')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert '# TYPE tts_stage_seconds histogram' in text
+    assert 'tts_stage_seconds_count{stage="generate"}' in text
+    assert 'tts_requests_total{outcome="completed"}' in text
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_counter_and_gauge_text_format()
+    test_label_values_are_escaped()
+    test_histogram_buckets_are_cumulative()
+    test_metrics_endpoint(conftest.load_server(), conftest.wait_until)
+    print("Metrics tests passed")
@@ -0,0 +1,99 @@
+import gzip
+import io
+import json
+import marshal
+import os
+import pstats
+import tempfile
+import time
+
+from profiling import JobProfiler
+
+
+def run_job(client, text, wait_for):
+    job_id = client.post('/synthesize', json={'text': text}).json['job_id']
+    wait_for(lambda: client.get(f'/job/{job_id}').json['status'] in ('completed', 'error'))
+    assert client.get(f'/job/{job_id}').json['status'] == 'completed'
+    # The capture is written just after the job reports completion
+    wait_for(lambda: client.get('/profile').json['profiling_job'] is None)
+    return job_id
+
+
+def test_armed_profiler_captures_the_next_jobs(server, wait_for):
+    client = server.app.test_client()
+    server.job_profiler.keep = 2
+    assert client.post('/profile', json={}).status_code == 400
+
+    # Not armed: nothing is captured
+    run_job(client, 'Nobody is watching this one.', wait_for)
+    assert client.get('/profile').json['captures'] == []
+
+    status = client.post('/profile', json={'jobs': 3}).json
+    assert status['armed']['jobs_left'] == 3
+    job_ids = [run_job(client, f'Profiled request number {i}.', wait_for) for i in range(3)]
+    status = client.get('/profile').json
+    assert status['armed'] is None
+
+    # Only the newest captures are kept, newest first
+    captures = status['captures']
+    assert [c['job_id'] for c in captures] == job_ids[:0:-1]
+    assert len(os.listdir(server.job_profiler.directory)) == 2 * 3
+
+    trace = client.get(captures[0]['files']['trace'])
+    assert trace.status_code == 200
+    assert json.loads(gzip.decompress(trace.data))['traceEvents']
+
+    # The sampled Python profile loads with pstats
+    stats = marshal.loads(client.get(captures[0]['files']['pstats']).data)
+    with tempfile.NamedTemporaryFile(suffix='.pstats') as f:
+        marshal.dump(stats, f)
+        f.flush()
+        pstats.Stats(f.name, stream=io.StringIO()).print_stats()
+    assert captures[0]['python_samples'] > 0
+
+    assert client.get(f"/profile/{captures[0]['id']}/nope").status_code == 404
+    assert client.get('/profile/unknown/trace').status_code == 404
+
+    # Captures on disk are picked up again after a restart
+    reloaded = JobProfiler(server.job_profiler.directory, keep=2)
+    assert [c['id'] for c in reloaded.stats()['captures']] == [c['id'] for c in captures]
+
+
+def test_jobs_that_cannot_be_profiled_are_refused(server):
+    client = server.app.test_client()
+    response = client.post('/profile', json={'jobs': 1, 'job_type': 'stream'})
+    assert response.status_code == 409 and 'not profiled' in response.json['error']
+    assert client.post('/profile', json={'jobs': 1, 'job_type': 'nonsense'}).status_code == 400
+    assert client.get('/profile').json['armed'] is None
+
+
+def test_concurrent_jobs_are_listed_in_the_capture():
+    profiler = JobProfiler(tempfile.mkdtemp())
+    profiler.arm(jobs=1)
+    capture = profiler.start('profiled')
+    # Jobs batched with the profiled one are recorded, even once the armed count has run out
+    assert profiler.start('batched') is None
+    profiler.finish(capture)
+    assert profiler.stats()['captures'][0]['concurrent_jobs'] == ['batched']
+    assert profiler.start('later') is None
+
+
+def test_time_window_and_disarm(server):
+    client = server.app.test_client()
+    assert client.post('/profile', json={'seconds': 60}).json['armed']['until'] is not None
+    assert client.delete('/profile').json['armed'] is None
+
+    profiler = JobProfiler(tempfile.mkdtemp())
+    profiler.arm(seconds=0.01)
+    time.sleep(0.05)
+    assert profiler.start('late') is None
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_armed_profiler_captures_the_next_jobs(conftest.load_server(), conftest.wait_until)
+    test_jobs_that_cannot_be_profiled_are_refused(conftest.load_server())
+    test_concurrent_jobs_are_listed_in_the_capture()
+    test_time_window_and_disarm(conftest.load_server())
+    print("Profiling tests passed")
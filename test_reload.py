@@ -0,0 +1,41 @@
+def test_reload_switches_models_without_failing_running_jobs(server, wait_for):
+    client = server.app.test_client()
+    server.load_model_in_background()
+    wait_for(lambda: client.get('/readyz').status_code == 200)
+
+    # Stands in for a job that is still running on the current model
+    old = server.acquire_generator()
+    response = client.post('/memory-settings', json={'device': 'cpu', 'quantization': 'int8'})
+    assert response.status_code == 202
+    reload_url = response.headers['Location']
+
+    wait_for(lambda: client.get(reload_url).json['phase'] == 'draining')
+    assert client.get(reload_url).json['draining_jobs'] == 1
+    assert server.current_generator is not old
+    assert server.current_generator.quantization_method is not None
+    assert client.post('/memory-settings', json={'quantization': 'none'}).status_code == 409
+
+    # New jobs run on the new model while the old one drains
+    job_id = client.post('/synthesize', json={'text': 'Hello there.'}).json['job_id']
+    wait_for(lambda: client.get(f'/job/{job_id}').json['status'] in ('completed', 'error'))
+    assert client.get(f'/job/{job_id}').json['status'] == 'completed'
+    assert client.get(reload_url).json['phase'] == 'draining'
+
+    server.release_generator(old)
+    wait_for(lambda: client.get(reload_url).json['phase'] == 'completed')
+    reload = client.get(reload_url).json
+    assert set(reload['timings']) == {'load_model', 'warm_up', 'drain'}
+    status = client.get('/status').json
+    assert status['quantization'] == 'int8'
+    assert status['reload'] is None
+
+    # Settings that match the serving model do not reload it
+    assert client.post('/memory-settings', json={'device': 'cpu', 'quantization': 'int8'}).status_code == 200
+    assert client.get('/memory-settings/reload/unknown').status_code == 404
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_reload_switches_models_without_failing_running_jobs(conftest.load_server(), conftest.wait_until)
+    print("Reload tests passed")
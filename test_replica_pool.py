@@ -0,0 +1,143 @@
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+
+import torch
+
+from csm_generator import load_csm_generator
+from replica_pool import ReplicaCrashedError, ReplicaPool, ReplicaStartError
+
+TEXTS = [
+    "Hello there.",
+    "This sentence is quite a bit longer than the first one.",
+    "Short.",
+    "Your call is important to us, please stay on the line.",
+]
+
+
+def test_replicas_match_in_process_generation():
+    generator = load_csm_generator(device="cpu")
+    pool = ReplicaPool(2, threads_per_replica=1, generator_options={'device': 'cpu'})
+    try:
+        results = {}
+
+        def worker(i):
+            results[i] = pool.generate(text=TEXTS[i], speaker=0)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(TEXTS))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i, text in enumerate(TEXTS):
+            assert torch.allclose(results[i], generator.generate(text=text, speaker=0))
+        streamed = torch.cat(list(pool.generate_stream(text=TEXTS[1], speaker=0, chunk_frames=5)))
+        assert torch.allclose(streamed, generator.generate(text=TEXTS[1], speaker=0))
+
+        # Long-form segment budgets are worked out here, and stop reasons come back per segment
+        stops = []
+        with tempfile.TemporaryDirectory() as directory:
+            pool.synthesize_long_form(
+                " ".join(TEXTS), 0, os.path.join(directory, 'long.wav'),
+                budget_ms=lambda segment: 400 if segment == TEXTS[1] else 20_000,
+                stop_callback=lambda segment, reason, frames: stops.append((segment, reason, frames)),
+            )
+        assert [segment for segment, _, _ in stops] == TEXTS
+        assert stops[1][1:] == ('budget', 5) and stops[0][1] == 'eos'
+        # Both replicas took part
+        assert all(replica['dispatched'] > 0 for replica in pool.stats()['replicas'])
+    finally:
+        pool.shutdown()
+
+
+def test_crashed_replica_is_restarted():
+    # Slow frames so the request is still running when its replica is killed
+    os.environ['STUB_CSM_FRAME_COST_MS'] = '50'
+    try:
+        pool = ReplicaPool(1, threads_per_replica=1, generator_options={'device': 'cpu'})
+    finally:
+        del os.environ['STUB_CSM_FRAME_COST_MS']
+    try:
+        pool.sample_rate  # wait until the model is loaded
+        errors = []
+
+        def worker():
+            try:
+                pool.generate(text=TEXTS[1], speaker=0)
+            except ReplicaCrashedError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        while not pool.stats()['replicas'][0]['in_flight']:
+            time.sleep(0.01)
+        pool._replicas[0].process.kill()
+        thread.join()
+
+        assert len(errors) == 1
+        assert pool.generate(text=TEXTS[2], speaker=0).shape[0] > 0
+        assert pool.stats()['replicas'][0]['restarts'] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_pool_gives_up_on_replicas_that_cannot_load():
+    # Every load fails with a TypeError, so each replica exits straight after starting
+    pool = ReplicaPool(
+        2, threads_per_replica=1, generator_options={'device': 'cpu', 'no_such_option': True}, max_start_failures=2
+    )
+    try:
+        try:
+            pool.sample_rate
+            assert False, 'a pool with no loadable replica should raise'
+        except ReplicaStartError as e:
+            assert 'no_such_option' in str(e)
+        try:
+            pool.wait_ready()
+            assert False, 'a pool with no loadable replica should raise'
+        except ReplicaStartError:
+            pass
+        try:
+            pool.generate(text=TEXTS[0], speaker=0)
+            assert False, 'a pool with no loadable replica should raise'
+        except ReplicaStartError:
+            pass
+        assert all(replica['gave_up'] and replica['restarts'] == 1 for replica in pool.stats()['replicas'])
+    finally:
+        pool.shutdown()
+
+
+def test_replicas_do_not_import_the_main_module():
+    # The script that starts the pool counts how often it is imported
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        script = os.path.join(directory, 'main_with_side_effects.py')
+        with open(script, 'w') as f:
+            f.write(textwrap.dedent(f'''
+                import sys
+                sys.path[:0] = [{here!r}, {os.path.join(here, 'stub_csm')!r}]
+                print('imported', flush=True)
+
+                if __name__ == '__main__':
+                    from replica_pool import ReplicaPool
+                    pool = ReplicaPool(1, threads_per_replica=1, generator_options={{'device': 'cpu'}})
+                    assert pool.wait_ready(60)
+                    pool.shutdown()
+            '''))
+        output = subprocess.run([sys.executable, script], capture_output=True, text=True, timeout=120, check=True)
+    assert output.stdout.split() == ['imported']
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_replicas_match_in_process_generation()
+    test_crashed_replica_is_restarted()
+    test_pool_gives_up_on_replicas_that_cannot_load()
+    test_replicas_do_not_import_the_main_module()
+    print("Replica pool tests passed")
@@ -0,0 +1,98 @@
+import time
+
+from werkzeug.http import parse_range_header
+
+from result_store import ResultStore
+
+
+def test_small_results_stay_in_memory_and_large_ones_spill():
+    store = ResultStore(spill_threshold_bytes=16)
+    small = store.put('small', b'a' * 16)
+    large = store.put('large', b'b' * 17)
+
+    assert not small.spilled and small.tobytes() == b'a' * 16
+    assert large.spilled and large.tobytes() == b'b' * 17
+    stats = store.stats()
+    assert stats['memory_bytes'] == 16 and stats['spilled_bytes'] == 17
+
+
+def test_put_file_takes_ownership_of_the_file():
+    store = ResultStore(spill_threshold_bytes=4)
+    path = store.spill_path()
+    with open(path, 'wb') as f:
+        f.write(b'0123456789')
+
+    result = store.put_file('job', path)
+    assert result.spilled
+    assert b''.join(result.iter_range(2, 6, chunk_size=3)) == b'2345'
+    try:
+        open(path, 'rb')
+        assert False, 'the spilled file should be unlinked once mapped'
+    except FileNotFoundError:
+        pass
+
+
+def test_delete_and_ttl_expiry():
+    store = ResultStore(ttl_seconds=60)
+    result = store.put('job', b'audio')
+    store.link('coalesced', result)
+    assert store.stats()['results'] == 2 and store.stats()['memory_bytes'] == 5
+
+    assert store.delete('coalesced')
+    assert not store.delete('coalesced')
+    assert store.get('job') is result
+
+    # Results older than the TTL go on the next expiry pass
+    result.created_at = time.time() - 61
+    store.expire()
+    assert store.get('job') is None
+
+
+def test_range_requests(server):
+    result = ResultStore().put('job', bytes(range(100)))
+
+    def plan(header):
+        return server.plan_download(result, 'speech.wav', parse_range_header(header) if header else None)
+
+    start, end, status, headers = plan(None)
+    assert (start, end, status) == (0, 100, 200) and headers['Content-Length'] == '100'
+
+    start, end, status, headers = plan('bytes=10-19')
+    assert (start, end, status) == (10, 20, 206)
+    assert headers['Content-Range'] == 'bytes 10-19/100' and headers['Content-Length'] == '10'
+
+    # Open-ended and suffix ranges
+    assert plan('bytes=90-')[:3] == (90, 100, 206)
+    start, end, status, headers = plan('bytes=-5')
+    assert (start, end, status) == (95, 100, 206) and headers['Content-Range'] == 'bytes 95-99/100'
+
+    # A range past the end cannot be satisfied
+    start, end, status, headers = plan('bytes=200-300')
+    assert status == 416 and headers['Content-Range'] == 'bytes */100'
+
+
+def test_download_honours_range(server, wait_for):
+    client = server.app.test_client()
+    job_id = client.post('/synthesize', json={'text': 'Send me a slice.'}).json['job_id']
+    wait_for(lambda: client.get(f'/job/{job_id}').json['status'] == 'completed')
+
+    whole = client.get(f'/job/{job_id}?download=true').data
+    response = client.get(f'/job/{job_id}?download=true', headers={'Range': 'bytes=-100'})
+    assert response.status_code == 206 and response.data == whole[-100:]
+
+    response = client.get(f'/job/{job_id}?download=true', headers={'Range': f'bytes={len(whole)}-'})
+    assert response.status_code == 416
+
+    assert client.delete(f'/job/{job_id}').status_code == 200
+    assert client.get(f'/job/{job_id}?download=true').status_code == 404
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_small_results_stay_in_memory_and_large_ones_spill()
+    test_put_file_takes_ownership_of_the_file()
+    test_delete_and_ttl_expiry()
+    test_range_requests(conftest.load_server())
+    test_download_honours_range(conftest.load_server(), conftest.wait_until)
+    print("Result store tests passed")
@@ -0,0 +1,49 @@
+import threading
+
+
+def test_identical_requests_share_one_run(server, wait_for):
+    client = server.app.test_client()
+    coalesced_before = server.single_flight.coalesced
+
+    # Hold the first run at the model so the others arrive while it is in flight
+    gate = threading.Event()
+    acquire_generator = server.acquire_generator
+    server.acquire_generator = lambda: gate.wait() and acquire_generator()
+    try:
+        body = {'text': 'Attention please, the train is delayed.', 'voice': 'SPEAKER_1'}
+        first = client.post('/synthesize', json=body).json
+        second = client.post('/synthesize', json=body).json
+        third = client.post('/synthesize', json=body).json
+        other = client.post('/synthesize', json=dict(body, speed=1.2)).json
+        assert 'coalesced' not in first and 'coalesced' not in other
+        assert second['coalesced'] and third['coalesced']
+        assert len({first['job_id'], second['job_id'], third['job_id']}) == 3
+        assert server.single_flight.stats()['waiting'] == 2
+    finally:
+        gate.set()
+        server.acquire_generator = acquire_generator
+
+    job_ids = [first['job_id'], second['job_id'], third['job_id'], other['job_id']]
+    wait_for(lambda: all(client.get(f'/job/{j}').json['status'] == 'completed' for j in job_ids))
+    assert client.get(f"/job/{second['job_id']}").json['coalesced']
+
+    # Coalesced jobs hold the same stored result rather than copies of it
+    results = [server.result_store.get(j) for j in job_ids[:3]]
+    assert results[0] is results[1] is results[2]
+    assert server.result_store.get(other['job_id']) is not results[0]
+
+    # Cleaning up one job leaves the audio of the others in place
+    client.post('/cleanup', json={'job_ids': [first['job_id']]})
+    download = client.get(f"/job/{second['job_id']}?download=true")
+    assert download.status_code == 200 and download.data == results[0].tobytes()
+
+    status = client.get('/status').json['coalescing']
+    assert status['coalesced'] - coalesced_before == 2
+    assert status['in_flight'] == 0
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_identical_requests_share_one_run(conftest.load_server(), conftest.wait_until)
+    print("Single-flight tests passed")
@@ -0,0 +1,62 @@
+import tempfile
+
+import torch
+
+from csm_generator import load_csm_generator
+
+
+def test_snapshot_restores_the_loaded_model():
+    with tempfile.TemporaryDirectory() as tmp:
+        first = load_csm_generator(device="cpu", snapshot_dir=tmp)
+        second = load_csm_generator(device="cpu", snapshot_dir=tmp)
+
+        assert not first.loaded_from_snapshot
+        assert 'save_snapshot' in first.load_timings
+        assert second.loaded_from_snapshot
+
+        first_state = first._model._model.state_dict()
+        second_state = second._model._model.state_dict()
+        assert first_state.keys() == second_state.keys()
+        for name in first_state:
+            assert torch.equal(first_state[name], second_state[name])
+        # Buffers that are not saved are rebuilt rather than left on the meta device
+        assert not any(buffer.is_meta for buffer in second._model._model.buffers())
+        # The RoPE table is rebuilt too, though rope_init registers nothing on the meta device
+        assert second._model._model.backbone.rope.is_cache_built
+
+        second.warm_up()
+        assert torch.equal(first.generate("Hello there.", 0), second.generate("Hello there.", 0))
+
+
+def test_unusable_snapshot_falls_back_to_a_full_load():
+    with tempfile.TemporaryDirectory() as tmp:
+        generator = load_csm_generator(device="cpu", snapshot_dir=tmp)
+        with open(generator._snapshot_path(), 'wb') as f:
+            f.write(b'not a snapshot')
+
+        reloaded = load_csm_generator(device="cpu", snapshot_dir=tmp)
+        assert not reloaded.loaded_from_snapshot
+        # The broken file was replaced by a fresh snapshot
+        assert load_csm_generator(device="cpu", snapshot_dir=tmp).loaded_from_snapshot
+
+
+def test_int8_mode_quantizes_from_the_shared_snapshot():
+    with tempfile.TemporaryDirectory() as tmp:
+        full = load_csm_generator(device="cpu", snapshot_dir=tmp)
+        quantized = load_csm_generator(device="cpu", snapshot_dir=tmp, quantization="int8")
+
+        assert quantized.loaded_from_snapshot
+        assert quantized.model_id != full.model_id
+        model = quantized._model._model
+        modules = list(model.backbone.modules()) + list(model.decoder.modules())
+        assert not any(type(module) is torch.nn.Linear for module in modules)
+        assert torch.equal(full.generate("Hello there.", 0), quantized.generate("Hello there.", 0))
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_snapshot_restores_the_loaded_model()
+    test_unusable_snapshot_falls_back_to_a_full_load()
+    test_int8_mode_quantizes_from_the_shared_snapshot()
+    print("Startup tests passed")
@@ -0,0 +1,57 @@
+import torch
+
+from audio_effects import stretched_length
+from csm_generator import load_csm_generator
+
+TEXT = "Thanks for calling, all of our agents are currently busy."
+
+
+def test_stream_matches_full_generation():
+    generator = load_csm_generator(device="cpu")
+
+    full = generator.generate(text=TEXT, speaker=0)
+    chunks = list(generator.generate_stream(text=TEXT, speaker=0, first_chunk_frames=2, chunk_frames=5))
+
+    assert len(chunks) > 2
+    # First chunk is short to get audio out early
+    assert chunks[0].shape[0] < chunks[1].shape[0]
+    assert torch.allclose(torch.cat(chunks), full)
+
+
+def test_closing_stream_releases_model():
+    generator = load_csm_generator(device="cpu")
+
+    stream = generator.generate_stream(text=TEXT, speaker=0, first_chunk_frames=1)
+    next(stream)
+    stream.close()
+
+    # The lock is free again, so a normal generation can run
+    assert generator.generate(text="Hello.", speaker=0).numel() > 0
+
+
+
+def test_streamed_speed_change_covers_the_whole_text(server):
+    client = server.app.test_client()
+
+    def stream(speed):
+        response = client.post('/synthesize/stream', json={'text': TEXT, 'speed': speed})
+        assert response.status_code == 200
+        # 16-bit samples after the 44-byte header
+        return (len(response.data) - 44) // 2
+
+    # The stretcher carries over between chunks and flushes its tail at the end
+    assert stream(1.25) == stretched_length(stream(1.0), 1.25)
+
+    for speed in (0.2, 3, 'nan'):
+        response = client.post('/synthesize/stream', json={'text': TEXT, 'speed': speed})
+        assert response.status_code == 400 and 'speed' in response.json['error']
+        assert client.post('/synthesize', json={'text': TEXT, 'speed': speed}).status_code == 400
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_stream_matches_full_generation()
+    test_closing_stream_releases_model()
+    test_streamed_speed_change_covers_the_whole_text(conftest.load_server())
+    print("Streaming tests passed")
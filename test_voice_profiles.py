@@ -0,0 +1,58 @@
+import tempfile
+
+import torch
+
+from csm_generator import load_csm_generator
+from voice_profiles import VoiceProfileStore, build_voice_profile
+
+TRANSCRIPT = "This is how I sound when I read."
+
+
+def reference_audio(seconds=2.0, sample_rate=24000):
+    t = torch.arange(int(seconds * sample_rate)) / sample_rate
+    return 0.2 * torch.sin(2 * torch.pi * 180 * t) * torch.linspace(0.2, 1.0, t.shape[0])
+
+
+def test_profile_round_trips_through_disk():
+    generator = load_csm_generator(device="cpu")
+    audio = reference_audio()
+    profile = build_voice_profile(generator, "narrator", 1, [(audio, 24000, TRANSCRIPT)])
+    tokens, tokens_mask = generator.tokenize_reference(TRANSCRIPT, 1, audio)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        VoiceProfileStore(tmp).add(profile)
+        loaded = VoiceProfileStore(tmp).get("narrator")
+
+    assert loaded.key == profile.key
+    assert torch.equal(loaded.tokens, tokens)
+    assert torch.equal(loaded.tokens_mask, tokens_mask)
+
+
+def test_cached_prompt_matches_reference_context():
+    # A stub CSM module, importable once conftest has put the stubs on the path
+    from generator import Segment
+
+    generator = load_csm_generator(device="cpu")
+    audio = reference_audio()
+    profile = build_voice_profile(generator, "narrator", 1, [(audio, 24000, TRANSCRIPT)])
+    context = [Segment(speaker=1, text=TRANSCRIPT, audio=audio)]
+    texts = ["Hello there.", "A slightly longer sentence for the batch."]
+
+    expected = [generator.generate(text=text, speaker=1, context=context) for text in texts]
+    first = generator.generate(text=texts[0], speaker=1, voice=profile)
+    batched = generator.generate_batch([{'text': text, 'speaker': 1, 'voice': profile} for text in texts])
+
+    assert torch.allclose(first, expected[0])
+    for audio_out, audio_expected in zip(batched, expected):
+        assert torch.allclose(audio_out, audio_expected)
+    # The prompt ran through the backbone once and was restored for the later batch
+    assert generator.prefix_cache_stats()['misses'] == 1
+    assert generator.prefix_cache_stats()['hits'] == 1
+
+
+if __name__ == "__main__":
+    import conftest
+
+    test_profile_round_trips_through_disk()
+    test_cached_prompt_matches_reference_context()
+    print("Voice profile tests passed")
@@ -0,0 +1,222 @@
+"""
+Voice profiles: reference clips tokenized once and kept in a compact on-disk format
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+
+import torch
+import torchaudio
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+PROFILE_EXTENSION = '.voice.pt'
+
+# Reference audio has to leave room in the 2048-frame context for the text and the generated audio
+MAX_REFERENCE_SECONDS = 60
+
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class VoiceProfile:
+    """
+    A named voice defined by reference clips and their transcripts.
+
+    The clips are tokenized once into the same prompt rows a ``Segment``
+    context produces. On disk each row is stored as its 32 audio codes
+    (int16) and its text token (int32) plus a text/audio flag, instead of the
+    33-wide int64 matrix and mask the model consumes, which is about 8x
+    smaller. ``key`` changes whenever the tokens do, so it can key caches of
+    anything derived from the prompt.
+    """
+
+    def __init__(self, name, speaker, audio_codes, text_tokens, is_text, description='', num_clips=1):
+        self.name = name
+        self.speaker = speaker
+        self.description = description
+        self.num_clips = num_clips
+        self.audio_codes = audio_codes
+        self.text_tokens = text_tokens
+        self.is_text = is_text
+
+        digest = hashlib.sha256()
+        for tensor in (audio_codes, text_tokens, is_text):
+            digest.update(tensor.numpy().tobytes())
+        self.key = f"{name}:{digest.hexdigest()[:16]}"
+
+        self._tokens = None
+        self._tokens_mask = None
+
+    @classmethod
+    def from_tokens(cls, name, speaker, tokens, tokens_mask, description='', num_clips=1):
+        """Compact prompt rows of shape (num_rows, 33) as produced by the CSM tokenizers"""
+        is_text = tokens_mask[:, -1].clone()
+        return cls(
+            name,
+            speaker,
+            audio_codes=tokens[:, :-1].to(torch.int16),
+            text_tokens=tokens[:, -1].to(torch.int32),
+            is_text=is_text,
+            description=description,
+            num_clips=num_clips,
+        )
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._expand()
+        return self._tokens
+
+    @property
+    def tokens_mask(self):
+        if self._tokens_mask is None:
+            self._expand()
+        return self._tokens_mask
+
+    def _expand(self):
+        """Rebuild the (num_rows, 33) token matrix and mask the model expects"""
+        num_rows = self.is_text.size(0)
+        tokens = torch.zeros(num_rows, 33, dtype=torch.long)
+        tokens_mask = torch.zeros(num_rows, 33, dtype=torch.bool)
+        tokens[:, :-1] = self.audio_codes.long()
+        tokens[:, -1] = self.text_tokens.long()
+        tokens_mask[self.is_text, -1] = True
+        tokens_mask[~self.is_text, :-1] = True
+        self._tokens, self._tokens_mask = tokens, tokens_mask
+
+    @property
+    def num_rows(self):
+        return self.is_text.size(0)
+
+    def info(self):
+        return {
+            'id': self.name,
+            'name': self.description or self.name,
+            'speaker': self.speaker,
+            'clips': self.num_clips,
+            'prompt_tokens': self.num_rows,
+            'custom': True,
+        }
+
+    def save(self, path):
+        torch.save({
+            'version': FORMAT_VERSION,
+            'name': self.name,
+            'speaker': self.speaker,
+            'description': self.description,
+            'num_clips': self.num_clips,
+            'audio_codes': self.audio_codes,
+            'text_tokens': self.text_tokens,
+            'is_text': self.is_text,
+        }, path)
+
+    @classmethod
+    def load(cls, path):
+        data = torch.load(path, map_location='cpu', weights_only=True)
+        if data.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported voice profile version {data.get('version')} in {path}")
+        return cls(
+            data['name'],
+            data['speaker'],
+            audio_codes=data['audio_codes'],
+            text_tokens=data['text_tokens'],
+            is_text=data['is_text'],
+            description=data.get('description', ''),
+            num_clips=data.get('num_clips', 1),
+        )
+
+
+def build_voice_profile(generator, name, speaker, clips, description=''):
+    """
+    Tokenize reference clips into a ``VoiceProfile``.
+
+    ``clips`` is a list of ``(audio, sample_rate, transcript)`` with mono float
+    audio tensors. Raises ValueError for an invalid name, no clips or too much
+    reference audio.
+    """
+    if not NAME_PATTERN.match(name):
+        raise ValueError("Voice names may only contain letters, digits, '-' and '_' (at most 64)")
+    if not clips:
+        raise ValueError("At least one reference clip is required")
+
+    total_seconds = sum(audio.shape[-1] / sample_rate for audio, sample_rate, _ in clips)
+    if total_seconds > MAX_REFERENCE_SECONDS:
+        raise ValueError(f"Reference audio is {total_seconds:.1f}s long, the limit is {MAX_REFERENCE_SECONDS}s")
+
+    tokens, tokens_mask = [], []
+    for audio, sample_rate, transcript in clips:
+        if not transcript.strip():
+            raise ValueError("Every reference clip needs a transcript")
+        audio = audio.float()
+        if sample_rate != generator.sample_rate:
+            audio = torchaudio.functional.resample(audio, orig_freq=sample_rate, new_freq=generator.sample_rate)
+        clip_tokens, clip_tokens_mask = generator.tokenize_reference(transcript, speaker, audio)
+        tokens.append(clip_tokens)
+        tokens_mask.append(clip_tokens_mask)
+
+    return VoiceProfile.from_tokens(
+        name, speaker, torch.cat(tokens, dim=0), torch.cat(tokens_mask, dim=0),
+        description=description, num_clips=len(clips)
+    )
+
+
+class VoiceProfileStore:
+    """Loads every profile in ``directory`` at startup and persists new ones there"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+        if os.path.isdir(directory):
+            self._load_all()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + PROFILE_EXTENSION)
+
+    def _load_all(self):
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(PROFILE_EXTENSION):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                profile = VoiceProfile.load(path)
+            except Exception as e:
+                logger.warning(f"Skipping unreadable voice profile {path}: {str(e)}")
+                continue
+            self._profiles[profile.name] = profile
+        if self._profiles:
+            logger.info(f"Loaded {len(self._profiles)} voice profile(s) from {self.directory}")
+
+    def get(self, name):
+        with self._lock:
+            return self._profiles.get(name)
+
+    def list(self):
+        with self._lock:
+            return list(self._profiles.values())
+
+    def add(self, profile):
+        """Persist a profile, replacing any existing one with the same name"""
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename so a crash never leaves a truncated profile behind
+        tmp_path = self._path(profile.name) + '.tmp'
+        profile.save(tmp_path)
+        os.replace(tmp_path, self._path(profile.name))
+        with self._lock:
+            self._profiles[profile.name] = profile
+
+    def delete(self, name):
+        with self._lock:
+            profile = self._profiles.pop(name, None)
+        if profile is None:
+            return False
+        try:
+            os.unlink(self._path(name))
+        except FileNotFoundError:
+            pass
+        return True